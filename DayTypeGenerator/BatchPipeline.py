@@ -0,0 +1,170 @@
+import FileReader as fr
+import DataCleansing as dc
+import DataSmoothing as ds
+import ProfileCube as pc
+import DayTypeClustering as dtc
+import DayTypeClassifier as dcl
+import Instrumentation as ins
+import KPIsCalculation as kc
+import NetworkDayTypeModel as ndm
+import SummaryReports as sr
+
+# Headless pipeline: only computation and CSV exports, no Streamlit, matplotlib or plotly. The computational steps
+# are shared with the web-app (DayTypeGenerator.py) so that both produce the same results: the results of each measure
+# are computed once into a MeasureResults object, which is then exported and, in the web-app, only sliced by the
+# widgets.
+
+
+class MeasureResults:
+    """
+    Results of the pipeline for one measure (Flow|Speed): the profile cube and the smoothed profiles and, when the
+    clustering is enabled, the clusters and centers of each key, the quality of their clustering, their KPIs and the
+    network model (whose results are computed lazily, see NetworkDayTypeModel). They are read-only once computed.
+    """
+
+    def __init__(self, measureType, profileCube, smoothDF):
+        self.measureType = measureType
+        self.profileCube = profileCube
+        self.smoothDF = smoothDF
+        self.sectionClusterDF = None
+        self.sectionClusterCentersDF = None
+        self.qualityTable = None
+        self.singleKeyKPIs = None
+        self.networkModel = None
+
+
+def individualClustering(smoothDF, argOptions):
+    """
+    Clusters and centers of each single KeyID together with the table of the quality of the clustering of every key,
+    both coming from the same clustering run
+    """
+    clusterings = dtc.profileClusterings(smoothDF, argOptions.numberOfWorkers, argOptions.clusteringBackend,
+                                         argOptions.numberOfProfileClusters)
+    sectionClusterDF, sectionClusterCentersDF = dtc.IndividualDetectorClusteringResult(smoothDF,
+                                                                                        argOptions.numberOfWorkers,
+                                                                                        argOptions.clusteringBackend,
+                                                                                        argOptions.numberOfProfileClusters,
+                                                                                        clusterings)
+
+    return sectionClusterDF, sectionClusterCentersDF, worstClusteredFirst(dtc.clusteringQualityTable(smoothDF,
+                                                                                                     clusterings))
+
+
+def worstClusteredFirst(qualityTable):
+    """
+    The keys whose clustering did not converge come first, then the ones with the lowest silhouette score
+    """
+    return qualityTable.sort_values(['Converged', 'Silhouette'], na_position='last', kind='mergesort').reset_index(
+        drop=True)
+
+
+def individualKPIs(smoothDF, sectionClusterDF, sectionClusterCentersDF, argOptions):
+    """
+    The KPIs of the clusters of each single KeyID, as a single table with a row for each (KeyID, ClusterGroup)
+    """
+    return kc.KPIsTable(smoothDF, sectionClusterDF, sectionClusterCentersDF, argOptions.numberOfWorkers)
+
+
+@ins.instrumented
+def exportIndividualResults(sectionClusterDF, singleKeyKPIs, measureType):
+    sr.writeTable(sr.DetectorClusterSummary(sectionClusterDF), f"Individual_{measureType}_Cluster_Results")
+
+    sr.writeTable(singleKeyKPIs[['KeyID', 'MAE', 'MAPE', 'MSE', 'RMSE']], f"Individual_{measureType}_Cluster_KPIs")
+
+
+@ins.instrumented
+def exportClusteringQuality(qualityTable, measureType):
+    sr.writeTable(qualityTable, f"Individual_{measureType}_Cluster_Quality")
+
+
+@ins.instrumented
+def exportNetworkResults(networkModel, measureType):
+    """
+    Day-type of each date and network-wide KPIs and, when the number of clusters is chosen automatically, the score
+    curve of the numbers of clusters evaluated
+    """
+    sr.writeTable(sr.NetworkClusterSummary(networkModel.clusterResult), f"Network_{measureType}_Cluster_Results")
+
+    sr.writeTable(networkModel.kpis, f"Network_{measureType}_Cluster_KPIs")
+
+    if networkModel.scoreCurve is not None:
+        sr.writeTable(networkModel.scoreCurve, f"Network_{measureType}_Cluster_Selection")
+
+
+def computeSingleMeasure(cleanDataframe, measureType, argOptions):
+    """
+    INPUT notes:
+    - measureType = can be ONLY   Speed|Flow
+    The results of the measure, without exporting them
+    """
+    profileCube = pc.buildProfileCube(cleanDataframe, measureType.lower())
+    results = MeasureResults(measureType, profileCube, ds.smoothDataframe(profileCube, argOptions))
+
+    if not argOptions.enableProfileClustering:
+        return results
+
+    results.sectionClusterDF, results.sectionClusterCentersDF, results.qualityTable = individualClustering(
+        results.smoothDF, argOptions)
+    results.singleKeyKPIs = individualKPIs(results.smoothDF, results.sectionClusterDF,
+                                           results.sectionClusterCentersDF, argOptions)
+
+    if argOptions.enableNetworkClustering:
+        results.networkModel = ndm.buildNetworkModel(results.sectionClusterDF, argOptions)
+
+    return results
+
+
+def exportSingleMeasure(results, argOptions, outlierCap=None):
+    """
+    All the results files of the measure and, when asked, its classifier
+    - outlierCap = the threshold of the outliers of the measure, saved with the classifier
+    """
+    if results.sectionClusterDF is None:
+        return
+
+    exportIndividualResults(results.sectionClusterDF, results.singleKeyKPIs, results.measureType)
+    exportClusteringQuality(results.qualityTable, results.measureType)
+
+    if str(argOptions.clusteringBackendReport) == 'True':
+        sr.writeTable(dtc.clusteringBackendsReport(results.smoothDF, argOptions.numberOfProfileClusters,
+                                                   argOptions.numberOfWorkers),
+                      f"Clustering_Backends_{results.measureType}_Report")
+
+    if results.networkModel is not None:
+        exportNetworkResults(results.networkModel, results.measureType)
+
+    if str(argOptions.exportClassifier) == 'True':
+        model = dcl.buildClassifier(results.smoothDF, results.sectionClusterDF, results.sectionClusterCentersDF,
+                                    results.networkModel, outlierCap, argOptions)
+        dcl.saveClassifier(model, argOptions.modelDirectory, results.measureType)
+        if results.networkModel is not None:
+            ndm.saveNetworkModel(results.networkModel, argOptions.modelDirectory, results.measureType)
+
+
+def processSingleMeasure(cleanDataframe, measureType, argOptions, outlierCap=None):
+    """
+    INPUT notes:
+    - measureType = can be ONLY   Speed|Flow
+    - outlierCap = the threshold of the outliers of the measure, saved with the classifier
+    """
+    exportSingleMeasure(computeSingleMeasure(cleanDataframe, measureType, argOptions), argOptions, outlierCap)
+
+
+def run(argOptions):
+    print("Reading input")
+    df = fr.readInputFile(argOptions)
+
+    print("Cleaning data")
+    cleanDF, cap_flow, cap_speed, pivotKeyDateFlowDF, pivotKeyDateSpeedDF = dc.cleanData(df, argOptions)
+    # the raw data are needed only by the charts of the web-app
+    del df
+
+    if argOptions.flow >= 0:
+        print("Processing Flow")
+        with ins.measureScope('Flow'):
+            processSingleMeasure(cleanDataframe=cleanDF, measureType='Flow', argOptions=argOptions, outlierCap=cap_flow)
+    if argOptions.speed >= 0:
+        print("Processing Speed")
+        with ins.measureScope('Speed'):
+            processSingleMeasure(cleanDataframe=cleanDF, measureType='Speed', argOptions=argOptions,
+                                 outlierCap=cap_speed)
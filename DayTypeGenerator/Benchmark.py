@@ -0,0 +1,238 @@
+import ConfigurableOptions as conf
+import FileReader as fr
+import DataCleansing as dc
+import DataSmoothing as ds
+import ProfileCube as pc
+import DayTypeClustering as dtc
+import KPIsCalculation as kc
+import NetworkDayTypeModel as ndm
+import BatchPipeline as bp
+import StageCache as sc
+import SummaryReports as sr
+import SyntheticData as sd
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+# Benchmark suite of the pipeline stages on synthetic data (see SyntheticData) at several scales. Each stage is run
+# once, timed and, unless disabled, traced by tracemalloc to measure its peak of memory in the same run, so that the
+# exports write their files once. The tracing slows down the stages, so only runs with the same memory setting are
+# comparable. The persistent cache is disabled, every stage is really computed. The results are written as JSON,
+# together with the environment of the run, and can be compared with the ones of a previous run. With more than one
+# worker the memory of the worker processes is not measured, only the one of the main process.
+
+
+def benchmarkOptions(dataFile, resultsDirectory, TimeResolution, numberOfWorkers):
+    """
+    Default options of the pipeline for the layout of the synthetic data, without persistent cache
+    """
+    argOptions = conf.parseArgument(argparse.ArgumentParser(), [])
+    argOptions.headless = 'True'
+    argOptions.inputFile = dataFile
+    argOptions.fileSeparator = ';'
+    argOptions.header = 'True'
+    argOptions.ID1 = 0
+    argOptions.timestamp = 1
+    argOptions.flow = 2
+    argOptions.speed = 3
+    argOptions.TimeResolution = TimeResolution
+    argOptions.numberOfWorkers = numberOfWorkers
+    argOptions.enableProfileClustering = True
+    argOptions.enableNetworkClustering = True
+    argOptions.outputDirectory = resultsDirectory
+    argOptions.cacheDirectory = ""
+
+    return argOptions
+
+
+def measureStage(function, measureMemory):
+    """
+    It returns the result of the function, run once, together with the seconds it took and its peak of memory in MB
+    (None when not measured)
+    """
+    if measureMemory:
+        tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        peakMemoryMB = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if measureMemory else None
+    finally:
+        tracemalloc.stop()
+
+    return result, {"seconds": round(seconds, 6),
+                    "peakMemoryMB": None if peakMemoryMB is None else round(peakMemoryMB, 3)}
+
+
+# ==============================================================================================================
+#                                                    SCALES
+# ==============================================================================================================
+def parseScales(scales):
+    """
+    Scales are given as "KEYSxDAYS" separated by commas, e.g. "10x30,50x90"
+    """
+    result = []
+    for scale in scales.split(","):
+        try:
+            numberOfKeys, numberOfDays = (int(value) for value in scale.lower().split("x"))
+        except ValueError:
+            raise Exception("BENCHMARK ERROR: ", f"scale {scale} is not in the form KEYSxDAYS")
+        result.append((numberOfKeys, numberOfDays))
+
+    return result
+
+
+def benchmarkScale(numberOfKeys, numberOfDays, args, workDirectory):
+    """
+    Stages of the pipeline of a single measure on the synthetic data of numberOfKeys keys over numberOfDays days
+    """
+    dataFile = os.path.join(workDirectory, f"synthetic_{numberOfKeys}x{numberOfDays}.csv")
+    data = sd.generateDetectorData(numberOfKeys, numberOfDays, args.TimeResolution, seed=args.seed)
+    sd.writeDetectorData(data, dataFile)
+    numberOfRows = len(data.index)
+    del data
+
+    argOptions = benchmarkOptions(dataFile, os.path.join(workDirectory, "Results"), args.TimeResolution,
+                                  args.numberOfWorkers)
+    sc.configure(argOptions)
+    sr.configure(argOptions)
+    measure = args.measure
+    numberOfClusters = argOptions.KmeansNumberOfFlowCluster if measure == 'Flow' \
+        else argOptions.KmeansNumberOfSpeedCluster
+    memory = not args.noMemory
+
+    stages = {}
+    df, stages["readInputFile"] = measureStage(lambda: fr.readInputFile(argOptions), memory)
+    cleaned, stages["cleanData"] = measureStage(lambda: dc.cleanData(df, argOptions), memory)
+    cleanDF = cleaned[0]
+    del df, cleaned
+    profileCube, stages["buildProfileCube"] = measureStage(lambda: pc.buildProfileCube(cleanDF, measure.lower()),
+                                                           memory)
+    smoothDF, stages["smoothDataframe"] = measureStage(lambda: ds.smoothDataframe(profileCube, argOptions), memory)
+    _, stages["similarityMatrix"] = measureStage(lambda: [dtc.similarityMatrix(df) for df in smoothDF.values()],
+                                                 memory)
+    (sectionClusterDF, centersDF), stages["IndividualDetectorClusteringResult"] = measureStage(
+        lambda: dtc.IndividualDetectorClusteringResult(smoothDF, argOptions.numberOfWorkers,
+                                                       argOptions.clusteringBackend,
+                                                       argOptions.numberOfProfileClusters), memory)
+    # the per-cluster KPIs of every key, computed by KPIsTable for all the KPI types at once
+    singleKeyKPIs, stages["KPI"] = measureStage(
+        lambda: kc.KPIsTable(smoothDF, sectionClusterDF, centersDF, argOptions.numberOfWorkers), memory)
+    similarity, stages["networkSimilarityMatrix"] = measureStage(lambda: dtc.networkSimilarityMatrix(sectionClusterDF),
+                                                                 memory)
+    distance = np.asarray(dtc.networkDistanceMatrix(similarity), dtype=np.float64)
+    labels, stages["networkClustering"] = measureStage(
+        lambda: dtc.networkClusteringLabels(distance, numberOfClusters, argOptions.networkClusteringInits), memory)
+    networkKPIs, stages["NetworkKpisIntegration"] = measureStage(lambda: kc.NetworkKpisIntegration(distance, labels),
+                                                                 memory)
+
+    # the network results already computed are given to the model, so that the export only writes them
+    networkModel = ndm.NetworkDayTypeModel(sectionClusterDF, numberOfClusters)
+    networkModel._similarity, networkModel._distance = similarity, distance
+    networkModel._labels, networkModel._kpis = labels, networkKPIs
+    _, stages["exportIndividualResults"] = measureStage(lambda: bp.exportIndividualResults(sectionClusterDF,
+                                                                                           singleKeyKPIs, measure),
+                                                        memory)
+    _, stages["exportNetworkResults"] = measureStage(lambda: bp.exportNetworkResults(networkModel, measure),
+                                                     memory)
+
+    return {"numberOfKeys": numberOfKeys,
+            "numberOfDays": numberOfDays,
+            "TimeResolution": args.TimeResolution,
+            "numberOfRows": numberOfRows,
+            "stages": stages,
+            "totalSeconds": round(sum(result["seconds"] for result in stages.values()), 6)}
+
+
+def environment():
+    import sklearn
+
+    return {"python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpuCount": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "sklearn": sklearn.__version__}
+
+
+# ==============================================================================================================
+#                                                  COMPARISON
+# ==============================================================================================================
+def compareRuns(previous, current):
+    """
+    Table of the seconds and peak memory of each stage at each scale present in both runs, with the ratio of the
+    current ones over the previous ones
+    """
+    previousScales = {(scale["numberOfKeys"], scale["numberOfDays"], scale["TimeResolution"]): scale
+                      for scale in previous["scales"]}
+    rows = []
+    for scale in current["scales"]:
+        previousScale = previousScales.get((scale["numberOfKeys"], scale["numberOfDays"], scale["TimeResolution"]))
+        if previousScale is None:
+            continue
+        for stageName, result in scale["stages"].items():
+            previousResult = previousScale["stages"].get(stageName)
+            if previousResult is None:
+                continue
+            previousMemory, currentMemory = previousResult["peakMemoryMB"], result["peakMemoryMB"]
+            rows.append([f'{scale["numberOfKeys"]}x{scale["numberOfDays"]}', stageName,
+                         previousResult["seconds"], result["seconds"],
+                         result["seconds"] / previousResult["seconds"] if previousResult["seconds"] > 0 else np.nan,
+                         previousMemory, currentMemory,
+                         currentMemory / previousMemory if previousMemory and currentMemory is not None else np.nan])
+
+    return pd.DataFrame(rows, columns=['Scale', 'Stage', 'PreviousSeconds', 'Seconds', 'SecondsRatio',
+                                       'PreviousPeakMemoryMB', 'PeakMemoryMB', 'PeakMemoryRatio'])
+
+
+def run(args):
+    scales = parseScales(args.scales)
+    workDirectory = tempfile.mkdtemp(prefix="DayTypeBenchmark_")
+    result = {"environment": environment(),
+              "settings": {"scales": args.scales, "TimeResolution": args.TimeResolution, "measure": args.measure,
+                           "numberOfWorkers": args.numberOfWorkers, "seed": args.seed,
+                           "memory": not args.noMemory},
+              "scales": []}
+    try:
+        for numberOfKeys, numberOfDays in scales:
+            print(f"Benchmark of {numberOfKeys} keys x {numberOfDays} days")
+            scaleResult = benchmarkScale(numberOfKeys, numberOfDays, args, workDirectory)
+            for stageName, stageResult in scaleResult["stages"].items():
+                print(f"  {stageName:<36} {stageResult['seconds']:>10.3f} s  {stageResult['peakMemoryMB']} MB")
+            result["scales"].append(scaleResult)
+    finally:
+        shutil.rmtree(workDirectory, ignore_errors=True)
+
+    with open(args.output, 'w') as outputFile:
+        json.dump(result, outputFile, indent=1)
+    print(f"Benchmark results written into {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as previousFile:
+            comparison = compareRuns(json.load(previousFile), result)
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(comparison.to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the Day-Type Generation stages on synthetic data')
+    parser.add_argument('--scales', default="10x30,50x90,100x365",
+                        help="Scales to benchmark as KEYSxDAYS separated by commas")
+    parser.add_argument('--TimeResolution', type=int, default=15, help="Time resolution in minutes")
+    parser.add_argument('--measure', choices=['Flow', 'Speed'], default='Flow', help="Measure to cluster")
+    parser.add_argument('--numberOfWorkers', type=int, default=1, help="Number of worker processes (0 = all CPUs)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument('--noMemory', action='store_true', help="Do not measure the peak memory of the stages")
+    parser.add_argument('--output', default="benchmark.json", help="JSON file of the results")
+    parser.add_argument('--compare', default=None, help="JSON file of a previous run to compare with")
+
+    run(parser.parse_args())
@@ -1,16 +1,51 @@
 import argparse
-import streamlit as st
 import os
 import json
-from PIL import Image
 
 
-def parseArgument(parserObject):
+def parseArgument(parserObject, arguments=None):
     parserObject.add_argument('--GUI',
                               default="False",
                               choices=['False', 'True'],
                               help="Option to enable Streamlit GUI")
 
+    parserObject.add_argument('--headless',
+                              default="False",
+                              choices=['False', 'True'],
+                              help="Option to run the batch pipeline only, without Streamlit and charts")
+
+    parserObject.add_argument('--incrementalUpdate',
+                              default="False",
+                              choices=['False', 'True'],
+                              help="Option to add the new days of the input file to the model saved in the model "
+                                   "directory (the model is fitted on the input file if it does not exist yet)")
+
+    parserObject.add_argument('--modelDirectory',
+                              default="Model",
+                              help="Directory of the model state used by the incremental update")
+
+    parserObject.add_argument('--refit',
+                              default="False",
+                              choices=['False', 'True'],
+                              help="Option to refit the model after the incremental update")
+
+    parserObject.add_argument('--exportClassifier',
+                              default="False",
+                              choices=['False', 'True'],
+                              help="Option to save into the model directory the day-type classifier of the clustering run")
+
+    parserObject.add_argument('--classify',
+                              default="False",
+                              choices=['False', 'True'],
+                              help="Option to label the dates of the input file with the classifier saved into the "
+                                   "model directory")
+
+    parserObject.add_argument('--driftThreshold',
+                              type=float,
+                              default=20.0,
+                              help="Percentage of the new profiles not explained by the clusters, since the last fit, "
+                                   "above which the incremental update refits the model")
+
     parserObject.add_argument('--conf',
                               default=None,
                               help="Option to enable reading from JSON file")
@@ -27,9 +62,13 @@ def parseArgument(parserObject):
 
     parserObject.add_argument('--format',
                               default="csv",
-                              choices=['csv'],
+                              choices=['csv', 'parquet', 'feather'],
                               help="Input file format")
 
+    parserObject.add_argument('--convertToParquet',
+                              default=None,
+                              help="Convert the CSV input file into a Parquet dataset written in this directory, then exit")
+
     parserObject.add_argument('--fileSeparator',
                               default=",",
                               choices=[',', ';', '|'],
@@ -75,6 +114,23 @@ def parseArgument(parserObject):
                               default=1.0,
                               help="Conversion factor to Km/Hour")
 
+    parserObject.add_argument('--memoryBudgetMB',
+                              type=float,
+                              default=0.0,
+                              help="Memory budget in MB for reading the input file in chunks (0 to read it at once)")
+
+    parserObject.add_argument('--keyFilter',
+                              default=None,
+                              help="Comma separated list of the KeyIDs to be read (all of them if not given)")
+
+    parserObject.add_argument('--startDate',
+                              default=None,
+                              help="First date (YYYY-MM-DD) of the data to be read")
+
+    parserObject.add_argument('--endDate',
+                              default=None,
+                              help="Last date (YYYY-MM-DD) of the data to be read")
+
     parserObject.add_argument('--keepFlowZero',
                               type=bool,
                               default=True,
@@ -130,14 +186,103 @@ def parseArgument(parserObject):
                               default=12,
                               help="Define Number of Speed Data Clusters by K-Means Clustering Algorithm")
 
-    args = parserObject.parse_args()
+    parserObject.add_argument('--autoNetworkClusters',
+                              default="False",
+                              help="Choose the number of network clusters with the best silhouette score")
+
+    parserObject.add_argument('--minimumNetworkClusters',
+                              type=int,
+                              default=2,
+                              help="Smallest number of network clusters evaluated by the automatic choice")
+
+    parserObject.add_argument('--maximumNetworkClusters',
+                              type=int,
+                              default=20,
+                              help="Largest number of network clusters evaluated by the automatic choice")
+
+    parserObject.add_argument('--networkClusteringInits',
+                              type=int,
+                              default=10,
+                              help="Number of K-Means initializations for each number of network clusters evaluated")
+
+    parserObject.add_argument('--numberOfWorkers',
+                              type=int,
+                              default=1,
+                              help="Number of worker processes for the per-key clustering (1 = serial, 0 = all CPUs)")
+
+    parserObject.add_argument('--clusteringBackend',
+                              choices=["affinityPropagation", "miniBatchKMeans", "agglomerative", "kMedoids"],
+                              default="affinityPropagation",
+                              help="Algorithm clustering the profiles of each single ID")
+
+    parserObject.add_argument('--numberOfProfileClusters',
+                              type=int,
+                              default=8,
+                              help="Number of clusters of the profiles of each single ID (not used by affinityPropagation)")
+
+    parserObject.add_argument('--clusteringBackendReport',
+                              default="False",
+                              help="Export the timing and quality of every clustering backend on the same profiles")
+
+    parserObject.add_argument('--outputDirectory',
+                              default="Results",
+                              help="Directory where the results are written")
+
+    parserObject.add_argument('--outputFormat',
+                              choices=["csv", "parquet"],
+                              default="csv",
+                              help="Format of the results files")
+
+    parserObject.add_argument('--partitionByKey',
+                              default="False",
+                              help="Write the Parquet results having a KeyID column as datasets partitioned by KeyID")
+
+    parserObject.add_argument('--cacheDirectory',
+                              default="",
+                              help="Directory of the persistent cache of the pipeline stages (empty to disable it)")
+
+    parserObject.add_argument('--cacheSizeMB',
+                              type=float,
+                              default=2048.0,
+                              help="Maximum size in MB of the persistent cache, least recently used entries are deleted "
+                                   "first (0 to disable it)")
+
+    parserObject.add_argument('--profileStoreDirectory',
+                              default="",
+                              help="Directory of the memory-mapped store of the smoothed profiles (empty to keep them "
+                                   "in memory)")
+
+    parserObject.add_argument('--runReport',
+                              default="False",
+                              choices=['False', 'True'],
+                              help="Option to write the run report with the time and memory of each stage beside the "
+                                   "results")
+
+    parserObject.add_argument('--profileStage',
+                              default="",
+                              help="Name of a stage to run under cProfile when the run report is enabled (empty for "
+                                   "none)")
+
+    parserObject.add_argument('--maximumHeatmapCells',
+                              type=int,
+                              default=40000,
+                              help="Maximum number of cells of the heatmaps of the web-app, larger ones are binned")
+
+    # arguments = list of the command line arguments, None to read the ones of the process
+    args = parserObject.parse_args(arguments)
 
     # REMINDER: each new option must be added also under this conditional branch
     if args.GUI == 'True':
+        # Streamlit is imported only by the web-app, headless runs must not load it
+        import streamlit as st
+
+        st.title(parserObject.description)
+        st.sidebar.title("Configuration Panel")
+
         st.sidebar.header("Input File")
         args.inputFile = st.sidebar.text_input('Input Filename', args.inputFile, key="inputfile")
         args.compression = st.sidebar.radio('File compression', ("None", "zip", "gzip", "bz2", "xz"), key="compression")
-        args.format = st.sidebar.selectbox('Input File Format', ("csv",), key="format")
+        args.format = st.sidebar.selectbox('Input File Format', ("csv", "parquet", "feather"), key="format")
         args.fileSeparator = st.sidebar.selectbox('Input File Separator', (",", ";", "|"), key="separator")
         args.header = st.sidebar.radio('Does file have header?', ("False", "True"), key="header")
         args.TimeResolution = int(st.sidebar.text_input('Time Resolution in Minutes', value=args.TimeResolution, key="TimeResolution"))
@@ -149,6 +294,14 @@ def parseArgument(parserObject):
         args.speed = st.sidebar.number_input('Column index Speed', min_value=-1, value=args.speed, key="speed")
         args.flowFactor = float(st.sidebar.text_input('Flow conversion factor to Veh/h', value=args.flowFactor, key="flowFactor"))
         args.speedFactor = float(st.sidebar.text_input('Speed conversion factor to Km/h', value=args.speedFactor, key="speedFactor"))
+        args.memoryBudgetMB = float(st.sidebar.text_input('Reading memory budget in MB (0 = whole file)',
+                                                          value=args.memoryBudgetMB, key="memoryBudgetMB"))
+        args.keyFilter = st.sidebar.text_input('Key IDs to be read (comma separated, empty = all)',
+                                               value=args.keyFilter or "", key="keyFilter")
+        args.startDate = st.sidebar.text_input('First date to be read (YYYY-MM-DD)', value=args.startDate or "",
+                                               key="startDate")
+        args.endDate = st.sidebar.text_input('Last date to be read (YYYY-MM-DD)', value=args.endDate or "",
+                                             key="endDate")
 
         st.sidebar.header("Data Cleansing")
         if args.flow >= 0:
@@ -170,17 +323,63 @@ def parseArgument(parserObject):
             args.enableNetworkClustering = st.sidebar.checkbox("Enable network clustering for Day-Type definition",
                                                                False,
                                                                key="enableNetworkClustering")
-            if args.flow >= 0:
+            args.autoNetworkClusters = str(st.sidebar.checkbox("Automatic number of network clusters", False,
+                                                               key="autoNetworkClusters"))
+            if args.autoNetworkClusters == 'True':
+                args.minimumNetworkClusters = int(st.sidebar.number_input('Minimum number of network clusters',
+                                                                          min_value=2,
+                                                                          value=args.minimumNetworkClusters,
+                                                                          key="minimumNetworkClusters"))
+                args.maximumNetworkClusters = int(st.sidebar.number_input('Maximum number of network clusters',
+                                                                          min_value=2,
+                                                                          value=args.maximumNetworkClusters,
+                                                                          key="maximumNetworkClusters"))
+            elif args.flow >= 0:
                 args.KmeansNumberOfFlowCluster = int(st.sidebar.number_input('Number of network clusters (based on Flow data)',
                                                                            min_value=2,
                                                                            value=args.KmeansNumberOfFlowCluster,
                                                                            key="KmeansNumberOfFlowCluster"))
-            if args.speed >= 0:
+            if args.speed >= 0 and args.autoNetworkClusters != 'True':
                 args.KmeansNumberOfSpeedCluster = int(
                     st.sidebar.number_input('Number of network clusters (based on Speed data)',
                                           min_value=2,
                                           value=args.KmeansNumberOfSpeedCluster,
                                           key="KmeansNumberOfSpeedCluster"))
+            args.clusteringBackend = st.sidebar.selectbox('Clustering algorithm of each ID',
+                                                          ("affinityPropagation", "miniBatchKMeans", "agglomerative",
+                                                           "kMedoids"),
+                                                          key="clusteringBackend")
+            if args.clusteringBackend != "affinityPropagation":
+                args.numberOfProfileClusters = int(st.sidebar.number_input('Number of clusters of each ID',
+                                                                           min_value=1,
+                                                                           value=args.numberOfProfileClusters,
+                                                                           key="numberOfProfileClusters"))
+            args.numberOfWorkers = int(st.sidebar.number_input('Number of worker processes (0 = all CPUs)',
+                                                               min_value=0,
+                                                               value=args.numberOfWorkers,
+                                                               key="numberOfWorkers"))
+
+        st.sidebar.header("Output")
+        args.outputDirectory = st.sidebar.text_input('Results directory', value=args.outputDirectory,
+                                                     key="outputDirectory")
+        args.outputFormat = st.sidebar.selectbox('Results format', ("csv", "parquet"), key="outputFormat")
+        if args.outputFormat == "parquet":
+            args.partitionByKey = str(st.sidebar.checkbox("Partition the results by Key ID", False,
+                                                          key="partitionByKey"))
+
+        st.sidebar.header("Cache")
+        args.cacheDirectory = st.sidebar.text_input('Cache directory (empty = no persistent cache)',
+                                                    value=args.cacheDirectory, key="cacheDirectory")
+        args.cacheSizeMB = float(st.sidebar.text_input('Cache size in MB', value=args.cacheSizeMB, key="cacheSizeMB"))
+        args.profileStoreDirectory = st.sidebar.text_input('Smoothed profiles store (empty = in memory)',
+                                                           value=args.profileStoreDirectory,
+                                                           key="profileStoreDirectory")
+
+        st.sidebar.header("Charts")
+        args.maximumHeatmapCells = int(st.sidebar.number_input('Maximum number of cells of a heatmap',
+                                                               min_value=1,
+                                                               value=args.maximumHeatmapCells,
+                                                               key="maximumHeatmapCells"))
     if args.conf:
         json_filename = ".\\conf\\" + args.conf if os.path.basename(args.conf) == args.conf else args.conf
         with open(json_filename, 'r') as json_file:
@@ -198,6 +397,10 @@ def parseArgument(parserObject):
             args.speed = data["speed"]
             args.flowFactor = data["flowFactor"]
             args.speedFactor = data["speedFactor"]
+            args.memoryBudgetMB = data.get("memoryBudgetMB", args.memoryBudgetMB)
+            args.keyFilter = data.get("keyFilter", args.keyFilter)
+            args.startDate = data.get("startDate", args.startDate)
+            args.endDate = data.get("endDate", args.endDate)
             args.keepFlowZero = data["keepFlowZero"]
             args.keepSpeedZero = data["keepSpeedZero"]
             args.flowThreshold = data["flowThreshold"]
@@ -209,12 +412,60 @@ def parseArgument(parserObject):
             args.enableNetworkClustering = data["enableNetworkClustering"]
             args.KmeansNumberOfFlowCluster = data["KmeansNumberOfFlowCluster"]
             args.KmeansNumberOfSpeedCluster = data["KmeansNumberOfSpeedCluster"]
+            args.autoNetworkClusters = data.get("autoNetworkClusters", args.autoNetworkClusters)
+            args.minimumNetworkClusters = data.get("minimumNetworkClusters", args.minimumNetworkClusters)
+            args.maximumNetworkClusters = data.get("maximumNetworkClusters", args.maximumNetworkClusters)
+            args.networkClusteringInits = data.get("networkClusteringInits", args.networkClusteringInits)
+            args.numberOfWorkers = data.get("numberOfWorkers", args.numberOfWorkers)
+            args.clusteringBackend = data.get("clusteringBackend", args.clusteringBackend)
+            args.numberOfProfileClusters = data.get("numberOfProfileClusters", args.numberOfProfileClusters)
+            args.clusteringBackendReport = data.get("clusteringBackendReport", args.clusteringBackendReport)
+            args.headless = data.get("headless", args.headless)
+            args.incrementalUpdate = data.get("incrementalUpdate", args.incrementalUpdate)
+            args.modelDirectory = data.get("modelDirectory", args.modelDirectory)
+            args.refit = data.get("refit", args.refit)
+            args.driftThreshold = data.get("driftThreshold", args.driftThreshold)
+            args.exportClassifier = data.get("exportClassifier", args.exportClassifier)
+            args.classify = data.get("classify", args.classify)
+            args.outputDirectory = data.get("outputDirectory", args.outputDirectory)
+            args.outputFormat = data.get("outputFormat", args.outputFormat)
+            args.partitionByKey = data.get("partitionByKey", args.partitionByKey)
+            args.cacheDirectory = data.get("cacheDirectory", args.cacheDirectory)
+            args.cacheSizeMB = data.get("cacheSizeMB", args.cacheSizeMB)
+            args.profileStoreDirectory = data.get("profileStoreDirectory", args.profileStoreDirectory)
+            args.runReport = data.get("runReport", args.runReport)
+            args.profileStage = data.get("profileStage", args.profileStage)
+            args.maximumHeatmapCells = data.get("maximumHeatmapCells", args.maximumHeatmapCells)
     return args
 
 
+def isHeadless(argOptions):
+    """
+    Headless runs are asked by the command line or by the JSON file (where the value could be a string or a boolean)
+    and they are never done with the GUI
+    """
+    return str(argOptions.headless) == 'True' and argOptions.GUI != 'True'
+
+
+def isIncremental(argOptions):
+    """
+    Incremental updates are batch runs too, they are never done with the GUI
+    """
+    return str(argOptions.incrementalUpdate) == 'True' and argOptions.GUI != 'True'
+
+
+def isClassification(argOptions):
+    """
+    Classifications of new dates are batch runs too, they are never done with the GUI
+    """
+    return str(argOptions.classify) == 'True' and argOptions.GUI != 'True'
+
+
 def checkOption(boolCondition, errorMessage, errorImage):
     if boolCondition:
-        st.image(errorImage, caption=errorMessage, width=128, format='PNG')
+        if errorImage is not None:
+            import streamlit as st
+            st.image(errorImage, caption=errorMessage, width=128, format='PNG')
         raise Exception("CONFIGURATION ERROR: ", errorMessage)
 
 
@@ -222,7 +473,11 @@ def checkArgument(argOptions):
 
     ImageErrorDirectory = ".\\images\\error.png"
 
-    errorImg = Image.open(ImageErrorDirectory)
+    # the error image is shown only by the web-app
+    errorImg = None
+    if not (isHeadless(argOptions) or isIncremental(argOptions) or isClassification(argOptions)):
+        from PIL import Image
+        errorImg = Image.open(ImageErrorDirectory)
     optionsAreOK = True
 
     checkOption(argOptions.inputFile is None or not os.path.exists(argOptions.inputFile),
@@ -230,10 +485,16 @@ def checkArgument(argOptions):
                 errorImg)
 
     # REMINDER: put in OR all supported future formats
-    checkOption(not (argOptions.format == "csv"),
+    checkOption(not (argOptions.format == "csv" or
+                     argOptions.format == "parquet" or
+                     argOptions.format == "feather"),
                 'File format not supported',
                 errorImg)
 
+    checkOption(argOptions.convertToParquet is not None and argOptions.format != "csv",
+                'Only CSV input files can be converted to Parquet',
+                errorImg)
+
     # REMINDER: put in OR all supported future file separators
     checkOption(not (argOptions.fileSeparator == "," or
                      argOptions.fileSeparator == ";" or
@@ -261,6 +522,10 @@ def checkArgument(argOptions):
                 'Speed conversion factor must be greater than zero',
                 errorImg)
 
+    checkOption(float(argOptions.memoryBudgetMB) < 0.0,
+                'Memory budget must be zero (whole file) or a positive number of MB',
+                errorImg)
+
     checkOption(float(argOptions.flowThreshold) > 100.0 or float(argOptions.flowThreshold) < 0.0,
                 'Flow threshold must be a percentage value (between 0% and 100%)',
                 errorImg)
@@ -269,6 +534,55 @@ def checkArgument(argOptions):
                 'Speed threshold must be a percentage value (between 0% and 100%)',
                 errorImg)
 
+    checkOption(int(argOptions.minimumNetworkClusters) < 2 or
+                int(argOptions.maximumNetworkClusters) < int(argOptions.minimumNetworkClusters),
+                'Network clusters range must start from 2 and the maximum cannot be lower than the minimum',
+                errorImg)
+
+    checkOption(int(argOptions.networkClusteringInits) < 1,
+                'Number of K-Means initializations must be a positive integer',
+                errorImg)
+
+    checkOption(int(argOptions.numberOfWorkers) < 0,
+                'Number of workers must be zero (all CPUs) or a positive integer',
+                errorImg)
+
+    checkOption(argOptions.clusteringBackend not in ("affinityPropagation", "miniBatchKMeans", "agglomerative",
+                                                     "kMedoids"),
+                'Clustering backend not supported',
+                errorImg)
+
+    checkOption(int(argOptions.numberOfProfileClusters) < 1,
+                'Number of clusters of each ID must be a positive integer',
+                errorImg)
+
+    checkOption(argOptions.outputFormat not in ("csv", "parquet"),
+                'Results format not supported',
+                errorImg)
+
+    checkOption(not argOptions.outputDirectory,
+                'Results directory must be specified',
+                errorImg)
+
+    checkOption(float(argOptions.cacheSizeMB) < 0.0,
+                'Cache size must be zero (no persistent cache) or a positive number of MB',
+                errorImg)
+
+    checkOption(int(argOptions.maximumHeatmapCells) < 1,
+                'Maximum number of cells of a heatmap must be a positive number',
+                errorImg)
+
+    checkOption(float(argOptions.driftThreshold) > 100.0 or float(argOptions.driftThreshold) < 0.0,
+                'Drift threshold must be a percentage value (between 0% and 100%)',
+                errorImg)
+
+    checkOption(isClassification(argOptions) and
+                not any(os.path.exists(os.path.join(argOptions.modelDirectory, measureType + "_classifier.npz"))
+                        for measureType, column in (('Flow', argOptions.flow), ('Speed', argOptions.speed))
+                        if int(column) >= 0),
+                'No classifier found into the model directory',
+                errorImg)
+
     return optionsAreOK
 
 
@@ -1,40 +1,51 @@
+import PlotData as pld
 import streamlit as st
 import pandas as pd
-import numpy as np
-import itertools
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 import plotly.express as px
 
 
-def DataAnalysisVisualization(data, AnalysisType, unit, threshold, column_index, cap):
+def DataAnalysisVisualization(histogram, AnalysisType, unit, threshold, cap):
     """
-    A simple function to plot the histogram of the specified column of a dataframe, its normalized cumulative, and
-    horizontal and vertical lines corresponding to a threshold.
+    A simple function to plot the histogram of a column of a dataframe, its normalized cumulative, and horizontal and
+    vertical lines corresponding to a threshold. The histogram is given as the function returning the counts and edges
+    of its bins together with the total number of values (see PlotData.histogramData), over the whole range of the
+    values or, when asked, only up to the threshold value, so only the bins are drawn whatever the number of values.
     """
     st.title(f'{AnalysisType} Data Analysis')
 
+    upToCap = st.checkbox(f"Show the {AnalysisType} distribution only up to the threshold", False,
+                          key='histogramUpToCap' + AnalysisType)
+    counts, edges, total = histogram(upToCap)
+    distributionCounts, distributionEdges = pld.rebinHistogram(counts, edges, 20)
+    cumulativeCounts, cumulativeEdges = pld.rebinHistogram(counts, edges, 90)
+
     plt.figure(figsize=(10, 4))
     fig, axs = plt.subplots(nrows=1, ncols=2, figsize=(10, 5), sharex=True)
 
-    axs[0].hist(data.iloc[:, column_index].dropna(), density=True, bins=20, histtype='stepfilled', linewidth=2.5,
-                color='teal')
+    # a value at the left edge of each bin weighted by its height draws the same bars as the histogram of the values
+    axs[0].hist(distributionEdges[:-1], bins=distributionEdges,
+                weights=pld.densityHistogram(distributionCounts, distributionEdges, total), histtype='stepfilled',
+                linewidth=2.5, color='teal')
 
-    axs[0].set_title(f"{AnalysisType} Distribution", weight='bold')
+    axs[0].set_title(f"{AnalysisType} Distribution" + (" (up to the threshold)" if upToCap else ""), weight='bold')
     axs[0].set_xlabel(f'{AnalysisType} ({unit})')
     axs[0].set_xlim(0, )
     axs[0].axvline(x=cap, linewidth=3.5, linestyle='--', color='r')
 
     axs[1].set_title("Normalized Cumulative Distribution", weight='bold')
     axs[1].set_xlabel(f'{AnalysisType} ({unit})')
-    axs[1].hist(data.iloc[:, column_index].dropna(), cumulative=True, density=True, bins=90, histtype='step',
-                linewidth=3, color='teal')
+    axs[1].hist(cumulativeEdges[:-1], bins=cumulativeEdges, weights=pld.cumulativeHistogram(cumulativeCounts, total),
+                histtype='step', linewidth=3, color='teal')
 
     x1, y1 = [0, cap], [threshold / 100, threshold / 100]
     x2, y2 = [cap, cap], [0, threshold / 100]
     axs[1].plot(x1, y1, x2, y2, c='r', linewidth=2.3)
 
     st.write(f"The {AnalysisType} threshold is: ", round(cap, 3), f"({unit})")
+    if upToCap:
+        st.write(f"Values above the threshold, not shown: {100 * (total - counts.sum()) / max(total, 1):.2f}%")
     st.pyplot()
 
 
@@ -48,15 +59,29 @@ def DataAnalysisStatistics(data, column_index, title):
     return pd.DataFrame(data.iloc[:, column_index]).describe().T
 
 
-def PivotDataframeHeatmap(DataFrame, title, timeBucketNumber):
+def PivotDataframeHeatmap(DataFrame, title, timeBucketNumber, maximumCells, key=''):
     """
-    Function to visualize the heatmap of a pivot dataframe. Percentage and absolute number
+    Function to visualize the heatmap of a pivot dataframe. Percentage and absolute number.
+    When the dataframe has more than maximumCells cells, the heatmap is binned (see PlotData.heatmapData) and a region
+    of rows and columns can be selected to be shown at full resolution: only the region is sliced from the dataframe.
     """
+    if len(DataFrame.index) * len(DataFrame.columns) > maximumCells:
+        st.write(f"{len(DataFrame.index)} keys x {len(DataFrame.columns)} dates, binned to at most {maximumCells} "
+                 f"cells: each cell is the mean of a block of keys and dates")
+        if st.checkbox("Select a region at full resolution", False, key='heatmapRegion' + key):
+            firstRow, lastRow = st.slider("Keys (position)", 0, len(DataFrame.index) - 1,
+                                          (0, min(len(DataFrame.index), 100) - 1), key='heatmapRows' + key)
+            firstColumn, lastColumn = st.slider("Dates (position)", 0, len(DataFrame.columns) - 1,
+                                                (0, min(len(DataFrame.columns), 100) - 1), key='heatmapColumns' + key)
+            DataFrame = DataFrame.iloc[firstRow:lastRow + 1, firstColumn:lastColumn + 1]
+
+    values, rowLabels, columnLabels, hoverText = pld.heatmapData(DataFrame, maximumCells)
+
     fig = go.Figure(data=go.Heatmap(
-        z=(100 * DataFrame / timeBucketNumber),
-        x=DataFrame.columns,
-        y=DataFrame.transpose().columns,
-        hovertext=DataFrame,
+        z=(100 * values / timeBucketNumber),
+        x=columnLabels,
+        y=rowLabels,
+        hovertext=hoverText,
         zmin=0,
         zmax=100,
         colorscale='Viridis'))
@@ -104,13 +129,14 @@ def plotSeriesOriginalAndSmooth(xvalue, yvalue1, yvalue2, title, ylabel):
     st.plotly_chart(fig)
 
 
-def plotSeriesClusterOriginal(xvalue, originalDF, ID, dates, title, ylabel, measureType):
+def plotSeriesClusterOriginal(xvalue, profileCube, ID, dates, title, ylabel):
+    profiles = pld.cubeProfileArray(profileCube, ID, dates)
     fig = go.Figure()
-    for d in dates:
+    for i, d in enumerate(dates):
         fig.add_trace(go.Scatter(x=xvalue,
-                                 y=originalDF[(originalDF['KeyID'] == ID) & (originalDF['Date'] == d)][measureType.lower()],
+                                 y=profiles[:, i],
                                  mode='lines+markers',
-                                 name=str(d)))
+                                 name=d.strftime("%Y-%m-%d")))
 
     fig.update_layout(
         title={
@@ -123,12 +149,13 @@ def plotSeriesClusterOriginal(xvalue, originalDF, ID, dates, title, ylabel, meas
 
 
 def plotSeriesClusterSmoothed(xvalue, smoothDF, ID, dates, title, ylabel):
+    profiles = pld.keyProfileArray(smoothDF[ID], dates)
     fig = go.Figure()
-    for d in dates:
+    for i, d in enumerate(dates):
         fig.add_trace(go.Scatter(x=xvalue,
-                                 y=smoothDF[ID][d],
+                                 y=profiles[:, i],
                                  mode='lines+markers',
-                                 name=str(d)))
+                                 name=d.strftime("%Y-%m-%d")))
     fig.update_layout(
         title={
             'text': title,
@@ -139,36 +166,30 @@ def plotSeriesClusterSmoothed(xvalue, smoothDF, ID, dates, title, ylabel):
     st.plotly_chart(fig)
 
 
-def plotBoxPlotClusterSmoothed(smoothDF, clusterCenterDF, ID, clusterID, dates, title, ylabel):
-    times = [t.strftime("%H:%M") for t in smoothDF[ID].index]
-    N = len(times)
-    y_data = []
-    for t in range(N):
-        tmpList = []
-        for d in dates:
-            tmpList.append(smoothDF[ID][d].iloc[t])
-        y_data.append(tmpList)
+def plotBoxPlotClusterSmoothed(xvalue, smoothDF, clusterCenterDF, ID, clusterID, dates, title, ylabel):
+    times = list(xvalue)
+    keyFrame = smoothDF[ID]
+    x_data, y_data = pld.boxPlotData(times, pld.keyProfileArray(keyFrame, dates))
 
     fig = go.Figure()
     representativeIndex = clusterCenterDF[ID][clusterCenterDF[ID]['ClusterGroup'] == clusterID]['ClusterCenterIndex'].to_list()
-    dd = smoothDF[ID].iloc[:, representativeIndex].columns
 
-    fig.add_trace(go.Scatter(x=times, y=list(smoothDF[ID][dd[0]]),
+    fig.add_trace(go.Scatter(x=times, y=keyFrame.to_numpy()[:, representativeIndex[0]],
                              mode='lines+markers',
                              marker_color='black',
                              name=str("Representative")))
 
-    for xd, yd in zip(times, y_data):
-        fig.add_trace(go.Box(
-            y=yd,
-            name=xd,
-            showlegend=False,
-            notched=True,
-            whiskerwidth=0.2,
-            marker_color='gray',
-            marker_size=2,
-            line_width=1)
-        )
+    # a single trace holding a box for each time bucket
+    fig.add_trace(go.Box(
+        x=x_data,
+        y=y_data,
+        showlegend=False,
+        notched=True,
+        whiskerwidth=0.2,
+        marker_color='gray',
+        marker_size=2,
+        line_width=1)
+    )
 
     fig.update_layout(
         title={
@@ -225,62 +246,23 @@ def plotClusterParallelByWeekday(singleKeyClusterDF, title):
 
 
 def CalendarHeatMap(Cluster_Result, title, measureType):
-    clusterOption = Cluster_Result['ClusterGroup'].unique()
-
-    clusterSelection = [-1]
-    datesToFlatten = []
-    for cid in clusterOption:
-        clusterSelection.append(cid)
+    clusterGroups = Cluster_Result['ClusterGroup'].to_numpy()
 
-        tmpdates = list(Cluster_Result[Cluster_Result['ClusterGroup'] == cid]['Date'])
-        datesToFlatten.append(tmpdates)
-    dates = list(itertools.chain(*datesToFlatten))  # these are datetime.date() types
+    # plot the calendar heatmap of the cluster results with a slider to select to show just one cluster in case
+    clusterIDheatmap = st.slider(
+        'Select the cluster ID to be visualized on the calendar heatmap in Yellow (-1 for all of them)',
+        min_value=-1, max_value=int(clusterGroups.max()), key='clusterIDheatmap'+measureType)
 
-    years = np.unique(np.array([d.strftime("%Y") for d in Cluster_Result['Date']]))
-    for y in years:
+    for y in pld.calendarYears(Cluster_Result['Date']):
         st.subheader('Clustering Year ' + str(y))
 
-        # plot the calendar heatmap of the cluster results with a slider to select to show just one cluster in case
-        clusterIDheatmap = st.slider(
-            'Select the cluster ID to be visualized on the calendar heatmap in Yellow (-1 for all of them)',
-            min_value=-1, max_value=int(max(clusterSelection)), key='clusterIDheatmap'+measureType)
-
-        all_days = pd.date_range(start='1/1/'+str(y), end='31/12/'+str(y), freq='D')
-
-        clusterDF = pd.DataFrame([-np.Inf for d in all_days], columns=['ClusterID'], index=all_days)
-        clusterDF['week'] = [d.isocalendar()[1] for d in all_days]
-        clusterDF['weekday'] = [d.isocalendar()[2] for d in all_days]
-        for d in dates:
-            clustergroupvalue = Cluster_Result[Cluster_Result['Date'] == d]['ClusterGroup'].iloc[0]
-            if clusterIDheatmap == -1:
-                clusterDF.at[d, 'ClusterID'] = clustergroupvalue
-            else:
-                if clustergroupvalue == clusterIDheatmap:
-                    clusterDF.at[d, 'ClusterID'] = clustergroupvalue
-                else:
-                    clusterDF.at[d, 'ClusterID'] = -1
-
-        pivotClusterDF = clusterDF.pivot_table(index=clusterDF.columns[clusterDF.columns.get_loc('weekday')],
-                                               columns=clusterDF.columns[clusterDF.columns.get_loc('week')],
-                                               values=clusterDF.columns[clusterDF.columns.get_loc('ClusterID')])
-        months = []
-        for w in list(pivotClusterDF.columns):
-            lastdayweek = pd.to_datetime(str(y)+str(w) + "6", format="%Y%U%w")
-            months.append(lastdayweek.strftime("%B")+"-week_"+str(w))
-
-        hoverDate = pd.DataFrame([d.strftime("%Y-%m-%d") for d in all_days], columns=['Date'])
-        hoverDate['week'] = [d.isocalendar()[1] for d in all_days]
-        hoverDate['weekday'] = [d.isocalendar()[2] for d in all_days]
-        pivotHoverDate = hoverDate.pivot_table(index=hoverDate.columns[hoverDate.columns.get_loc('weekday')],
-                                               columns=hoverDate.columns[hoverDate.columns.get_loc('week')],
-                                               values=hoverDate.columns[hoverDate.columns.get_loc('Date')],
-                                               aggfunc=lambda x: ' '.join(str(v) for v in x))
+        grid, hoverText, weeks = pld.calendarGrid(Cluster_Result['Date'], clusterGroups, y, clusterIDheatmap)
 
         fig = go.Figure(data=go.Heatmap(
-            z=pivotClusterDF,
-            x=months,
-            y=['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
-            hovertext=pivotHoverDate,
+            z=grid,
+            x=weeks,
+            y=pld.weekdayNames,
+            hovertext=hoverText,
             colorscale='Viridis'))
 
         fig.update_layout(
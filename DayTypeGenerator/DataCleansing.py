@@ -1,23 +1,31 @@
+import StageCache as sc
+import utils as ut
+
 import numpy as np
-import streamlit as st
+import pandas as pd
 
 
-@st.cache
-def cleanData(rawDataFrame, argOptions):
+@sc.stage(options=("ID1", "ID2", "timestamp", "flow", "speed", "TimeResolution", "keepFlowZero", "keepSpeedZero",
+                   "flowThreshold", "speedThreshold", "maximumMissingPercentageFlow", "maximumMissingPercentageSpeed"))
+def cleanData(rawDataFrame, argOptions, cap_flow=None, cap_speed=None):
     """
     Function to be used to clean the data set. Fundamental and first step in the data pipeline process
 
     The two basic steps (but more can be added) to be implemented should be
     1) validity value check
     2) outliers detection (manual/automatic) and removal
+
+    The outlier caps are computed on the data, unless they are given (e.g. the ones of the history when a new day is
+    added by the incremental update)
     """
 
-    # just a deep copy of the input because outside we would like to work
-    # on both original raw data and cleaned one
-    rawDataCopy = rawDataFrame.copy(deep=True)
+    # just a shallow copy of the input because outside we would like to work
+    # on both original raw data and cleaned one: the cleaning replaces the value columns (and adds new ones) instead of
+    # writing into them, so the raw data are never modified nor copied as a whole
+    rawDataCopy = rawDataFrame.copy(deep=False)
 
     validDF = checkValidity(rawDataCopy, argOptions)
-    outlierDF, cap_flow, cap_speed = checkOutliers(validDF, argOptions)
+    outlierDF, cap_flow, cap_speed = checkOutliers(validDF, argOptions, cap_flow, cap_speed)
     dataAugmentedDF = datetimeAndKeyOptimization(outlierDF, argOptions)
     pivotFlowDF, pivotSpeedDF, completeDF = checkCompleteness(dataAugmentedDF, argOptions)
 
@@ -31,15 +39,17 @@ def checkValidity(rawDataFrame, argOptions):
     We are dealing with flows and speeds so they must not be negative at all
     """
     if argOptions.flow >= 0:
-        rawDataFrame.iloc[:, argOptions.flow].mask(rawDataFrame.iloc[:, argOptions.flow] < 0, inplace=True)
+        flow = rawDataFrame.iloc[:, argOptions.flow]
+        rawDataFrame[rawDataFrame.columns[argOptions.flow]] = flow.mask(flow < 0)
 
     if argOptions.speed >= 0:
-        rawDataFrame.iloc[:, argOptions.speed].mask(rawDataFrame.iloc[:, argOptions.speed] < 0, inplace=True)
+        speed = rawDataFrame.iloc[:, argOptions.speed]
+        rawDataFrame[rawDataFrame.columns[argOptions.speed]] = speed.mask(speed < 0)
 
     return rawDataFrame
 
 
-def checkOutliers(validDataFrame, argOptions):
+def checkOutliers(validDataFrame, argOptions, cap_flow=None, cap_speed=None):
     """
     Function dedicated to remove outlier data
 
@@ -49,21 +59,23 @@ def checkOutliers(validDataFrame, argOptions):
     The functions returns the clean data-set and also the corresponding speed and flow threshold values based
     on the user percentile thresholds.
     The function remove also flow and/or speed values exactly equal to zero as decided by th user
+    Thresholds values already known can be given, in which case they are not computed again
     """
-    cap_flow = None
-    cap_speed = None
-
     if argOptions.flow >= 0:
-        cap_flow = np.percentile(a=validDataFrame.iloc[:, argOptions.flow].dropna(), q=argOptions.flowThreshold)
-        validDataFrame.iloc[:, argOptions.flow].mask(validDataFrame.iloc[:, argOptions.flow] > cap_flow, inplace=True)
+        flowColumn = validDataFrame.columns[argOptions.flow]
+        if cap_flow is None:
+            cap_flow = np.percentile(a=validDataFrame[flowColumn].dropna(), q=argOptions.flowThreshold)
+        validDataFrame[flowColumn] = validDataFrame[flowColumn].mask(validDataFrame[flowColumn] > cap_flow)
         if not argOptions.keepFlowZero:
-            validDataFrame.iloc[:, argOptions.flow].mask(validDataFrame.iloc[:, argOptions.flow] == 0, inplace=True)
+            validDataFrame[flowColumn] = validDataFrame[flowColumn].mask(validDataFrame[flowColumn] == 0)
 
     if argOptions.speed >= 0:
-        cap_speed = np.percentile(a=validDataFrame.iloc[:, argOptions.speed].dropna(), q=argOptions.speedThreshold)
-        validDataFrame.iloc[:, argOptions.speed].mask(validDataFrame.iloc[:, argOptions.speed] > cap_speed, inplace=True)
-    if not argOptions.keepSpeedZero:
-        validDataFrame.iloc[:, argOptions.speed].mask(validDataFrame.iloc[:, argOptions.speed] == 0, inplace=True)
+        speedColumn = validDataFrame.columns[argOptions.speed]
+        if cap_speed is None:
+            cap_speed = np.percentile(a=validDataFrame[speedColumn].dropna(), q=argOptions.speedThreshold)
+        validDataFrame[speedColumn] = validDataFrame[speedColumn].mask(validDataFrame[speedColumn] > cap_speed)
+        if not argOptions.keepSpeedZero:
+            validDataFrame[speedColumn] = validDataFrame[speedColumn].mask(validDataFrame[speedColumn] == 0)
 
     return validDataFrame, cap_flow, cap_speed
 
@@ -73,14 +85,23 @@ def datetimeAndKeyOptimization(finalCleanDataframe, argOptions):
     This function will expand the dataframe adding a column just storing the date and another one just storing the time
     because it is useful in subsequent processing steps. Moreover the primary key as a single field will be created
     taking ID1 or the concatenation ID1;ID2 in order to have just a single column for querying the IDs
+
+    All the columns are derived in a columnar way: the date is the timestamp truncated at midnight (datetime64), the
+    time is the integer index of the time bucket within the day given the time resolution, and the key is categorical,
+    so that the concatenation ID1;ID2 is done once for each distinct couple instead of once for each row. Readable
+    times are obtained back from the bucket indexes only where they are shown (see utils.timeBucketLabels)
     """
-    finalCleanDataframe['Date'] = [d.date() for d in finalCleanDataframe.iloc[:, argOptions.timestamp]]
-    finalCleanDataframe['Time'] = [d.time() for d in finalCleanDataframe.iloc[:, argOptions.timestamp]]
+    timestamps = finalCleanDataframe.iloc[:, argOptions.timestamp]
+    finalCleanDataframe['Date'] = timestamps.dt.normalize()
+    finalCleanDataframe['Time'] = ((60 * timestamps.dt.hour + timestamps.dt.minute) // argOptions.TimeResolution).astype(np.int16)
 
     if argOptions.ID2 >= 0:
-        finalCleanDataframe['KeyID'] = finalCleanDataframe.iloc[:, argOptions.ID1] + ";" + finalCleanDataframe.iloc[:, argOptions.ID2]
+        keyCodes, keyPairs = pd.MultiIndex.from_arrays([finalCleanDataframe.iloc[:, argOptions.ID1],
+                                                        finalCleanDataframe.iloc[:, argOptions.ID2]]).factorize()
+        finalCleanDataframe['KeyID'] = pd.Categorical.from_codes(keyCodes,
+                                                                 categories=[str(id1) + ";" + str(id2) for id1, id2 in keyPairs])
     else:
-        finalCleanDataframe['KeyID'] = finalCleanDataframe.iloc[:, argOptions.ID1]
+        finalCleanDataframe['KeyID'] = finalCleanDataframe.iloc[:, argOptions.ID1].astype('category')
 
     # maybe here we could set the index of the dataframe to KeyID ...
 
@@ -92,44 +113,38 @@ def checkCompleteness(outlierDataframe, argOptions):
     Function dedicated to drop time profiles having to much missing data, based on maximum allowed percentage
     defined by the user for both the flow and the speed data.
 
+    The number of valid values of each (KeyID, Date) profile is obtained by a single groupby for flow and speed
+    together, and it is broadcast back to the rows through the group number of each row, so that all the incomplete
+    profiles are masked at once. The missing percentage is computed with respect to the number of time buckets of a
+    day.
+
     Pivot tables are used for data visualization and user interaction
     """
-    profileKeyNames = outlierDataframe.loc[:, 'KeyID']
-
-    pivotKeyDateFlowDF = None
-    if argOptions.flow > 0:
-        pivotKeyDateFlowDF = outlierDataframe.pivot_table(index=profileKeyNames,
-                                                          columns=outlierDataframe.columns[outlierDataframe.columns.get_loc('Date')],
-                                                          values=outlierDataframe.columns[argOptions.flow],
-                                                          aggfunc=lambda x: x.count())
-
-        pivotKeyDateFlowDF.mask(100 - pivotKeyDateFlowDF > argOptions.maximumMissingPercentageFlow, inplace=True)
-
-        IDdatesFlow = {}
-        for ID in pivotKeyDateFlowDF.index:
-             IDdatesFlow[ID] = pivotKeyDateFlowDF.loc[ID, :].dropna().index.astype(str).tolist()
-
-        for key, value in IDdatesFlow.items():
-            outlierDataframe.iloc[:, argOptions.flow].mask((outlierDataframe.loc[:, 'KeyID'] == key) &
-                                                           (np.logical_not(outlierDataframe.loc[:, 'Date'].astype(str).isin(value))),
-                                                           inplace=True)
-
-    pivotKeyDateSpeedDF = None
-    if argOptions.speed > 0:
-        pivotKeyDateSpeedDF = outlierDataframe.pivot_table(index=profileKeyNames,
-                                                           columns=outlierDataframe.columns[outlierDataframe.columns.get_loc('Date')],
-                                                           values=outlierDataframe.columns[argOptions.speed],
-                                                           aggfunc=lambda x: x.count())
-
-        pivotKeyDateSpeedDF.mask(100 - pivotKeyDateSpeedDF > argOptions.maximumMissingPercentageSpeed, inplace=True)
-
-        IDdatesSpeed = {}
-        for ID in pivotKeyDateSpeedDF.index:
-            IDdatesSpeed[ID] = pivotKeyDateSpeedDF.loc[ID, :].dropna().index.astype(str).tolist()
-
-        for key, value in IDdatesSpeed.items():
-            outlierDataframe.iloc[:, argOptions.speed].mask((outlierDataframe.loc[:, 'KeyID'] == key) &
-                                                            (np.logical_not(outlierDataframe.loc[:, 'Date'].astype(str).isin(value))),
-                                                            inplace=True)
+    maximumMissingPercentage = {}
+    if argOptions.flow >= 0:
+        maximumMissingPercentage[argOptions.flow] = argOptions.maximumMissingPercentageFlow
+    if argOptions.speed >= 0:
+        maximumMissingPercentage[argOptions.speed] = argOptions.maximumMissingPercentageSpeed
+
+    valueColumns = [outlierDataframe.columns[i] for i in maximumMissingPercentage]
+    profiles = outlierDataframe.groupby(['KeyID', 'Date'], observed=True)
+    profileCounts = profiles[valueColumns].count()
+    profileOfRow = profiles.ngroup().to_numpy()
+    rowHasProfile = profileOfRow >= 0
+
+    pivotKeyDate = {}
+    for columnIndex, maximumMissing in maximumMissingPercentage.items():
+        column = outlierDataframe.columns[columnIndex]
+        missingPercentage = 100 * (1 - profileCounts[column] / ut.timeBucketNumber(argOptions.TimeResolution))
+        incompleteProfile = (missingPercentage > maximumMissing).to_numpy()
+
+        incompleteRow = np.zeros(len(outlierDataframe), dtype=bool)
+        incompleteRow[rowHasProfile] = incompleteProfile[profileOfRow[rowHasProfile]]
+        outlierDataframe[column] = outlierDataframe[column].mask(incompleteRow)
+
+        pivotKeyDate[columnIndex] = profileCounts[column].mask(incompleteProfile).unstack('Date')
+
+    pivotKeyDateFlowDF = pivotKeyDate.get(argOptions.flow)
+    pivotKeyDateSpeedDF = pivotKeyDate.get(argOptions.speed)
 
     return pivotKeyDateFlowDF, pivotKeyDateSpeedDF, outlierDataframe
@@ -1,8 +1,10 @@
+import ProfileStore as pst
+import StageCache as sc
 import utils as ut
 
+import numpy as np
 import pandas as pd
 import math
-import streamlit as st
 
 
 def kernel(n):
@@ -26,7 +28,8 @@ def convolve(f, g):
 def smooth(f, g):
     """
     This function finalize the smoothing operation by taking the convolution signal and normalizing it for the kernel
-    weights taking into account the NaN values too
+    weights taking into account the NaN values too.
+    It works on a single series and it is kept as the reference implementation of smoothArray
     """
     chi_f = f.apply(lambda x: 0.0 if pd.isna(x) else 1.0)
     f_ext = pd.concat([f, chi_f], axis=1).prod(axis=1)
@@ -35,36 +38,112 @@ def smooth(f, g):
     return a.div(b)
 
 
-def DataSmoothing(FinalDataFrame, ValueColumnIndex, kernelFunction):
+def smoothArray(values, g):
     """
-    This function will perform a smoothing of the input signal convolving it with a triangular kernel
+    Vectorized version of the smoothing working on a whole array of profiles at once, where the time is the last axis
+    (dates x time buckets for a single key or keys x dates x time buckets for all of them). The signal is zero-filled
+    and convolved with the kernel together with its NaN indicator, one shifted slice per kernel element, and then
+    normalized by the convolved indicator, exactly as done by smooth on a single series. Time buckets for which the
+    kernel does not reach any defined value stay NaN
     """
-    finalCleanPivotTable = pd.pivot_table(data=FinalDataFrame, index='Time', columns='Date',
-                                          values=FinalDataFrame.columns[ValueColumnIndex], aggfunc='first')
+    validity = ~np.isnan(values)
+    signal = np.where(validity, values, 0.0)
+    chi_f = validity.astype(signal.dtype)
+
+    size = values.shape[-1]
+    a = np.zeros_like(signal)
+    b = np.zeros_like(signal)
+    for (x, y) in g:
+        if y == 0 or abs(x) >= size:
+            continue
+        # shifting by x the series means that at position i we take the value at position i - x
+        if x >= 0:
+            a[..., x:] += y * signal[..., :size - x]
+            b[..., x:] += y * chi_f[..., :size - x]
+        else:
+            a[..., :size + x] += y * signal[..., -x:]
+            b[..., :size + x] += y * chi_f[..., -x:]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return a / b
+
+
+def smoothKeysArray(values, timeExists, g):
+    """
+    Smoothing of an array of profiles of shape keys x dates x time buckets, where the profiles of each key are
+    smoothed over its own time buckets only (timeExists, keys x time buckets), as the profiles of the pivot table of a
+    single key: the time buckets without data of a key are not part of its time axis, so the kernel reaches across
+    them instead of counting them as missing values. The keys having all the time buckets are smoothed together, the
+    others one at a time; the time buckets not belonging to a key are NaN
+    """
+    smoothValues = np.full(values.shape, np.nan, dtype=values.dtype)
+    completeKeys = timeExists.all(axis=1)
+    smoothValues[completeKeys] = smoothArray(values[completeKeys], g)
 
-    SmoothDataFrame = pd.DataFrame()
-    for col in finalCleanPivotTable:
-        SmoothDataFrame[col] = smooth(finalCleanPivotTable[col], kernelFunction)
+    for k in np.flatnonzero(~completeKeys):
+        smoothValues[k][:, timeExists[k]] = smoothArray(values[k][:, timeExists[k]], g)
 
-    return SmoothDataFrame
+    return smoothValues
 
 
-@st.cache(allow_output_mutation=True)
-def smoothDataframe(FinalDataFrame, argOptions, IDvsDateDictionary, ValueColumnIndex):
+def smoothingKernel(argOptions):
     """
-    This function will return a dictionary of key-dataframe, each dataframe corresponding to a key of the clean dataset
-    and for which the data are smoothed.
+    The kernel given by the user options, whose width is a percentage of the number of time buckets of a day
     """
-    cleanDF = {}
-    for key, value in IDvsDateDictionary.items():
-        result_df = FinalDataFrame[(FinalDataFrame['KeyID'] == key) & (FinalDataFrame['Date'].isin(value))]
-        cleanDF[key] = result_df
-
     kernelHalfWidth = math.ceil(argOptions.smoothingKernelPercentage * ut.timeBucketNumber(argOptions.TimeResolution) / 200)
-    kernelFunction = kernel(kernelHalfWidth)
 
-    smoothDF = {}
-    for key, df in cleanDF.items():
-        smoothDF[key] = DataSmoothing(df, ValueColumnIndex, kernelFunction)
+    return kernel(kernelHalfWidth)
+
+
+def smoothCubeValues(profileCube, argOptions, smoothValues, keyBlockSize=256):
+    """
+    All the profiles of all the keys are smoothed by the vectorized engine into the smoothValues array (of the shape
+    of the cube, possibly memory-mapped), a block of keys at a time in order to bound the size of the temporary arrays.
+    Each key is smoothed over its own time buckets (see smoothKeysArray)
+    """
+    kernelFunction = smoothingKernel(argOptions)
+
+    for start in range(0, len(profileCube.keys), keyBlockSize):
+        stop = start + keyBlockSize
+        smoothValues[start:stop] = smoothKeysArray(profileCube.values[start:stop], profileCube.timeExists[start:stop],
+                                                   kernelFunction)
+
+
+def smoothProfileCube(profileCube, argOptions, keyBlockSize=256):
+    """
+    This function will return the cube of the smoothed profiles
+    """
+    smoothValues = np.empty_like(profileCube.values)
+    smoothCubeValues(profileCube, argOptions, smoothValues, keyBlockSize)
+
+    return profileCube.withValues(smoothValues)
+
+
+def storedSmoothProfiles(profileCube, argOptions):
+    """
+    The smoothed profiles of the cube from the profile store of the directory given by the options, where they are
+    smoothed (in single precision) only if no run has stored them yet
+    """
+    directory = argOptions.profileStoreDirectory
+    name = pst.storeName("smoothDataframe", profileCube, argOptions.TimeResolution,
+                         argOptions.smoothingKernelPercentage)
+
+    if not pst.storeExists(directory, name):
+        smoothValues = pst.createStoreValues(directory, name, profileCube.values.shape)
+        smoothCubeValues(profileCube, argOptions, smoothValues)
+        pst.commitStore(smoothValues, profileCube, directory, name)
+
+    return pst.openProfileStore(directory, name)
+
+
+@sc.stage(options=("TimeResolution", "smoothingKernelPercentage", "profileStoreDirectory"))
+def smoothDataframe(profileCube, argOptions):
+    """
+    This function will return a dictionary of key-dataframe, each dataframe corresponding to a key of the clean dataset
+    and for which the data are smoothed. With a profile store directory the mapping returned reads the profiles of
+    each key from the memory-mapped store when asked (see ProfileStore).
+    """
+    if argOptions.profileStoreDirectory:
+        return storedSmoothProfiles(profileCube, argOptions)
 
-    return smoothDF
+    return smoothProfileCube(profileCube, argOptions).keyFrames()
@@ -0,0 +1,244 @@
+import DataCleansing as dc
+import DataSmoothing as ds
+import FileReader as fr
+import Instrumentation as ins
+import ProfileCube as pc
+import SummaryReports as sr
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Day-type classifier: after a clustering run the exemplar profiles of the clusters of each key and the centroids of
+# the network clusters are saved into the model directory, so that new dates can be labelled in milliseconds without
+# running the clustering again. A new profile belongs to the cluster of its most similar exemplar (the similarity is
+# the one used by the clustering) and a new date belongs to the nearest network centroid, in the space of the
+# distances from the days of the network clustering.
+
+
+class DayTypeClassifier:
+    """
+    Persisted model of one measure:
+    - keys, times = the KeyIDs and the time buckets of the fitted profiles
+    - timeExists = KeyID x TimeBucket mask of the time buckets of the profiles of each key
+    - exemplars = KeyID x Cluster x TimeBucket array of the smoothed exemplar profiles (NaN where not defined, and for
+      the clusters a key does not have)
+    - networkDays, networkExists, networkLabels = the days of the network clustering and, for each key, whether it has
+      a profile on those days and in which cluster
+    - networkCenters = centroids of the network clusters in the space of the distances from the networkDays
+    - metadata = measure, outlier cap and options the model depends on
+    """
+
+    def __init__(self, keys, times, timeExists, exemplars, networkDays, networkExists, networkLabels, networkCenters,
+                 metadata):
+        self.keys = pd.Index(keys)
+        self.times = pd.Index(times)
+        self.timeExists = timeExists
+        self.exemplars = exemplars
+        self.networkDays = pd.DatetimeIndex(networkDays)
+        self.networkExists = networkExists
+        self.networkLabels = networkLabels
+        self.networkCenters = networkCenters
+        self.metadata = metadata
+
+        # zero-filled exemplars restricted to the time buckets of their key, with their norms, ready for the products
+        self._exemplarValues = np.where(np.isnan(exemplars), 0.0, exemplars) * timeExists[:, np.newaxis, :]
+        self._exemplarNorms = (self._exemplarValues * self._exemplarValues).sum(axis=2)
+        self._exemplarMissing = np.isnan(exemplars).all(axis=2)
+
+    def classifyValues(self, values):
+        """
+        Engine of the classifier working on an array of raw profiles of shape keys x dates x time buckets, aligned to
+        the keys and the time buckets of the model (NaN where missing). The profiles are smoothed as done for the fit,
+        over the time buckets of their key, and compared with all the exemplars of their key at once. It returns the
+        KeyID x Date arrays of the clusters (-1 where the profile does not exist or the key has no clusters) and of the
+        similarities with the exemplars, together with the network cluster of each date (-1 if the network model is
+        not available)
+        """
+        exists = ~np.isnan(values).all(axis=2)
+        smoothValues = ds.smoothKeysArray(values, self.timeExists, ds.kernel(self.metadata["kernelHalfWidth"]))
+        profiles = np.where(np.isnan(smoothValues), 0.0, smoothValues) * self.timeExists[:, np.newaxis, :]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = np.einsum('knt,kct->knc', profiles, self._exemplarValues)
+            similarity /= np.sqrt((profiles * profiles).sum(axis=2)[:, :, np.newaxis] *
+                                  self._exemplarNorms[:, np.newaxis, :])
+        similarity[np.isnan(similarity)] = -np.inf
+        similarity[np.broadcast_to(self._exemplarMissing[:, np.newaxis, :], similarity.shape)] = -np.inf
+
+        labels = np.argmax(similarity, axis=2) if similarity.shape[2] else np.zeros(exists.shape, dtype=np.int64)
+        bestSimilarity = np.take_along_axis(similarity, labels[:, :, np.newaxis], axis=2)[:, :, 0] \
+            if similarity.shape[2] else np.full(exists.shape, -np.inf)
+        classified = exists & np.isfinite(bestSimilarity)
+        labels = np.where(classified, labels, -1)
+        bestSimilarity = np.where(classified, bestSimilarity, np.nan)
+
+        dayTypes = np.full(values.shape[1], -1, dtype=np.int64)
+        if len(self.networkDays):
+            for n in range(values.shape[1]):
+                both = exists[:, n][:, np.newaxis] & self.networkExists
+                same = both & (labels[:, n][:, np.newaxis] == self.networkLabels)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    networkSimilarity = np.nan_to_num(same.sum(axis=0) / both.sum(axis=0))
+                distances = np.exp(-networkSimilarity) - np.exp(-1)
+                dayTypes[n] = np.argmin(((self.networkCenters - distances) ** 2).sum(axis=1))
+
+        return labels, bestSimilarity, dayTypes
+
+    def alignedValues(self, keys, times, values):
+        """
+        The values of profiles given on other keys and time buckets put on the ones of the model (unknown keys and time
+        buckets are dropped, missing ones are NaN)
+        """
+        keyIndex = self.keys.get_indexer(pd.Index(keys).astype(str))
+        timeIndex = self.times.get_indexer(pd.Index(times))
+        knownKeys = keyIndex >= 0
+        knownTimes = timeIndex >= 0
+
+        aligned = np.full((len(self.keys), values.shape[1], len(self.times)), np.nan)
+        aligned[np.ix_(keyIndex[knownKeys], np.arange(values.shape[1]), timeIndex[knownTimes])] = \
+            values[np.ix_(knownKeys, np.arange(values.shape[1]), knownTimes)]
+
+        return aligned
+
+    @ins.instrumented
+    def classify(self, profileCube):
+        """
+        Batch classification of all the dates of a ProfileCube of raw (clean) profiles. It returns a table with the
+        cluster of each (KeyID, Date) profile and the similarity with its exemplar, and a table with the network
+        day-type of each date
+        """
+        labels, similarity, dayTypes = self.classifyValues(self.alignedValues(profileCube.keys, profileCube.times,
+                                                                              profileCube.values))
+        keyIndex, dateIndex = np.nonzero(labels >= 0)
+        keyClusters = pd.DataFrame({'KeyID': self.keys[keyIndex],
+                                    'Date': profileCube.dates[dateIndex],
+                                    'ClusterGroup': labels[keyIndex, dateIndex],
+                                    'ExemplarSimilarity': similarity[keyIndex, dateIndex]})
+        dayTypesDF = pd.DataFrame({'Date': profileCube.dates, 'ClusterGroup': dayTypes})
+
+        return keyClusters, dayTypesDF
+
+    def classifyDate(self, profilesForDate):
+        """
+        Classification of a single date given its raw profiles as a dataframe having the KeyIDs on the rows and the
+        time buckets on the columns. It returns the cluster of each key as a series (-1 if it cannot be classified)
+        and the network day-type of the date
+        """
+        values = profilesForDate.to_numpy(dtype=np.float64)[:, np.newaxis, :]
+        labels, similarity, dayTypes = self.classifyValues(self.alignedValues(profilesForDate.index,
+                                                                              profilesForDate.columns, values))
+
+        return pd.Series(labels[:, 0], index=self.keys, name='ClusterGroup'), int(dayTypes[0])
+
+
+# ==============================================================================================================
+#                                                 BUILD AND SAVE
+# ==============================================================================================================
+@ins.instrumented
+def buildClassifier(smoothDF, sectionClusterDF, sectionClusterCentersDF, networkModel, outlierCap, argOptions):
+    """
+    The model is built from the results of the clustering run: smoothed profiles, clusters and centers of each key
+    and, if the network clustering has been done (otherwise networkModel is None), the days, labels and centroids of
+    the NetworkDayTypeModel
+    """
+    keys = pd.Index(list(smoothDF.keys()))
+    times = pd.Index(sorted(set().union(*[df.index for df in smoothDF.values()])))
+    numberOfClusters = max([len(df.index) for df in sectionClusterCentersDF.values()] + [0])
+
+    timeExists = np.zeros((len(keys), len(times)), dtype=bool)
+    exemplars = np.full((len(keys), numberOfClusters, len(times)), np.nan)
+    for k, key in enumerate(keys):
+        timeIndex = times.get_indexer(smoothDF[key].index)
+        timeExists[k, timeIndex] = True
+        centers = sectionClusterCentersDF[key]['ClusterCenterIndex'].to_numpy(dtype=np.int64)
+        exemplars[k, :len(centers)][:, timeIndex] = smoothDF[key].values.T[centers]
+
+    networkDays = pd.DatetimeIndex([])
+    networkExists = np.zeros((len(keys), 0), dtype=bool)
+    networkKeyLabels = np.zeros((len(keys), 0), dtype=np.int64)
+    networkCenters = np.zeros((0, 0))
+    if networkModel is not None:
+        networkDays = networkModel.days
+        networkExists = np.zeros((len(keys), len(networkDays)), dtype=bool)
+        networkKeyLabels = np.full((len(keys), len(networkDays)), -1, dtype=np.int64)
+        for k, key in enumerate(keys):
+            dayIndex = networkDays.get_indexer(pd.to_datetime(sectionClusterDF[key]['Date']))
+            networkExists[k, dayIndex] = True
+            networkKeyLabels[k, dayIndex] = sectionClusterDF[key]['ClusterGroup'].to_numpy()
+        networkCenters = networkModel.centroids
+
+    metadata = {"outlierCap": None if outlierCap is None else float(outlierCap),
+                "TimeResolution": argOptions.TimeResolution,
+                "smoothingKernelPercentage": argOptions.smoothingKernelPercentage,
+                "kernelHalfWidth": max(x for x, y in ds.smoothingKernel(argOptions))}
+
+    return DayTypeClassifier(keys.astype(str), times, timeExists, exemplars, networkDays, networkExists,
+                             networkKeyLabels, networkCenters, metadata)
+
+
+def classifierPaths(modelDirectory, measureType):
+    return (os.path.join(modelDirectory, measureType + "_classifier.npz"),
+            os.path.join(modelDirectory, measureType + "_classifier.json"))
+
+
+def saveClassifier(model, modelDirectory, measureType):
+    """
+    Arrays are saved in a NumPy archive and the metadata in a JSON file beside it
+    """
+    os.makedirs(modelDirectory, exist_ok=True)
+    arraysPath, metadataPath = classifierPaths(modelDirectory, measureType)
+
+    with open(arraysPath, 'wb') as arraysFile:
+        np.savez(arraysFile,
+                 keys=model.keys.to_numpy(dtype=str),
+                 times=model.times.values,
+                 timeExists=model.timeExists,
+                 exemplars=model.exemplars,
+                 networkDays=model.networkDays.values.astype('datetime64[ns]'),
+                 networkExists=model.networkExists,
+                 networkLabels=model.networkLabels,
+                 networkCenters=model.networkCenters)
+
+    with open(metadataPath, 'w') as metadataFile:
+        json.dump(model.metadata, metadataFile, indent=1)
+
+
+def loadClassifier(modelDirectory, measureType):
+    arraysPath, metadataPath = classifierPaths(modelDirectory, measureType)
+
+    with open(metadataPath, 'r') as metadataFile:
+        metadata = json.load(metadataFile)
+
+    with np.load(arraysPath) as arrays:
+        return DayTypeClassifier(arrays['keys'], arrays['times'], arrays['timeExists'], arrays['exemplars'],
+                                 arrays['networkDays'], arrays['networkExists'], arrays['networkLabels'],
+                                 arrays['networkCenters'], metadata)
+
+
+# ==============================================================================================================
+#                                                      RUN
+# ==============================================================================================================
+def run(argOptions):
+    """
+    Command line classification of all the dates of the input file with the models saved into the model directory
+    """
+    models = {measureType: loadClassifier(argOptions.modelDirectory, measureType)
+              for measureType, column in (('Flow', argOptions.flow), ('Speed', argOptions.speed)) if column >= 0}
+
+    print("Reading input")
+    df = fr.readInputFile(argOptions)
+
+    print("Cleaning data")
+    # the dates are cleaned with the outlier caps of the fitted data
+    cleanDF, cap_flow, cap_speed, pivotKeyDateFlowDF, pivotKeyDateSpeedDF = dc.cleanData(
+        df, argOptions, *[models[m].metadata["outlierCap"] if m in models else None for m in ('Flow', 'Speed')])
+    del df
+
+    for measureType, model in models.items():
+        print(f"Classifying {measureType}")
+        with ins.measureScope(measureType):
+            keyClusters, dayTypes = model.classify(pc.buildProfileCube(cleanDF, measureType.lower()))
+            sr.writeTable(keyClusters, f"Classified_{measureType}_Cluster_Results")
+            sr.writeTable(dayTypes, f"Classified_{measureType}_Network_Results")
@@ -1,15 +1,81 @@
+import Instrumentation as ins
+import KPIsCalculation as kc
+import ParallelProcessing as pp
+import StageCache as sc
+
+import time
+import warnings
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
 from sklearn.cluster import AffinityPropagation
 from sklearn.cluster import KMeans
-import streamlit as st
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.metrics import silhouette_score
 
 
 # ==============================================================================================================
 #                                            CLUSTERING INDIVIDUAL KEY
 # ==============================================================================================================
-@st.cache
-def similarityMatrix(FinalSmoothedDataFrame):
+def similarityMatrixArray(values, dtype=np.float64, blockSize=2048, overlapNormalization=False):
+    """
+    Vectorized engine of the similarity matrix working on a 2-D array of shape dates x time buckets, where missing
+    values are NaN. The profiles are zero-filled and a validity mask is kept aside, so that the dot products among all
+    the profiles are obtained by matrix products instead of pairwise loops. With the default normalization each dot
+    product is divided by the sqrt of the full norms of the two profiles, as done historically. With the overlap
+    normalization the norms are computed only where both profiles are defined, via the masked product of the squared
+    values with the validity mask.
+    The rows of the matrix are computed block by block (blockSize dates at a time) so that the temporary arrays stay
+    bounded when the number of dates is large. The float32 dtype halves memory and doubles the matmul throughput at
+    the cost of precision. On the diagonal it will be set the value of 1
+    """
+    validity = ~np.isnan(values)
+    profiles = np.where(validity, values, 0.0).astype(dtype, copy=False)
+    squares = profiles * profiles
+    mask = validity.astype(dtype)
+    norms = squares.sum(axis=1)
+
+    size = profiles.shape[0]
+    blockSize = max(1, int(blockSize))
+    similarity = np.empty((size, size), dtype=dtype)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, size, blockSize):
+            stop = min(start + blockSize, size)
+            dotProducts = profiles[start:stop] @ profiles.T
+            if overlapNormalization:
+                # norms of the block rows and of all the columns restricted to the common defined time buckets
+                rowNorms = squares[start:stop] @ mask.T
+                columnNorms = mask[start:stop] @ squares.T
+                denominator = rowNorms * columnNorms
+            else:
+                # M1 and M2 should never be 0 if it happens it means we have to handle better the cleaning
+                denominator = np.outer(norms[start:stop], norms)
+            similarity[start:stop] = dotProducts / np.sqrt(denominator)
+
+    np.fill_diagonal(similarity, 1.0)
+
+    return similarity
+
+
+def similarityRowsArray(newValues, values, dtype=np.float64):
+    """
+    Rows of the similarity matrix between some new profiles and the existing ones (2-D arrays of shape dates x time
+    buckets, NaN where missing), i.e. the rows/columns the similarity matrix of similarityMatrixArray would gain by
+    adding the new profiles, with the same (default) normalization
+    """
+    newProfiles = np.nan_to_num(newValues).astype(dtype, copy=False)
+    profiles = np.nan_to_num(values).astype(dtype, copy=False)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (newProfiles @ profiles.T) / np.sqrt(np.outer((newProfiles * newProfiles).sum(axis=1),
+                                                             (profiles * profiles).sum(axis=1)))
+
+
+@sc.stage(ignore=("blockSize",))
+def similarityMatrix(FinalSmoothedDataFrame, dtype=np.float64, blockSize=2048):
     """
     The function will compute the similarity matrix among all the profiles of one ID element via a correlation
     measure. The dot product between two profiles will be done, only where both are defined, and normalized with
@@ -17,44 +83,233 @@ def similarityMatrix(FinalSmoothedDataFrame):
     The matrix is clearly symmetric and on the diagonal it will be set the value of 1
     """
     dates = FinalSmoothedDataFrame.columns
-    values = FinalSmoothedDataFrame.values.T
-    size = len(dates)
-    similarity_matrix = []
-    for k in range(0, size):
-        correlation = []
-        M1 = (np.nansum(values[k] ** 2))
-        for j in range(0, size):
-            if k == j:
-                value = 1.0
-            else:
-                H = np.nansum(values[k] * values[j])
-                M2 = (np.nansum(values[j] ** 2))
-                # M1 and M2 should never be 0 if it happens it means we have to handle better the cleaning
-                value = H / ((M1 * M2) ** .5)
-            correlation.append(value)
-        similarity_matrix.append(correlation)
+    similarity_matrix = similarityMatrixArray(FinalSmoothedDataFrame.values.T, dtype=dtype, blockSize=blockSize)
 
     similarityDF = pd.DataFrame(similarity_matrix, index=dates, columns=dates)
 
     return similarityDF
 
 
-def IndividualDetectorClusteringResult(FinalSmoothedDataFrame):
+def affinityPropagationModel():
     """
-    This function will perform the affinity propagation clustering returning a dictionary of KeyID and dataframes
-    where for each date is associated the cluster id obtained. Moreover the indexes of the centroids of each cluster
-    are returned.
+    Affinity propagation on a precomputed similarity matrix. The random state, used by scikit-learn only to add a tiny
+    noise to the similarities, is fixed to 0 (the seed older versions hard code) so that results are reproducible
+    """
+    model = AffinityPropagation(affinity='precomputed')
+    if 'random_state' in model.get_params():
+        model.set_params(random_state=0)
+
+    return model
+
+
+def consecutiveLabels(labels):
+    """
+    Cluster labels renumbered as 0, 1, 2, ... in order of first appearance, so that no cluster is empty
+    """
+    uniqueLabels, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+
+    return order[inverse]
+
+
+def medoidCenters(similarity, labels):
+    """
+    The center of each cluster is its member having the highest total similarity with the other members
+    """
+    similarity = np.nan_to_num(similarity)
+    centers = []
+    for c in range(labels.max() + 1):
+        members = np.flatnonzero(labels == c)
+        centers.append(members[np.argmax(similarity[np.ix_(members, members)].sum(axis=1))])
+
+    return np.asarray(centers, dtype=np.int64)
+
+
+def miniBatchKMeansClustering(profiles, numberOfClusters):
+    """
+    MiniBatchKMeans on the profiles normalized to unit norm, so that the euclidean distance is a monotonic function of
+    the similarity used by the other backends. It never builds the dates x dates matrix. The center of each cluster is
+    the member nearest to the centroid
+    """
+    values = np.nan_to_num(profiles)
+    norms = np.sqrt((values * values).sum(axis=1))
+    normalized = values / np.where(norms > 0, norms, 1.0)[:, np.newaxis]
+
+    model = MiniBatchKMeans(n_clusters=numberOfClusters, n_init=3, batch_size=256, random_state=0)
+    centroidLabels = model.fit_predict(normalized)
+    # only the distance of each profile from the centroid of its own cluster is needed, not the ones from all of them
+    squaredDistances = ((normalized - model.cluster_centers_[centroidLabels]) ** 2).sum(axis=1)
+
+    labels = consecutiveLabels(centroidLabels)
+    centers = [np.flatnonzero(labels == c)[np.argmin(squaredDistances[labels == c])] for c in range(labels.max() + 1)]
+
+    return labels, np.asarray(centers, dtype=np.int64)
+
+
+def profileLinkageArray(similarity):
+    """
+    Average linkage dendrogram of the profiles on the correlation distance, i.e. 1 - similarity
+    """
+    distance = np.clip(1.0 - np.nan_to_num(similarity), 0.0, None)
+    distance = (distance + distance.T) / 2
+    np.fill_diagonal(distance, 0.0)
+
+    return hierarchy.linkage(squareform(distance, checks=False), method='average')
+
+
+def kMedoidsClustering(similarity, numberOfClusters, maximumIterations=100):
+    """
+    K-medoids on the correlation distance. The medoids are initialized greedily, adding each time the date which
+    reduces the most the total distance of the dates from their nearest medoid (as PAM does), then dates are assigned
+    to the nearest medoid and each medoid is moved to the member of its cluster with the lowest total distance from
+    the others, until nothing changes (or the maximum number of iterations is reached, in which case it is not
+    converged). It is deterministic.
+    """
+    distance = np.clip(1.0 - np.nan_to_num(similarity), 0.0, None)
+
+    medoids = [int(np.argmin(distance.sum(axis=1)))]
+    nearest = distance[medoids[0]]
+    while len(medoids) < numberOfClusters:
+        candidate = int(np.argmin(np.minimum(nearest[np.newaxis, :], distance).sum(axis=1)))
+        if candidate in medoids:
+            break
+        medoids.append(candidate)
+        nearest = np.minimum(nearest, distance[candidate])
+
+    medoids = np.asarray(medoids, dtype=np.int64)
+    for _ in range(maximumIterations):
+        labels = np.argmin(distance[:, medoids], axis=1)
+        labels[medoids] = np.arange(len(medoids))
+        newMedoids = medoids.copy()
+        for c in range(len(medoids)):
+            members = np.flatnonzero(labels == c)
+            newMedoids[c] = members[np.argmin(distance[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(newMedoids, medoids):
+            return labels, medoids, True
+        medoids = newMedoids
+
+    return labels, medoids, False
+
+
+def clusterSimilarity(profiles, similarity, backend="affinityPropagation", numberOfClusters=8, linkageMatrix=None):
+    """
+    Clustering engine of clusterProfiles, given also the similarity matrix of the profiles (it can be None for the
+    miniBatchKMeans backend, which does not use it). It returns the cluster label of each date, the indexes of the
+    dates being the centers of the clusters and whether the clustering converged (affinity propagation may not
+    converge, in which case it has no clusters, and k-medoids may stop at the maximum number of iterations)
+    """
+    if backend == "miniBatchKMeans":
+        return miniBatchKMeansClustering(profiles, max(1, min(int(numberOfClusters), len(profiles)))) + (True,)
+
+    if backend == "affinityPropagation":
+        with warnings.catch_warnings(record=True) as caughtWarnings:
+            warnings.simplefilter('always', category=ConvergenceWarning)
+            clustering = affinityPropagationModel().fit(similarity)
+        converged = len(clustering.cluster_centers_indices_) > 0 and clustering.n_iter_ < clustering.max_iter and \
+            not any(issubclass(w.category, ConvergenceWarning) for w in caughtWarnings)
+        return clustering.labels_, clustering.cluster_centers_indices_, converged
+
+    numberOfClusters = max(1, min(int(numberOfClusters), len(profiles)))
+    if len(profiles) == 1:
+        return np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), True
+
+    if backend == "agglomerative":
+        if linkageMatrix is None:
+            linkageMatrix = profileLinkageArray(similarity)
+        labels = consecutiveLabels(hierarchy.fcluster(linkageMatrix, numberOfClusters, criterion='maxclust'))
+        return labels, medoidCenters(similarity, labels), True
+
+    if backend == "kMedoids":
+        return kMedoidsClustering(similarity, numberOfClusters)
+
+    raise Exception("CLUSTERING ERROR: ", f"unknown clustering backend {backend}")
+
+
+def clusterProfiles(profiles, backend="affinityPropagation", numberOfClusters=8, linkageMatrix=None):
+    """
+    Clustering of the profiles of a single KeyID given as a 2-D array of shape dates x time buckets. It returns the
+    cluster label of each date and the indexes of the dates being the centers of the clusters, whatever the backend:
+    - affinityPropagation = on the precomputed similarity matrix, it finds by itself the number of clusters
+    - miniBatchKMeans = on the normalized profiles
+    - agglomerative = cut of the average linkage dendrogram (which can be given, e.g. the cached one)
+    - kMedoids = on the correlation distance
+    For the backends other than affinity propagation the number of clusters is given (at most the number of dates) and
+    the centers are dates of the cluster (medoids) as for affinity propagation.
+    The function is defined at module level because it is the task run by the worker processes.
+    """
+    similarity = None if backend == "miniBatchKMeans" else similarityMatrixArray(profiles)
+    labels, centers, _ = clusterSimilarity(profiles, similarity, backend, numberOfClusters, linkageMatrix)
+
+    return labels, centers
+
+
+def clusterAndScoreProfiles(profiles, backend="affinityPropagation", numberOfClusters=8, linkageMatrix=None):
+    """
+    Clustering of the profiles of a single KeyID together with its quality, computed on the same similarity matrix
+    (see similarityQuality). It returns the labels, the centers and the tuple (converged, silhouette, center
+    similarity). Task run by the worker processes
+    """
+    similarity = similarityMatrixArray(profiles)
+    labels, centers, converged = clusterSimilarity(profiles, similarity, backend, numberOfClusters, linkageMatrix)
+
+    return labels, centers, (converged,) + similarityQuality(similarity, labels, centers)
+
+
+def profileLinkage(profiles):
+    """
+    Dendrogram of the profiles of a single KeyID, task run by the worker processes
+    """
+    return profileLinkageArray(similarityMatrixArray(profiles)) if len(profiles) > 1 else None
+
+
+@sc.stage(ignore=("numberOfWorkers",))
+def profileLinkages(FinalSmoothedDataFrame, numberOfWorkers=1):
+    """
+    The dendrograms of the profiles of all the keys. They are cached apart, so that changing the number of clusters of
+    the agglomerative backend only cuts again the same dendrograms.
+    """
+    profiles = [df.values.T for df in FinalSmoothedDataFrame.values()]
+
+    return pp.mapOverProfiles(profileLinkage, profiles, numberOfWorkers, taskNames=list(FinalSmoothedDataFrame.keys()))
+
+
+@sc.stage(ignore=("numberOfWorkers",))
+def profileClusterings(FinalSmoothedDataFrame, numberOfWorkers=1, backend="affinityPropagation", numberOfClusters=8):
+    """
+    The clustering of the profiles of each key (affinity propagation unless another backend is chosen, see
+    clusterProfiles) together with its quality, as a list with the labels, centers and quality of each key (see
+    clusterAndScoreProfiles) in the order of the keys.
+    Keys are independent, so with more than one worker they are spread across a pool of processes, reading the
+    profiles from shared memory. Results are collected in the order of the keys, so the output is identical to the
+    serial one.
+    """
+    profiles = [df.values.T for df in FinalSmoothedDataFrame.values()]
+    linkages = profileLinkages(FinalSmoothedDataFrame, numberOfWorkers) if backend == "agglomerative" \
+        else [None] * len(profiles)
+
+    return pp.mapOverProfiles(clusterAndScoreProfiles, profiles, numberOfWorkers,
+                              profileArguments=[(backend, numberOfClusters, linkage) for linkage in linkages],
+                              taskNames=list(FinalSmoothedDataFrame.keys()))
+
+
+@sc.stage(ignore=("numberOfWorkers", "clusterings"))
+def IndividualDetectorClusteringResult(FinalSmoothedDataFrame, numberOfWorkers=1, backend="affinityPropagation",
+                                       numberOfClusters=8, clusterings=None):
+    """
+    This function will perform the clustering of the profiles of each key returning a dictionary of KeyID and
+    dataframes where for each date is associated the cluster id obtained. Moreover the indexes of the centroids of
+    each cluster are returned.
+    The clusterings of the keys already computed by profileClusterings (with the same arguments) can be given, so
+    that they are not computed again.
     """
     individual_clustering = {}
     centers_clustering = {}
 
-    for keyID, df in FinalSmoothedDataFrame.items():
-        dates = df.columns
-        similarityDF = similarityMatrix(df)
+    if clusterings is None:
+        clusterings = profileClusterings(FinalSmoothedDataFrame, numberOfWorkers, backend, numberOfClusters)
 
-        clustering = AffinityPropagation(affinity='precomputed').fit(similarityDF)
-        labels = clustering.labels_
-        centers = clustering.cluster_centers_indices_
+    for (keyID, df), (labels, centers, quality) in zip(FinalSmoothedDataFrame.items(), clusterings):
+        dates = df.columns
 
         cluster_result = pd.DataFrame(zip(dates, labels), columns=['Date', 'ClusterGroup'])
         cluster_centers = pd.DataFrame(zip(range(0, len(centers)), centers), columns=['ClusterGroup', 'ClusterCenterIndex'])
@@ -65,10 +320,90 @@ def IndividualDetectorClusteringResult(FinalSmoothedDataFrame):
     return individual_clustering, centers_clustering
 
 
+def similarityQuality(similarity, labels, centers):
+    """
+    Quality of the clustering of the profiles of a single KeyID given their similarity matrix: silhouette score on
+    the correlation distance, i.e. 1 - similarity (NaN when it is not defined, i.e. with a single cluster or a cluster
+    for each date) and mean similarity of the profiles with the center of their cluster
+    """
+    similarity = np.nan_to_num(similarity)
+    clustered = (labels >= 0) & (labels < len(centers))
+    if not clustered.any():
+        return np.nan, np.nan
+
+    centerSimilarity = similarity[np.flatnonzero(clustered), np.asarray(centers, dtype=np.int64)[labels[clustered]]]
+
+    silhouette = np.nan
+    if clustered.all() and 2 <= len(np.unique(labels)) <= len(labels) - 1:
+        distance = np.clip(1.0 - similarity, 0.0, None)
+        np.fill_diagonal(distance, 0.0)
+        silhouette = silhouette_score(distance, labels, metric='precomputed')
+
+    return silhouette, centerSimilarity.mean()
+
+
+def clusteringQuality(profiles, labels, centers):
+    """
+    Quality of the clustering of the profiles of a single KeyID (see similarityQuality), task run by the worker
+    processes
+    """
+    return similarityQuality(similarityMatrixArray(profiles), labels, centers)
+
+
+def clusteringQualityTable(FinalSmoothedDataFrame, clusterings):
+    """
+    Table of the quality of the clustering of every key, given the results of profileClusterings: number of dates and
+    of clusters, convergence, silhouette score, mean similarity with the cluster centers and number of clusters made
+    of a single date
+    """
+    report = []
+    for (keyID, df), (labels, centers, (converged, silhouette, centerSimilarity)) in zip(FinalSmoothedDataFrame.items(),
+                                                                                          clusterings):
+        clusterSizes = np.bincount(labels[labels >= 0], minlength=len(centers))
+        report.append([keyID, len(labels), len(centers), bool(converged), silhouette, centerSimilarity,
+                       int((clusterSizes == 1).sum())])
+
+    return pd.DataFrame(report, columns=['KeyID', 'NumberOfDates', 'NumberOfClusters', 'Converged', 'Silhouette',
+                                         'CenterSimilarity', 'SingleDateClusters'])
+
+
+def clusteringBackendsReport(FinalSmoothedDataFrame, numberOfClusters, numberOfWorkers=1,
+                             backends=("affinityPropagation", "miniBatchKMeans", "agglomerative", "kMedoids")):
+    """
+    Timing and quality of each clustering backend on the same profiles, to choose the fastest acceptable one for the
+    size of the data. The time includes the dendrograms for the agglomerative backend (nothing is taken from the
+    cache). Quality is the mean over the keys of the silhouette score and of the similarity with the cluster centers,
+    together with the mean number of clusters per key and the number of keys left without clusters (e.g. when affinity
+    propagation does not converge)
+    """
+    profiles = [df.values.T for df in FinalSmoothedDataFrame.values()]
+
+    report = []
+    for backend in backends:
+        start = time.perf_counter()
+        results = pp.mapOverProfiles(clusterProfiles, profiles, numberOfWorkers,
+                                     profileArguments=[(backend, numberOfClusters, None)] * len(profiles),
+                                     taskNames=list(FinalSmoothedDataFrame.keys()))
+        seconds = time.perf_counter() - start
+
+        quality = np.array(pp.mapOverProfiles(clusteringQuality, profiles, numberOfWorkers,
+                                              profileArguments=results), dtype=np.float64).reshape(-1, 2)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            report.append([backend, seconds,
+                           np.nanmean(quality[:, 0]),
+                           np.nanmean(quality[:, 1]),
+                           np.mean([len(centers) for labels, centers in results]),
+                           sum(len(centers) == 0 for labels, centers in results)])
+
+    return pd.DataFrame(report, columns=['Backend', 'Seconds', 'Silhouette', 'CenterSimilarity', 'ClustersPerKey',
+                                         'KeysWithoutClusters'])
+
+
 # ==============================================================================================================
 #                                        CLUSTERING AT NETWORK LEVEL
 # ==============================================================================================================
-@st.cache
+@sc.stage()
 def networkSimilarityMatrix(singleLocationClusteringDF):
     """
     In order to perform a clustering for day-type definition at network level, if we will use Affinity algorithm (or
@@ -98,65 +433,53 @@ def networkSimilarityMatrix(singleLocationClusteringDF):
       Note that you can see such definition of the ratio of intersection of 1-0 strings over the cardinality of the
       corresponding biclique keyID set, so for a given intersection value the bigger is the size of the biclique the
       smaller is the similarity as naively expected
+
+    The incidence dataframe is not materialized: its ones are collected as a scipy sparse matrix, having a row for
+    each tuple (keyID,clusterGroupID), together with the sparse presence matrix of the keys over the days, so that
+    numerator and denominator are just the sparse products B'B and P'P.
     """
-    # rebuild the whole dataframe
+    # the set of days, sorted so that the order of the output (and the network clustering) is the same at each run
     setOfDays = set()
     for key in singleLocationClusteringDF:
-        for d in singleLocationClusteringDF[key]['Date'].unique():
+        for d in pd.to_datetime(singleLocationClusteringDF[key]['Date'].unique()):
             setOfDays.add(d.strftime("%Y-%m-%d"))
-
-    IDcol = []
-    ClusterCol = []
-    key2cluster2days = {}
-    for key in singleLocationClusteringDF:
-        key2cluster2days[key] = {}
-        for cl in singleLocationClusteringDF[key]['ClusterGroup'].unique():
-            IDcol.append(key)
-            ClusterCol.append(cl)
-            key2cluster2days[key][cl] = [d.strftime("%Y-%m-%d") for d in list(singleLocationClusteringDF[key][singleLocationClusteringDF[key]['ClusterGroup'] == cl]['Date'])]
-
-    # print(key2cluster2days)
-
-    tmpDF = pd.DataFrame(IDcol, columns=['KeyID'])
-    tmpDF['ClusterGroup'] = ClusterCol
-    for d in setOfDays:
-        tmpDF[d] = np.zeros(len(tmpDF.index))
-
-    for key in key2cluster2days:
-        for cl in key2cluster2days[key]:
-            for d in key2cluster2days[key][cl]:
-                indexRow = tmpDF.index[(tmpDF['KeyID'] == key) & (tmpDF['ClusterGroup'] == cl)].tolist()
-                tmpDF.at[indexRow[0], d] = 1.0
-
-    # print(tmpDF)
-
-    simNumerator = []
-    for d in setOfDays:
-        simNumerator.append(tmpDF[d].to_numpy())
-    num = np.asarray(simNumerator, dtype=np.float32)
-
-    # print(np.matmul(num, num.T))
-
-    pivotTmpDF = tmpDF.pivot_table(index=['KeyID'], values=list(setOfDays), aggfunc=lambda x: x.sum())
-    # print(pivotTmpDF)
-
-    simDenominator = []
-    for d in setOfDays:
-        simDenominator.append(pivotTmpDF[d].to_numpy())
-    den = np.asarray(simDenominator, dtype=np.float32)
-
-    # print(np.matmul(den, den.T))
-
-    similarityMatrixDays = np.nan_to_num(np.divide(np.matmul(num, num.T), np.matmul(den, den.T)))
-    # print(similarityMatrixDays)
-
-    similarityMatrixDaysDF = pd.DataFrame(similarityMatrixDays, index=list(setOfDays), columns=list(setOfDays))
-    # print(similarityMatrixDaysDF)
+    days = pd.Index(sorted(setOfDays))
+
+    incidenceRows = []
+    presenceRows = []
+    dayColumns = []
+    numberOfRows = 0
+    for keyNumber, df in enumerate(singleLocationClusteringDF.values()):
+        clusterCodes, clusters = pd.factorize(df['ClusterGroup'])
+        incidenceRows.append(numberOfRows + clusterCodes)
+        presenceRows.append(np.full(len(df.index), keyNumber))
+        dayColumns.append(days.get_indexer(pd.to_datetime(df['Date']).dt.strftime("%Y-%m-%d")))
+        numberOfRows += len(clusters)
+
+    incidenceRows = np.concatenate(incidenceRows) if incidenceRows else np.zeros(0, dtype=int)
+    presenceRows = np.concatenate(presenceRows) if presenceRows else np.zeros(0, dtype=int)
+    dayColumns = np.concatenate(dayColumns) if dayColumns else np.zeros(0, dtype=int)
+    ones = np.ones(len(dayColumns), dtype=np.float32)
+
+    incidence = sparse.csr_matrix((ones, (incidenceRows, dayColumns)), shape=(numberOfRows, len(days)))
+    presence = sparse.csr_matrix((ones, (presenceRows, dayColumns)),
+                                 shape=(len(singleLocationClusteringDF), len(days)))
+    # an entry is a one even if the same day is given twice
+    incidence.data[:] = 1.0
+    presence.data[:] = 1.0
+
+    num = (incidence.T @ incidence).toarray()
+    den = (presence.T @ presence).toarray()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarityMatrixDays = np.nan_to_num(np.divide(num, den))
+
+    similarityMatrixDaysDF = pd.DataFrame(similarityMatrixDays, index=list(days), columns=list(days))
 
     return similarityMatrixDaysDF
 
 
-@st.cache
+@sc.stage()
 def networkDistanceMatrix(similarityMatrixDaysDF):
     """
     In order to perform a clustering for day-type definition at network level, we will use a K-mean algorithm (or
@@ -165,22 +488,75 @@ def networkDistanceMatrix(similarityMatrixDaysDF):
     """
     # you could try to implement other functions mapping the similarity to the distance, just taking care to
     # monotonic decreasing in similarity with proper boundary values
-    Network_Distance_Matrix = np.exp(-similarityMatrixDaysDF) - np.exp(-1)
+    # in double precision, so that the distance of a day from itself is exactly zero (the similarity is single
+    # precision and its exponential is not the same of exp(-1)), as the silhouette score requires
+    Network_Distance_Matrix = np.exp(-similarityMatrixDaysDF.astype(np.float64)) - np.exp(-1)
 
     return Network_Distance_Matrix
 
 
-def clusteringNetworkData(similarityMatrixDaysDF, numberOfClusters):
+def clusteringNetworkData(similarityMatrixDaysDF, numberOfClusters, numberOfInits=10):
     """
     The idea of such clustering is to define a set of day-types valid for the entire network starting from the profiles
     of flow or speed and having clustered them for each single location.
     """
     Network_Distance_Matrix = networkDistanceMatrix(similarityMatrixDaysDF)
 
-    clustering = KMeans(n_clusters=numberOfClusters, precompute_distances=True)
-    clustering.fit(Network_Distance_Matrix)
-    labels = clustering.labels_
+    labels = networkClusteringLabels(np.asarray(Network_Distance_Matrix, dtype=np.float64), numberOfClusters,
+                                     numberOfInits)
+
+    return networkClusterResult(similarityMatrixDaysDF, labels), labels
+
+
+@ins.instrumented
+def networkClusteringLabels(distances, numberOfClusters, numberOfInits=10):
+    """
+    K-Means of the days in the space of their distances from all the days, the best of numberOfInits
+    initializations. The seed is fixed so that the day-types do not change from run to run
+    """
+    clustering = KMeans(n_clusters=numberOfClusters, n_init=numberOfInits, random_state=0)
+
+    return clustering.fit(distances).labels_
+
 
-    cluster_result = pd.DataFrame(zip(pd.to_datetime(similarityMatrixDaysDF.columns), labels), columns=['Date', 'ClusterGroup'])
+def networkClusterResult(similarityMatrixDaysDF, labels):
+    return pd.DataFrame(zip(pd.to_datetime(similarityMatrixDaysDF.columns), labels), columns=['Date', 'ClusterGroup'])
 
-    return cluster_result, labels
+
+def networkClusteringScores(distances, numberOfClusters, numberOfInits):
+    """
+    K-Means of the days with the given number of clusters, the best of numberOfInits initializations, scored by the
+    network KPIs. Task run by the worker processes, all of them on the same distance matrix
+    """
+    labels = networkClusteringLabels(distances, numberOfClusters, numberOfInits)
+
+    return labels, kc.NetworkKpisIntegration(distances, labels)
+
+
+@sc.stage(ignore=("numberOfWorkers",))
+def selectNetworkClusters(distances, minimumClusters, maximumClusters, numberOfInits=10, numberOfWorkers=1):
+    """
+    Automatic choice of the number of network clusters: the K-Means of each number of clusters between
+    minimumClusters and maximumClusters (at most the number of days minus one, as needed by the silhouette score) are
+    run in parallel on the days x days distance array (see networkDistanceMatrix). The number of clusters with the
+    best silhouette score is chosen (the smallest one in case of ties).
+    It returns the number of clusters chosen, its labels, its network KPIs and the score curve, having a row for each
+    number of clusters with the network KPIs and a flag for the chosen one
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    numbersOfClusters = list(range(max(2, int(minimumClusters)), min(int(maximumClusters), len(distances) - 1) + 1))
+    if not numbersOfClusters:
+        raise Exception("CLUSTERING ERROR: ",
+                        f"no number of network clusters between {minimumClusters} and {maximumClusters} can be "
+                        f"evaluated on {len(distances)} days")
+
+    results = pp.mapOverArguments(networkClusteringScores, distances,
+                                  [(numberOfClusters, int(numberOfInits)) for numberOfClusters in numbersOfClusters],
+                                  numberOfWorkers)
+
+    scoreCurve = pd.DataFrame([list(kpis['Value']) for labels, kpis in results], columns=list(results[0][1]['KPI']))
+    scoreCurve.insert(0, 'NumberOfClusters', numbersOfClusters)
+    best = int(np.argmax(scoreCurve['Silhoutte'].to_numpy()))
+    scoreCurve['Selected'] = scoreCurve.index == best
+
+    return numbersOfClusters[best], results[best][0], results[best][1], scoreCurve
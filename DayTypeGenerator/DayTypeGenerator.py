@@ -1,26 +1,118 @@
 import FileReader as fr
+import Instrumentation as ins
 import utils as ut
 import DataCleansing as dc
 import DataAnalysis as da
-import DataSmoothing as ds
-import DayTypeClustering as dtc
-import KPIsCalculation as kc
-import SummaryReports as sr
+import BatchPipeline as bp
+import PlotData as pld
+import StageCache as sc
+import collections
 import pandas as pd
 import streamlit as st
 
+# The web-app is split into computation and view: the pipeline is run (and its results exported) once for each
+# configuration, and its results are kept in memory keyed by the fingerprint of the configuration. Streamlit reruns
+# the whole script at each interaction with a widget, but the reruns with the same configuration only slice the kept
+# results: nothing is recomputed and no results file is written again.
+# The results are kept in the state of the browser session, so that concurrent sessions never share them (the
+# histograms are added to them when first drawn); the stages of the pipeline are still shared by the sessions
+# through the memory cache of StageCache.
 
-def processSingleMeasure(rawDataframe, cleanDataframe, pivotKeyDateDF, dataframeColumnIndex,
-                         measureType, measureUnit, thresholdPercentage, thresholdValue, argOptions):
+# number of configurations whose results are kept by each session
+_pipelineResultsLimit = 4
+
+# options not changing the results of the pipeline
+_viewIgnoredOptions = ("GUI", "conf", "numberOfWorkers", "cacheDirectory", "cacheSizeMB", "runReport", "profileStage",
+                       "maximumHeatmapCells")
+
+
+class PipelineResults:
+    """
+    Results of the pipeline for one configuration: the raw and clean data with their outlier caps and counts of the
+    values by key and date (needed only by the charts) and the results of each measure (see
+    BatchPipeline.MeasureResults). The histograms of the raw data, over the whole range of the values or only up to
+    the outlier cap of the measure, are computed the first time they are drawn
+    """
+
+    def __init__(self, rawDataframe, cleanDataframe, caps, pivotKeyDateDFs):
+        self.rawDataframe = rawDataframe
+        self.cleanDataframe = cleanDataframe
+        self.caps = caps
+        self.pivotKeyDateDFs = pivotKeyDateDFs
+        self.measures = {}
+        self.histograms = {}
+
+    def histogram(self, measureType, columnIndex, upToCap=False):
+        if (measureType, upToCap) not in self.histograms:
+            self.histograms[(measureType, upToCap)] = pld.histogramData(
+                self.rawDataframe.iloc[:, columnIndex].to_numpy(), self.caps[measureType] if upToCap else None)
+        return self.histograms[(measureType, upToCap)]
+
+
+def computePipeline(argOptions):
+    """
+    Computation and export of the results of all the measures of the configuration, together with the run report
+    """
+    print("Reading input")
+    df = fr.readInputFile(argOptions)
+
+    print("Cleaning data")
+    cleanDF, cap_flow, cap_speed, pivotKeyDateFlowDF, pivotKeyDateSpeedDF = dc.cleanData(df, argOptions)
+    pipeline = PipelineResults(df, cleanDF, {'Flow': cap_flow, 'Speed': cap_speed},
+                               {'Flow': pivotKeyDateFlowDF, 'Speed': pivotKeyDateSpeedDF})
+
+    for measureType, column in (('Flow', argOptions.flow), ('Speed', argOptions.speed)):
+        if column >= 0:
+            print(f"Processing {measureType}")
+            with ins.measureScope(measureType):
+                results = bp.computeSingleMeasure(cleanDF, measureType, argOptions)
+                bp.exportSingleMeasure(results, argOptions, pipeline.caps[measureType])
+            pipeline.measures[measureType] = results
+
+    ins.writeRunReport(argOptions)
+
+    return pipeline
+
+
+def pipelineResults(argOptions):
+    """
+    The results of the configuration, computed only the first time the configuration is seen by the session. The
+    results of the last configurations are kept, the most recently used last
+    """
+    key = sc.optionsFingerprint(argOptions, _viewIgnoredOptions)
+    if "pipelineResults" not in st.session_state:
+        st.session_state["pipelineResults"] = collections.OrderedDict()
+    sessionResults = st.session_state["pipelineResults"]
+
+    pipeline = sessionResults.get(key)
+    if pipeline is None:
+        pipeline = computePipeline(argOptions)
+        sessionResults[key] = pipeline
+        while len(sessionResults) > _pipelineResultsLimit:
+            sessionResults.popitem(last=False)
+    sessionResults.move_to_end(key)
+
+    return pipeline
+
+
+def showSingleMeasure(pipeline, results, dataframeColumnIndex, measureUnit, thresholdPercentage, argOptions):
     """
     INPUT notes:
-    - measureType = can be ONLY   Speed|Flow
+    - results = the results of the measure (see BatchPipeline.MeasureResults), only sliced by the widgets
     """
+    measureType = results.measureType
+    rawDataframe = pipeline.rawDataframe
+    cleanDataframe = pipeline.cleanDataframe
+    pivotKeyDateDF = pipeline.pivotKeyDateDFs[measureType]
+    thresholdValue = pipeline.caps[measureType]
+
     # ==============================================================================================================
     #                                               DATA ANALYSIS
     # ==============================================================================================================
-    da.DataAnalysisVisualization(data=rawDataframe, AnalysisType=measureType, unit=measureUnit,
-                                 threshold=thresholdPercentage, column_index=dataframeColumnIndex, cap=thresholdValue)
+    da.DataAnalysisVisualization(histogram=lambda upToCap: pipeline.histogram(measureType, dataframeColumnIndex,
+                                                                              upToCap),
+                                 AnalysisType=measureType, unit=measureUnit, threshold=thresholdPercentage,
+                                 cap=thresholdValue)
 
     st.write(da.DataAnalysisStatistics(data=rawDataframe, column_index=dataframeColumnIndex, title='Raw Data Statistic'))
 
@@ -28,31 +120,32 @@ def processSingleMeasure(rawDataframe, cleanDataframe, pivotKeyDateDF, dataframe
 
     da.PivotDataframeHeatmap(DataFrame=pivotKeyDateDF,
                              title=f'{measureType} Data Count Percentage - Max possible counts {ut.timeBucketNumber(argOptions.TimeResolution)}',
-                             timeBucketNumber=ut.timeBucketNumber(argOptions.TimeResolution))
+                             timeBucketNumber=ut.timeBucketNumber(argOptions.TimeResolution),
+                             maximumCells=int(argOptions.maximumHeatmapCells), key=measureType)
 
     # ==============================================================================================================
     #                                               DATA UNIQUE ENTRIES
     # ==============================================================================================================
-    # build the set of unique keys and the set of corresponding unique dates
-
-    uniqueDatesGivenAKey = {}
-    uniqueKeys = cleanDataframe[cleanDataframe[measureType.lower()] >= 0]['KeyID'].unique()
-    for key in uniqueKeys:
-        uniqueDatesGivenAKey[key] = cleanDataframe[(cleanDataframe['KeyID'] == key) & (cleanDataframe[measureType.lower()] >= 0)]['Date'].unique()
+    # the dense KeyID x Date x Time cube of the profiles, together with the set of unique keys and the set of
+    # corresponding unique dates
+    profileCube = results.profileCube
+    uniqueKeys = profileCube.keys
+    uniqueDatesGivenAKey = profileCube.datesGivenAKey()
 
     # ==============================================================================================================
     #                                               DATA SMOOTHING
     # ==============================================================================================================
     st.subheader("Data Smoothing")
-    smoothDF = ds.smoothDataframe(cleanDataframe, argOptions, uniqueDatesGivenAKey, dataframeColumnIndex)
+    smoothDF = results.smoothDF
 
     # plot raw and smooth profiles
     IDOption = st.selectbox("Key ID", uniqueKeys, key='IDOption'+measureType)
-    DateOption = st.selectbox("Date", uniqueDatesGivenAKey[IDOption], key='DateOption'+measureType)
-    da.plotSeriesOriginalAndSmooth(smoothDF[IDOption].index,
-                                   cleanDataframe[(cleanDataframe['KeyID'] == IDOption) & (cleanDataframe['Date'] == DateOption)][measureType.lower()],
+    DateOption = st.selectbox("Date", uniqueDatesGivenAKey[IDOption], key='DateOption'+measureType,
+                              format_func=lambda d: d.strftime("%Y-%m-%d"))
+    da.plotSeriesOriginalAndSmooth(ut.timeBucketLabels(smoothDF[IDOption].index, argOptions.TimeResolution),
+                                   profileCube.profile(IDOption, DateOption),
                                    smoothDF[IDOption][DateOption],
-                                   "Key ID = " + str(IDOption) + " ; Date = " + str(DateOption),
+                                   "Key ID = " + str(IDOption) + " ; Date = " + DateOption.strftime("%Y-%m-%d"),
                                    measureUnit)
 
     # ==============================================================================================================
@@ -61,7 +154,9 @@ def processSingleMeasure(rawDataframe, cleanDataframe, pivotKeyDateDF, dataframe
     if argOptions.enableProfileClustering:
         st.subheader("Clustering Single Measurement Sections")
 
-        sectionClusterDF, sectionClusterCentersDF = dtc.IndividualDetectorClusteringResult(smoothDF)
+        sectionClusterDF = results.sectionClusterDF
+        sectionClusterCentersDF = results.sectionClusterCentersDF
+        qualityTable = results.qualityTable
         numberOfClusters = [len(df.index) for df in sectionClusterCentersDF.values()]
         st.write(da.DataAnalysisStatistics(data=pd.DataFrame(numberOfClusters), column_index=0,
                                            title='Statistic of Number of Clusters'))
@@ -71,6 +166,9 @@ def processSingleMeasure(rawDataframe, cleanDataframe, pivotKeyDateDF, dataframe
                                       xlabel="Key ID",
                                       ylabel="Number of Clusters")
 
+        st.subheader("Clustering Quality of the Keys (worst first)")
+        st.write(qualityTable)
+
         IDOptionCluster = st.selectbox("Key ID", uniqueKeys, key='IDOptionCluster'+measureType)
 
         da.CalendarHeatMap(sectionClusterDF[IDOptionCluster],
@@ -87,61 +185,37 @@ def processSingleMeasure(rawDataframe, cleanDataframe, pivotKeyDateDF, dataframe
 
         dates = list(sectionClusterDF[IDOptionCluster][sectionClusterDF[IDOptionCluster]['ClusterGroup'] == clusterOption]['Date'])
 
-        da.plotSeriesClusterOriginal(smoothDF[IDOption].index, cleanDataframe, IDOptionCluster, dates,
+        timeLabels = ut.timeBucketLabels(smoothDF[IDOptionCluster].index, argOptions.TimeResolution)
+        da.plotSeriesClusterOriginal(timeLabels, profileCube, IDOptionCluster, dates,
                                      title='Original Profiles ' + "(Key ID = " + str(IDOptionCluster) + " - Cluster ID = " + str(clusterOption) +")",
-                                     ylabel=measureUnit,
-                                     measureType=measureType)
-        da.plotSeriesClusterSmoothed(smoothDF[IDOption].index, smoothDF, IDOptionCluster, dates,
+                                     ylabel=measureUnit)
+        da.plotSeriesClusterSmoothed(timeLabels, smoothDF, IDOptionCluster, dates,
                                      title='Smoothed Profiles' + "(Key ID = " + str(IDOptionCluster) + " - Cluster ID = " + str(clusterOption) +")",
                                      ylabel=measureUnit)
-        da.plotBoxPlotClusterSmoothed(smoothDF, sectionClusterCentersDF, IDOptionCluster, clusterOption, dates,
+        da.plotBoxPlotClusterSmoothed(timeLabels, smoothDF, sectionClusterCentersDF, IDOptionCluster, clusterOption, dates,
                                       title='Box-Plot Smoothed Profiles' + "(Key ID = " + str(IDOptionCluster) + " - Cluster ID = " + str(clusterOption) +")",
                                       ylabel=measureUnit)
 
         # ==============================================================================================================
         #                                               CALCULATING KPIs
         # ==============================================================================================================
-        MAE_singleKey = kc.KPI(smoothDF, sectionClusterDF, sectionClusterCentersDF, "MAE")
-        MAPE_singleKey = kc.KPI(smoothDF, sectionClusterDF, sectionClusterCentersDF, "MAPE")
-        MSE_singleKey = kc.KPI(smoothDF, sectionClusterDF, sectionClusterCentersDF, "MSE")
-        RMSE_singleKey = kc.KPI(smoothDF, sectionClusterDF, sectionClusterCentersDF, "RMSE")
+        singleKeyKPIs = results.singleKeyKPIs
 
-        kpi_summary = kc.KPIsSummaryTable([MAE_singleKey[IDOptionCluster],
-                                           MAPE_singleKey[IDOptionCluster],
-                                           MSE_singleKey[IDOptionCluster],
-                                           RMSE_singleKey[IDOptionCluster]])
+        kpi_summary = singleKeyKPIs[singleKeyKPIs['KeyID'] == IDOptionCluster].drop(columns='KeyID').reset_index(drop=True)
 
         st.subheader(f'KPI Summary Table KeyID: {IDOptionCluster}')
         st.write(kpi_summary)
 
-        # ==============================================================================================================
-        #                                              EXPORT CSV RESULTS
-        # ==============================================================================================================
-        sr.DetectorClusterSummaryCSV(sectionClusterDF, '.\\Results\\Individual_Cluster_Results.csv')
-
-        kpi_summary = pd.DataFrame(columns=['KeyID', 'MAE', 'MAPE', 'MSE', 'RMSE'])
-        kpi_summary.to_csv(".\\Results\\Individual_Cluster_KPIs.csv", index=False, mode="w", header=True)
-        for key in uniqueKeys:
-            kpi_summary = kc.KPIsSummaryTable([MAE_singleKey[key],
-                                               MAPE_singleKey[key],
-                                               MSE_singleKey[key],
-                                               RMSE_singleKey[key]])
-            kpi_summary["KeyID"] = key
-            kpi_summary.to_csv(".\\Results\\Individual_Cluster_KPIs.csv",
-                               columns=['KeyID', 'MAE', 'MAPE', 'MSE', 'RMSE'],
-                               index=False, mode="a", header=False)
-
     # ==============================================================================================================
     #                                        CLUSTERING AT NETWORK LEVEL
     # ==============================================================================================================
     if argOptions.enableNetworkClustering:
         st.subheader("Clustering at Network Level for Day-Type Definition")
 
-        #TODO: make the K selection via elbow logic or sihlouette avg score
-        networkclusterResult, network_labels = dtc.clusteringNetworkData(dtc.networkSimilarityMatrix(sectionClusterDF),
-                                                         numberOfClusters=argOptions.KmeansNumberOfFlowCluster)
+        networkModel = results.networkModel
+        networkclusterResult = networkModel.clusterResult
 
-        da.CalendarHeatMap(networkclusterResult, title='Cluster Calendar Heatmap', measureType=measureType)
+        da.CalendarHeatMap(networkclusterResult, title='Cluster Calendar Heatmap', measureType='Network' + measureType)
 
         da.plotClusterParallelByClusterID(networkclusterResult, title='Cluster Associations by Cluster-ID')
 
@@ -150,38 +224,23 @@ def processSingleMeasure(rawDataframe, cleanDataframe, pivotKeyDateDF, dataframe
         # ==============================================================================================================
         #                                               CALCULATING KPIs
         # ==============================================================================================================
-        pairwise_distance = dtc.networkDistanceMatrix(dtc.networkSimilarityMatrix(sectionClusterDF))
-        network_kpis_summary = kc.NetworkKpisIntegration(pairwise_distance, network_labels)
-
         st.subheader("Network-Wide KPIs Summary Table")
-        st.write(network_kpis_summary)
-
-        # ==============================================================================================================
-        #                                              EXPORT CSV RESULTS
-        # ==============================================================================================================
-        sr.NetworkClusterSummaryCSV(networkclusterResult, '.\\Results\\Network_Cluster_Results.csv')
+        st.write(networkModel.kpis)
 
-        network_kpis_summary.to_csv(".\\Results\\Network_Cluster_KPIs.csv", index=False)
+        if networkModel.scoreCurve is not None:
+            st.subheader("Selection of the Number of Network Clusters")
+            st.write(networkModel.scoreCurve)
+            st.line_chart(networkModel.scoreCurve.set_index('NumberOfClusters')['Silhoutte'])
 
 
 def run(argOptions):
-    print("Reading input")
-    df = fr.readInputFile(argOptions)
+    pipeline = pipelineResults(argOptions)
     st.subheader('Raw Data Sample (first 100 rows)')
-    st.dataframe(df.head(100))
-
-    print("Cleaning data")
-    cleanDF, cap_flow, cap_speed, pivotKeyDateFlowDF, pivotKeyDateSpeedDF = dc.cleanData(df, argOptions)
-
-    if argOptions.flow >= 0:
-        print("Processing Flow")
-        processSingleMeasure(rawDataframe=df, cleanDataframe=cleanDF, pivotKeyDateDF=pivotKeyDateFlowDF,
-                             dataframeColumnIndex=argOptions.flow, measureType='Flow', measureUnit='Veh/h',
-                             thresholdPercentage=argOptions.flowThreshold, thresholdValue=cap_flow,
-                             argOptions=argOptions)
-    if argOptions.speed >= 0:
-        print("Processing Speed")
-        processSingleMeasure(rawDataframe=df, cleanDataframe=cleanDF, pivotKeyDateDF=pivotKeyDateSpeedDF,
-                             dataframeColumnIndex=argOptions.speed, measureType='Speed', measureUnit='Km/h',
-                             thresholdPercentage=argOptions.speedThreshold, thresholdValue=cap_speed,
-                             argOptions=argOptions)
+    st.dataframe(pipeline.rawDataframe.head(100))
+
+    if 'Flow' in pipeline.measures:
+        showSingleMeasure(pipeline, pipeline.measures['Flow'], dataframeColumnIndex=argOptions.flow,
+                          measureUnit='Veh/h', thresholdPercentage=argOptions.flowThreshold, argOptions=argOptions)
+    if 'Speed' in pipeline.measures:
+        showSingleMeasure(pipeline, pipeline.measures['Speed'], dataframeColumnIndex=argOptions.speed,
+                          measureUnit='Km/h', thresholdPercentage=argOptions.speedThreshold, argOptions=argOptions)
@@ -1,15 +1,27 @@
+import StageCache as sc
+
+from functools import reduce
+import numpy as np
 import pandas as pd
-import streamlit as st
+from pandas.api.types import union_categoricals
 
 
-@st.cache
+@sc.stage(options=("format", "compression", "fileSeparator", "header", "ID1", "ID2", "timestamp", "flow", "speed",
+                   "flowFactor", "speedFactor", "keyFilter", "startDate", "endDate"),
+          fileOptions=("inputFile",))
 def readInputFile(argOptions):
     if argOptions.format == "csv":
         df = readInputFileCSV(argOptions)
+    elif argOptions.format in ("parquet", "feather"):
+        df = readInputFileColumnar(argOptions)
     return df
 
 
-def readInputFileCSV(argOptions):
+def columnMapping(argOptions):
+    """
+    Mapping between the standard column names and the column indexes given by the user (sorted by index, so that the
+    names can be set in the order the columns are read), together with the types of the non-timestamp columns
+    """
     columnIndex = {"ID1": argOptions.ID1,
                    "ID2": argOptions.ID2,
                    "timestamp": argOptions.timestamp,
@@ -26,23 +38,195 @@ def readInputFileCSV(argOptions):
     dtypes = {}
     for key, value in columnIndex.items():
         if int(value) >= 0:
-            columnNames[key] = value
+            columnNames[key] = int(value)
             if columnType[key] != "datetime":
-                dtypes[value] = columnType[key]
+                dtypes[int(value)] = columnType[key]
 
     # sort columns by value index so that we can set corresponding names
     columnNames = {k: v for k, v in sorted(columnNames.items(), key=lambda item: item[1])}
 
-    df = pd.read_csv(argOptions.inputFile,
-                     sep=argOptions.fileSeparator,
-                     header=(None if argOptions.header == "False" else 0),
-                     usecols=columnNames.values(),
-                     dtype=dtypes,
-                     parse_dates=[columnNames["timestamp"]],
-                     compression=(None if argOptions.compression == "None" else argOptions.compression))
+    return columnNames, dtypes
+
+
+def inputKeys(argOptions):
+    """
+    The list of KeyIDs (ID1 or ID1;ID2) the user wants to read, None if all of them
+    """
+    if not argOptions.keyFilter:
+        return None
+
+    return [key.strip() for key in str(argOptions.keyFilter).split(",") if key.strip()]
+
+
+def inputDateRange(argOptions):
+    """
+    The first and the last (excluded) day the user wants to read as timestamps, None where not given
+    """
+    startDate = pd.Timestamp(argOptions.startDate) if argOptions.startDate else None
+    endDate = pd.Timestamp(argOptions.endDate) + pd.Timedelta(days=1) if argOptions.endDate else None
+
+    return startDate, endDate
+
+
+def filterRows(df, argOptions):
+    """
+    Keep only the rows of the KeyIDs and of the date range asked by the user (standard column names are expected)
+    """
+    keys = inputKeys(argOptions)
+    startDate, endDate = inputDateRange(argOptions)
+
+    keep = np.ones(len(df.index), dtype=bool)
+    if keys is not None:
+        if 'ID2' in df.columns:
+            keep &= (df['ID1'].astype(str) + ";" + df['ID2'].astype(str)).isin(keys).to_numpy()
+        else:
+            keep &= df['ID1'].astype(str).isin(keys).to_numpy()
+    if startDate is not None:
+        keep &= (df['timestamp'] >= startDate).to_numpy()
+    if endDate is not None:
+        keep &= (df['timestamp'] < endDate).to_numpy()
+
+    if keep.all():
+        return df
+
+    return df[keep].reset_index(drop=True)
+
+
+def readInputFileCSV(argOptions):
+    columnNames, dtypes = columnMapping(argOptions)
+
+    readOptions = dict(sep=argOptions.fileSeparator,
+                       header=(None if argOptions.header == "False" else 0),
+                       usecols=columnNames.values(),
+                       dtype=dtypes,
+                       parse_dates=[columnNames["timestamp"]],
+                       compression=(None if argOptions.compression == "None" else argOptions.compression))
+
+    if float(argOptions.memoryBudgetMB) > 0:
+        return readInputFileCSVChunked(argOptions, columnNames, readOptions)
+
+    df = pd.read_csv(argOptions.inputFile, **readOptions)
 
     # set standard column names
     df.columns = columnNames.keys()
+    df = filterRows(df, argOptions)
+
+    # column conversion operations
+    if 'flow' in columnNames:
+        df['flow'] *= argOptions.flowFactor
+    if 'speed' in columnNames:
+        df['speed'] *= argOptions.speedFactor
+
+    return df
+
+
+def chunkRowNumber(argOptions, readOptions, sampleRows=1000):
+    """
+    Number of rows of each chunk such that a parsed chunk stays within the memory budget, estimated from the memory
+    used by a small sample of the file
+    """
+    sample = pd.read_csv(argOptions.inputFile, nrows=sampleRows, **readOptions)
+    bytesPerRow = max(1.0, sample.memory_usage(index=False, deep=True).sum() / max(1, len(sample.index)))
+
+    return max(sampleRows, int(float(argOptions.memoryBudgetMB) * 2 ** 20 / bytesPerRow))
+
+
+def prepareChunk(chunk, columnNames, argOptions):
+    """
+    Operations done on each chunk as soon as it is parsed: rows out of the keys and dates asked by the user are dropped,
+    values are downcast to float32 and converted by the user factors, negative values are invalidated (as done by the
+    validity check of the cleaning) and the ID columns are stored as categorical
+    """
+    chunk.columns = columnNames.keys()
+    chunk = filterRows(chunk, argOptions)
+
+    for name, factor in (('flow', argOptions.flowFactor), ('speed', argOptions.speedFactor)):
+        if name in columnNames:
+            values = chunk[name].astype(np.float32) * np.float32(factor)
+            chunk[name] = values.mask(values < 0)
+
+    for name in ('ID1', 'ID2'):
+        if name in columnNames:
+            chunk[name] = chunk[name].astype('category')
+
+    return chunk
+
+
+def readInputFileCSVChunked(argOptions, columnNames, readOptions):
+    """
+    Bounded-memory reading of the CSV: the file is parsed in chunks whose size is given by the memory budget, each
+    chunk is reduced to its compact representation, and the columns are assembled at the end (categorical ID columns
+    are merged by union of their categories, so that they never go back to strings)
+    """
+    chunks = []
+    for chunk in pd.read_csv(argOptions.inputFile, chunksize=chunkRowNumber(argOptions, readOptions), **readOptions):
+        chunks.append(prepareChunk(chunk, columnNames, argOptions))
+
+    if not chunks:
+        return pd.DataFrame(columns=columnNames.keys())
+
+    columns = {}
+    for name in chunks[0].columns:
+        if isinstance(chunks[0][name].dtype, pd.CategoricalDtype):
+            columns[name] = union_categoricals([chunk[name] for chunk in chunks])
+        else:
+            columns[name] = np.concatenate([chunk[name].to_numpy() for chunk in chunks])
+        for chunk in chunks:
+            del chunk[name]
+
+    return pd.DataFrame(columns)
+
+
+def readInputFileColumnar(argOptions):
+    """
+    Reading of Parquet or Arrow IPC (Feather) input, a single file or a directory of files (also hive partitioned).
+    Columns are addressed by index exactly as for the CSV, using the schema of the dataset, and only the needed ones
+    are read. The KeyID and date range filters are pushed down to the dataset, so that the files, partitions or row
+    groups not matching them are skipped; the exact filtering is completed on the read rows.
+    """
+    try:
+        import pyarrow.dataset as pads
+    except ImportError:
+        raise Exception("READING ERROR: ", "pyarrow is needed to read " + argOptions.format + " input files")
+
+    columnNames, dtypes = columnMapping(argOptions)
+
+    dataset = pads.dataset(argOptions.inputFile, format=argOptions.format, partitioning="hive")
+    schemaNames = dataset.schema.names
+    projection = {key: schemaNames[index] for key, index in columnNames.items()}
+
+    # keys and timestamps stored with other types can only be filtered once read
+    pushedFilters = []
+    keys = inputKeys(argOptions)
+    if keys is not None and str(dataset.schema.field(projection["ID1"]).type) in ("string", "large_string"):
+        ID1values = {key.split(";")[0] for key in keys} if "ID2" in projection else set(keys)
+        pushedFilters.append(pads.field(projection["ID1"]).isin(sorted(ID1values)))
+
+    startDate, endDate = inputDateRange(argOptions)
+    if str(dataset.schema.field(projection["timestamp"]).type).startswith("timestamp"):
+        if startDate is not None:
+            pushedFilters.append(pads.field(projection["timestamp"]) >= startDate.to_pydatetime())
+        if endDate is not None:
+            pushedFilters.append(pads.field(projection["timestamp"]) < endDate.to_pydatetime())
+
+    # whole partitions written by convertCSVToParquet are skipped looking just at their month
+    if "partitionMonth" in schemaNames:
+        if startDate is not None:
+            pushedFilters.append(pads.field("partitionMonth") >= startDate.strftime("%Y-%m"))
+        if endDate is not None:
+            pushedFilters.append(pads.field("partitionMonth") <= (endDate - pd.Timedelta(days=1)).strftime("%Y-%m"))
+
+    pushedFilter = reduce(lambda left, right: left & right, pushedFilters) if pushedFilters else None
+
+    df = dataset.to_table(columns=list(projection.values()), filter=pushedFilter).to_pandas()
+
+    # set standard column names and the same types of the CSV reading
+    df.columns = columnNames.keys()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    for key, index in columnNames.items():
+        if index in dtypes:
+            df[key] = df[key].astype(dtypes[index])
+    df = filterRows(df, argOptions)
 
     # column conversion operations
     if 'flow' in columnNames:
@@ -51,3 +235,38 @@ def readInputFileCSV(argOptions):
         df['speed'] *= argOptions.speedFactor
 
     return df
+
+
+def convertCSVToParquet(argOptions, outputDirectory):
+    """
+    Converter of the input CSV file into a Parquet dataset partitioned by month, to avoid parsing the text timestamps
+    on every run. All the columns of the CSV are kept in the same order (the partition column is appended as the last
+    one) so that the same column indexes can be used to read the Parquet dataset. The values are stored raw: flow and
+    speed factors are applied while reading, as for the CSV. With a memory budget the CSV is converted in chunks.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("CONVERSION ERROR: ", "pyarrow is needed to write Parquet files")
+
+    columnNames, dtypes = columnMapping(argOptions)
+    readOptions = dict(sep=argOptions.fileSeparator,
+                       header=(None if argOptions.header == "False" else 0),
+                       dtype={index: dtype for index, dtype in dtypes.items() if dtype == "str"},
+                       parse_dates=[columnNames["timestamp"]],
+                       compression=(None if argOptions.compression == "None" else argOptions.compression))
+    if float(argOptions.memoryBudgetMB) > 0:
+        chunks = pd.read_csv(argOptions.inputFile, chunksize=chunkRowNumber(argOptions, readOptions), **readOptions)
+    else:
+        chunks = [pd.read_csv(argOptions.inputFile, **readOptions)]
+
+    numberOfRows = 0
+    for chunk in chunks:
+        chunk.columns = [str(c) for c in chunk.columns]
+        chunk['partitionMonth'] = chunk.iloc[:, columnNames["timestamp"]].dt.strftime("%Y-%m")
+        pq.write_to_dataset(pa.Table.from_pandas(chunk, preserve_index=False), outputDirectory,
+                            partition_cols=['partitionMonth'])
+        numberOfRows += len(chunk.index)
+
+    return numberOfRows
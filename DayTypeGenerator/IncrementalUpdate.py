@@ -0,0 +1,393 @@
+import BatchPipeline as bp
+import DataCleansing as dc
+import DataSmoothing as ds
+import DayTypeClustering as dtc
+import FileReader as fr
+import Instrumentation as ins
+import NetworkDayTypeModel as ndm
+import ProfileCube as pc
+import SummaryReports as sr
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Incremental update: the input file holds only the new day(s) of data, which are cleaned with the outlier caps of the
+# history, smoothed and assigned to the clusters already found for each key and at network level, without refitting.
+# The state of the fitted run of each measure (smoothed profiles, cluster labels, exemplars, network centroids) is kept
+# into the model directory and extended with the new days, so that a full refit can be done at any time from the state
+# itself, on demand or when too many of the new profiles are not explained by the current clusters (drift).
+
+
+class IncrementalState:
+    """
+    State of the fitted run of one measure:
+    - cube = the smoothed profiles of the history as a ProfileCube (its profiles are the ones of the raw data)
+    - labels = KeyID x Date matrix of the cluster of each profile of each key
+    - exemplars = for each key the date indexes of the exemplars of its clusters (by cluster number, padded with -1)
+    - similarityFloor = for each key the lowest similarity of a profile with the exemplar of its cluster, i.e. the
+      worst profile the clusters of the key have accepted
+    - networkDays = date indexes of the days clustered at network level, which are the features of the centroids
+    - networkCenters = centroids of the network clusters in the space of the distances from the networkDays
+    - networkLabels = network cluster of each date, -1 if the date has not been clustered
+    - metadata = outlier cap, options the state depends on and the counters of the profiles added since the last fit
+    """
+
+    def __init__(self, cube, labels, exemplars, similarityFloor, networkDays, networkCenters, networkLabels, metadata):
+        self.cube = cube
+        self.labels = labels
+        self.exemplars = exemplars
+        self.similarityFloor = similarityFloor
+        self.networkDays = networkDays
+        self.networkCenters = networkCenters
+        self.networkLabels = networkLabels
+        self.metadata = metadata
+
+    def driftPercentage(self):
+        profiles = self.metadata["profilesSinceFit"]
+
+        return 100.0 * self.metadata["unexplainedSinceFit"] / profiles if profiles else 0.0
+
+    def keyProfiles(self, k, dateIndexes):
+        """
+        Profiles of the key at position k for the given date indexes, restricted to the time buckets of the key
+        """
+        return self.cube.values[k][np.ix_(dateIndexes, self.cube.timeExists[k])]
+
+
+# ==============================================================================================================
+#                                                 STATE FILES
+# ==============================================================================================================
+def statePaths(modelDirectory, measureType):
+    return (os.path.join(modelDirectory, measureType + "_state.npz"),
+            os.path.join(modelDirectory, measureType + "_state.json"))
+
+
+def saveState(state, modelDirectory, measureType):
+    """
+    Arrays are saved in a NumPy archive and the metadata in a JSON file beside it
+    """
+    os.makedirs(modelDirectory, exist_ok=True)
+    arraysPath, metadataPath = statePaths(modelDirectory, measureType)
+
+    with open(arraysPath + ".tmp", 'wb') as arraysFile:
+        np.savez(arraysFile,
+                 keys=state.cube.keys.astype(str).to_numpy(dtype=str),
+                 dates=state.cube.dates.values.astype('datetime64[ns]'),
+                 times=state.cube.times.values,
+                 values=state.cube.values,
+                 profileExists=state.cube.profileExists,
+                 timeExists=state.cube.timeExists,
+                 labels=state.labels,
+                 exemplars=state.exemplars,
+                 similarityFloor=state.similarityFloor,
+                 networkDays=state.networkDays,
+                 networkCenters=state.networkCenters,
+                 networkLabels=state.networkLabels)
+    os.replace(arraysPath + ".tmp", arraysPath)
+
+    with open(metadataPath, 'w') as metadataFile:
+        json.dump(state.metadata, metadataFile, indent=1)
+
+
+def loadState(modelDirectory, measureType):
+    """
+    The state saved for the measure, None if there is not any
+    """
+    arraysPath, metadataPath = statePaths(modelDirectory, measureType)
+    if not (os.path.exists(arraysPath) and os.path.exists(metadataPath)):
+        return None
+
+    with open(metadataPath, 'r') as metadataFile:
+        metadata = json.load(metadataFile)
+
+    with np.load(arraysPath) as arrays:
+        cube = pc.ProfileCube(arrays['keys'], pd.DatetimeIndex(arrays['dates']), arrays['times'], arrays['values'])
+        cube.profileExists = arrays['profileExists']
+        cube.timeExists = arrays['timeExists']
+
+        return IncrementalState(cube, arrays['labels'], arrays['exemplars'], arrays['similarityFloor'],
+                                arrays['networkDays'], arrays['networkCenters'], arrays['networkLabels'], metadata)
+
+
+def checkStateOptions(state, argOptions):
+    for option in ("TimeResolution", "smoothingKernelPercentage"):
+        if float(state.metadata[option]) != float(getattr(argOptions, option)):
+            raise Exception("INCREMENTAL UPDATE ERROR: ",
+                            f"the model has been fitted with {option} = {state.metadata[option]}, a refit is needed")
+
+
+# ==============================================================================================================
+#                                                   FIT
+# ==============================================================================================================
+@ins.instrumented
+def fitState(smoothCube, outlierCap, argOptions):
+    """
+    Full fit of the clusters of each key and, if enabled, of the network clusters on the smoothed profiles. It returns
+    the state together with the results to be exported, as the batch pipeline does
+    """
+    smoothDF = smoothCube.keyFrames()
+    sectionClusterDF, sectionClusterCentersDF = dtc.IndividualDetectorClusteringResult(smoothDF,
+                                                                                        argOptions.numberOfWorkers,
+                                                                                        argOptions.clusteringBackend,
+                                                                                        argOptions.numberOfProfileClusters)
+
+    numberOfKeys = len(smoothCube.keys)
+    labels = np.full(smoothCube.profileExists.shape, -1, dtype=np.int32)
+    exemplars = np.full((numberOfKeys, max([len(df.index) for df in sectionClusterCentersDF.values()] + [0])), -1,
+                        dtype=np.int64)
+    for k, key in enumerate(smoothCube.keys):
+        datesOfKey = np.flatnonzero(smoothCube.profileExists[k])
+        labels[k, datesOfKey] = sectionClusterDF[key]['ClusterGroup'].to_numpy()
+        centers = datesOfKey[sectionClusterCentersDF[key]['ClusterCenterIndex'].to_numpy(dtype=np.int64)]
+        exemplars[k, :len(centers)] = centers
+
+    metadata = {"outlierCap": None if outlierCap is None else float(outlierCap),
+                "TimeResolution": argOptions.TimeResolution,
+                "smoothingKernelPercentage": argOptions.smoothingKernelPercentage,
+                "profilesSinceFit": 0,
+                "unexplainedSinceFit": 0}
+    state = IncrementalState(smoothCube, labels, exemplars, np.ones(numberOfKeys), np.zeros(0, dtype=np.int64),
+                             np.zeros((0, 0)), np.full(len(smoothCube.dates), -1, dtype=np.int32), metadata)
+
+    for k in range(numberOfKeys):
+        datesOfKey = np.flatnonzero(smoothCube.profileExists[k])
+        keyExemplars = exemplars[k][exemplars[k] >= 0]
+        members = labels[k, datesOfKey] >= 0
+        if len(keyExemplars) and members.any():
+            similarity = dtc.similarityRowsArray(state.keyProfiles(k, datesOfKey[members]),
+                                                 state.keyProfiles(k, keyExemplars))
+            state.similarityFloor[k] = np.nanmin(similarity[np.arange(members.sum()), labels[k, datesOfKey[members]]])
+
+    networkModel = None
+    if argOptions.enableNetworkClustering:
+        networkModel = fitNetwork(state, sectionClusterDF, argOptions)
+
+    return state, (smoothDF, sectionClusterDF, sectionClusterCentersDF), networkModel
+
+
+def fitNetwork(state, sectionClusterDF, argOptions):
+    """
+    Network clustering as done by the batch pipeline, keeping the centroids of the clusters in the space of the
+    distances, so that a new day can be assigned to the nearest one. It returns the NetworkDayTypeModel
+    """
+    networkModel = ndm.buildNetworkModel(sectionClusterDF, argOptions)
+
+    state.networkDays = state.cube.dates.get_indexer(networkModel.days)
+    state.networkCenters = networkModel.centroids
+    state.networkLabels = np.full(len(state.cube.dates), -1, dtype=np.int32)
+    state.networkLabels[state.networkDays] = networkModel.labels
+
+    return networkModel
+
+
+# ==============================================================================================================
+#                                                 UPDATE
+# ==============================================================================================================
+def extendState(state, newCube, smoothValues):
+    """
+    The keys and the dates of the new profiles are merged into the state (the new profiles replace the existing ones
+    for the same key and date). It returns the positions of the new keys and dates into the extended state
+    """
+    cube = state.cube
+    keys = cube.keys.append(pd.Index(newCube.keys.astype(str)).difference(cube.keys, sort=False))
+    dates = cube.dates.union(newCube.dates)
+    oldKeys = np.arange(len(cube.keys))
+    oldDates = dates.get_indexer(cube.dates)
+    newKeys = keys.get_indexer(newCube.keys.astype(str))
+    newDates = dates.get_indexer(newCube.dates)
+
+    values = np.full((len(keys), len(dates), len(cube.times)), np.nan, dtype=cube.values.dtype)
+    values[np.ix_(oldKeys, oldDates)] = cube.values
+    profileExists = np.zeros((len(keys), len(dates)), dtype=bool)
+    profileExists[np.ix_(oldKeys, oldDates)] = cube.profileExists
+    timeExists = np.zeros((len(keys), len(cube.times)), dtype=bool)
+    timeExists[oldKeys] = cube.timeExists
+
+    newProfiles = newCube.profileExists
+    newKeyIndex, newDateIndex = np.nonzero(newProfiles)
+    values[newKeys[newKeyIndex], newDates[newDateIndex]] = smoothValues[newKeyIndex, newDateIndex]
+    profileExists[np.ix_(newKeys, newDates)] |= newProfiles
+    timeExists[newKeys] |= newCube.timeExists
+
+    extendedCube = pc.ProfileCube(keys, dates, cube.times, values)
+    extendedCube.profileExists = profileExists
+    extendedCube.timeExists = timeExists
+
+    labels = np.full(profileExists.shape, -1, dtype=np.int32)
+    labels[np.ix_(oldKeys, oldDates)] = state.labels
+    exemplars = np.full((len(keys), state.exemplars.shape[1]), -1, dtype=np.int64)
+    exemplars[oldKeys] = np.where(state.exemplars >= 0, oldDates[state.exemplars], -1)
+    similarityFloor = np.ones(len(keys))
+    similarityFloor[oldKeys] = state.similarityFloor
+    networkLabels = np.full(len(dates), -1, dtype=np.int32)
+    networkLabels[oldDates] = state.networkLabels
+
+    state.cube = extendedCube
+    state.labels = labels
+    state.exemplars = exemplars
+    state.similarityFloor = similarityFloor
+    state.networkDays = oldDates[state.networkDays]
+    state.networkLabels = networkLabels
+
+    return newKeys, newDates
+
+
+@ins.instrumented
+def addNewDays(state, cleanDataframe, measureType, argOptions):
+    """
+    The profiles of the new days are smoothed and added to the state. Each profile is assigned to the cluster of the
+    most similar exemplar of its key, i.e. the similarity matrix of the key is extended only by the row of the new
+    profile against the exemplars, and it is counted as not explained when it is less similar to its exemplar than
+    the worst profile accepted by the fit (or when its key has no clusters). Each new day is then assigned to the
+    nearest network centroid, given its distances from the days of the network clustering computed as done by
+    networkSimilarityMatrix from the clusters of the keys.
+    """
+    newCube = pc.buildProfileCube(cleanDataframe, measureType.lower())
+
+    # the new profiles are put on the time buckets of the state before being smoothed, as for the history
+    timeIndex = state.cube.times.get_indexer(newCube.times)
+    knownTimes = timeIndex >= 0
+    values = np.full((len(newCube.keys), len(newCube.dates), len(state.cube.times)), np.nan)
+    values[:, :, timeIndex[knownTimes]] = newCube.values[:, :, knownTimes]
+    alignedCube = pc.ProfileCube(newCube.keys, newCube.dates, state.cube.times, values)
+
+    # each key is smoothed over the time buckets it will have in the extended state, as a fit of all its days would do
+    timeExists = alignedCube.timeExists.copy()
+    stateKeys = state.cube.keys.get_indexer(newCube.keys.astype(str))
+    timeExists[stateKeys >= 0] |= state.cube.timeExists[stateKeys[stateKeys >= 0]]
+    smoothValues = ds.smoothKeysArray(values, timeExists, ds.smoothingKernel(argOptions))
+
+    # the exemplars are compared on the time buckets the keys had when they were fitted
+    fittedTimeExists = state.cube.timeExists
+    fittedKeys = len(state.cube.keys)
+    newKeys, newDates = extendState(state, alignedCube, smoothValues)
+
+    assignments = []
+    for i, j in zip(*np.nonzero(alignedCube.profileExists)):
+        k = newKeys[i]
+        clusterGroup = -1
+        exemplarSimilarity = np.nan
+        keyExemplars = state.exemplars[k][state.exemplars[k] >= 0] if k < fittedKeys else []
+        if len(keyExemplars):
+            keyTimes = fittedTimeExists[k]
+            similarity = dtc.similarityRowsArray(smoothValues[i, j][keyTimes][np.newaxis],
+                                                 state.cube.values[k][np.ix_(keyExemplars, keyTimes)])[0]
+            if not np.isnan(similarity).all():
+                clusterGroup = int(np.nanargmax(similarity))
+                exemplarSimilarity = similarity[clusterGroup]
+        state.labels[k, newDates[j]] = clusterGroup
+        unexplained = not exemplarSimilarity >= state.similarityFloor[k]
+        assignments.append((state.cube.keys[k], state.cube.dates[newDates[j]], clusterGroup, exemplarSimilarity,
+                            unexplained))
+
+    state.metadata["profilesSinceFit"] += len(assignments)
+    state.metadata["unexplainedSinceFit"] += sum(a[4] for a in assignments)
+
+    assignmentsDF = pd.DataFrame(assignments, columns=['KeyID', 'Date', 'ClusterGroup', 'ExemplarSimilarity',
+                                                       'Unexplained'])
+
+    networkAssignments = None
+    if len(state.networkDays):
+        networkAssignments = assignNetworkDays(state, np.unique(newDates))
+
+    return assignmentsDF, networkAssignments
+
+
+def assignNetworkDays(state, dateIndexes):
+    """
+    The similarity of a new day with each day of the network clustering is the number of keys having the two days in
+    the same cluster over the number of keys having both days, as in networkSimilarityMatrix. The profiles without a
+    cluster (label -1, e.g. the ones of the keys not fitted yet) are left out, as if they did not exist
+    """
+    clustered = state.cube.profileExists & (state.labels >= 0)
+    featureClustered = clustered[:, state.networkDays]
+    featureLabels = state.labels[:, state.networkDays]
+
+    networkAssignments = []
+    for j in dateIndexes:
+        inBoth = clustered[:, j][:, np.newaxis] & featureClustered
+        both = inBoth.sum(axis=0)
+        same = (inBoth & (state.labels[:, j][:, np.newaxis] == featureLabels)).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarity = np.nan_to_num(same / both)
+
+        distances = np.exp(-similarity) - np.exp(-1)
+        clusterGroup = int(np.argmin(((state.networkCenters - distances) ** 2).sum(axis=1)))
+        state.networkLabels[j] = clusterGroup
+        networkAssignments.append((state.cube.dates[j], clusterGroup))
+
+    return pd.DataFrame(networkAssignments, columns=['Date', 'ClusterGroup'])
+
+
+# ==============================================================================================================
+#                                                  EXPORT
+# ==============================================================================================================
+def exportFitResults(individualResults, networkModel, measureType, argOptions):
+    smoothDF, sectionClusterDF, sectionClusterCentersDF = individualResults
+    bp.exportIndividualResults(sectionClusterDF,
+                               bp.individualKPIs(smoothDF, sectionClusterDF, sectionClusterCentersDF, argOptions),
+                               measureType)
+
+    if networkModel is not None:
+        bp.exportNetworkResults(networkModel, measureType)
+
+
+def exportUpdateResults(assignmentsDF, networkAssignments, measureType):
+    sr.writeTable(assignmentsDF, f"Incremental_{measureType}_Cluster_Results")
+
+    if networkAssignments is not None:
+        sr.writeTable(networkAssignments, f"Incremental_{measureType}_Network_Results")
+
+
+# ==============================================================================================================
+#                                                   RUN
+# ==============================================================================================================
+def processSingleMeasure(cleanDataframe, outlierCap, state, measureType, argOptions):
+    """
+    INPUT notes:
+    - measureType = can be ONLY   Speed|Flow
+    - state = the saved state of the measure, None if the model has not been fitted yet
+    """
+    if state is None:
+        print(f"Fitting {measureType} model")
+        smoothCube = ds.smoothProfileCube(pc.buildProfileCube(cleanDataframe, measureType.lower()), argOptions)
+        state, individualResults, networkModel = fitState(smoothCube, outlierCap, argOptions)
+        exportFitResults(individualResults, networkModel, measureType, argOptions)
+        return state
+
+    checkStateOptions(state, argOptions)
+    assignmentsDF, networkAssignments = addNewDays(state, cleanDataframe, measureType, argOptions)
+    exportUpdateResults(assignmentsDF, networkAssignments, measureType)
+    print(f"{measureType}: {len(assignmentsDF.index)} new profiles, drift {state.driftPercentage():.1f}%")
+
+    if str(argOptions.refit) == 'True' or state.driftPercentage() > float(argOptions.driftThreshold):
+        print(f"Refitting {measureType} model")
+        state, individualResults, networkModel = fitState(state.cube, state.metadata["outlierCap"], argOptions)
+        exportFitResults(individualResults, networkModel, measureType, argOptions)
+
+    return state
+
+
+def run(argOptions):
+    states = {measureType: loadState(argOptions.modelDirectory, measureType)
+              for measureType, column in (('Flow', argOptions.flow), ('Speed', argOptions.speed)) if column >= 0}
+    # the new days are cleaned with the outlier caps of the history
+    caps = {measureType: state.metadata["outlierCap"] for measureType, state in states.items() if state is not None}
+
+    print("Reading input")
+    df = fr.readInputFile(argOptions)
+
+    print("Cleaning data")
+    cleanDF, cap_flow, cap_speed, pivotKeyDateFlowDF, pivotKeyDateSpeedDF = dc.cleanData(df, argOptions,
+                                                                                         caps.get('Flow'),
+                                                                                         caps.get('Speed'))
+    del df
+
+    for measureType, outlierCap in (('Flow', cap_flow), ('Speed', cap_speed)):
+        if measureType in states:
+            print(f"Processing {measureType}")
+            with ins.measureScope(measureType):
+                state = processSingleMeasure(cleanDF, outlierCap, states[measureType], measureType, argOptions)
+                saveState(state, argOptions.modelDirectory, measureType)
@@ -0,0 +1,286 @@
+import contextlib
+import functools
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Instrumentation of the pipeline: every stage (see StageCache.stage) and every step decorated with instrumented is
+# recorded with its wall and CPU time, the resident memory of the process at its end and how much the step raised the
+# peak resident memory of the process (the peak never goes down, so only the steps setting a new peak raise it), the
+# rows, keys and dates it processed and the measure (Flow|Speed) being processed. The time of each key of the parallel
+# per-key tasks (see ParallelProcessing.mapOverProfiles) is recorded too, giving the distribution of the clustering
+# time across keys.
+# The run report is written beside the results. When disabled, nothing is recorded and the only cost is the check of
+# a flag. A single stage can be run under cProfile, its statistics being written beside the results.
+
+_enabled = False
+_profileStage = None
+
+# records of the steps run, task times of the per-key tasks, steps running (innermost last)
+_records = []
+_taskTimes = []
+_activeSteps = []
+_measure = None
+_runStart = None
+
+
+def configure(argOptions):
+    """
+    Function that enables the instrumentation from the options and starts a new run report
+    """
+    global _enabled, _profileStage, _measure, _runStart
+
+    _enabled = str(argOptions.runReport) == 'True'
+    _profileStage = argOptions.profileStage if argOptions.profileStage else None
+    _records.clear()
+    _taskTimes.clear()
+    _activeSteps.clear()
+    _measure = None
+    _runStart = time.time()
+
+
+def enabled():
+    return _enabled
+
+
+@contextlib.contextmanager
+def measureScope(measureType):
+    """
+    The steps run inside the scope are recorded as steps of the measure (Flow|Speed)
+    """
+    global _measure
+
+    previousMeasure, _measure = _measure, measureType
+    try:
+        yield
+    finally:
+        _measure = previousMeasure
+
+
+# ==============================================================================================================
+#                                                 MEASUREMENTS
+# ==============================================================================================================
+def peakMemoryMB():
+    """
+    Peak resident memory of the process so far (None if it cannot be read on this platform). Where psutil gives no
+    peak (it does only on Windows) the current resident memory is given instead
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        memoryInfo = psutil.Process().memory_info()
+        return getattr(memoryInfo, 'peak_wset', memoryInfo.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def currentMemoryMB():
+    """
+    Resident memory of the process now (None if it cannot be read on this platform)
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def cpuSeconds():
+    """
+    CPU time of the process and of its terminated children (the worker processes)
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def processedCounts(value):
+    """
+    Rows, keys and dates of a value of the pipeline (dataframe, dictionary of per-key dataframes, profile cube or store
+    or a tuple starting with one of them), None where not defined
+    """
+    if isinstance(value, (tuple, list)) and value:
+        return processedCounts(value[0])
+    if hasattr(value, 'profileExists') and hasattr(value, 'dates'):
+        # profile cubes and profile stores, counted on their index without reading the profiles
+        return None, len(value.profileExists), len(value.dates)
+    if isinstance(value, pd.DataFrame):
+        keyColumn = 'KeyID' if 'KeyID' in value.columns else 'ID1' if 'ID1' in value.columns else None
+        return (len(value.index),
+                value[keyColumn].nunique() if keyColumn else None,
+                value['Date'].nunique() if 'Date' in value.columns else None)
+    if isinstance(value, dict) and value and all(isinstance(df, pd.DataFrame) for df in value.values()):
+        dates = set()
+        for df in value.values():
+            dates.update(df['Date'] if 'Date' in df.columns else df.columns)
+        return sum(len(df.index) for df in value.values()), len(value), len(dates)
+
+    return None, None, None
+
+
+# ==============================================================================================================
+#                                                    STEPS
+# ==============================================================================================================
+def instrumented(function):
+    """
+    Decorator recording each call of the function as a step of the run report
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+
+        record = {"Measure": _measure,
+                  "Stage": function.__name__,
+                  "Parent": _activeSteps[-1]["Stage"] if _activeSteps else None,
+                  "Depth": len(_activeSteps),
+                  "Cached": False}
+        _activeSteps.append(record)
+        profiler = None
+        if function.__name__ == _profileStage and sys.getprofile() is None:
+            import cProfile
+            profiler = cProfile.Profile()
+
+        startWall, startCpu, startPeak = time.perf_counter(), cpuSeconds(), peakMemoryMB()
+        try:
+            if profiler is not None:
+                result = profiler.runcall(function, *args, **kwargs)
+            else:
+                result = function(*args, **kwargs)
+        finally:
+            record["WallSeconds"] = time.perf_counter() - startWall
+            record["CpuSeconds"] = cpuSeconds() - startCpu
+            endPeak = peakMemoryMB()
+            record["MemoryMB"] = currentMemoryMB()
+            record["PeakIncreaseMB"] = None if startPeak is None or endPeak is None else endPeak - startPeak
+            _activeSteps.pop()
+
+        # what is processed is the first argument, or the result for the steps producing the data (e.g. reading)
+        counts = processedCounts(args[0]) if args else (None, None, None)
+        if counts == (None, None, None):
+            counts = processedCounts(result)
+        record["Rows"], record["Keys"], record["Dates"] = counts
+        _records.append(record)
+
+        if profiler is not None:
+            writeProfile(profiler, record)
+
+        return result
+
+    return wrapper
+
+
+def markCached():
+    """
+    The running step took its result from the cache
+    """
+    if _enabled and _activeSteps:
+        _activeSteps[-1]["Cached"] = True
+
+
+def recordTaskTimes(taskName, seconds, taskNames=None):
+    """
+    Time of each of the tasks of a parallel map (e.g. the clustering of each key), named by taskNames or by their
+    position
+    """
+    if taskNames is None:
+        taskNames = range(len(seconds))
+    stageName = _activeSteps[-1]["Stage"] if _activeSteps else None
+    _taskTimes.extend([_measure, stageName, taskName, str(name), value] for name, value in zip(taskNames, seconds))
+
+
+def writeProfile(profiler, record):
+    import pstats
+    import SummaryReports as sr
+
+    fileName = f"Profile_{record['Measure'] or 'Run'}_{record['Stage']}"
+    profiler.dump_stats(sr.outputPath(fileName + ".prof"))
+    with open(sr.outputPath(fileName + ".txt"), 'w') as statsFile:
+        pstats.Stats(profiler, stream=statsFile).sort_stats('cumulative').print_stats(50)
+
+
+# ==============================================================================================================
+#                                                  RUN REPORT
+# ==============================================================================================================
+def stepsTable():
+    steps = pd.DataFrame(_records, columns=['Measure', 'Stage', 'Parent', 'Depth', 'Cached', 'WallSeconds',
+                                            'CpuSeconds', 'MemoryMB', 'PeakIncreaseMB', 'Rows', 'Keys', 'Dates'])
+
+    return steps.astype({'Rows': 'Int64', 'Keys': 'Int64', 'Dates': 'Int64'})
+
+
+def taskTimesTable():
+    return pd.DataFrame(_taskTimes, columns=['Measure', 'Stage', 'Task', 'Key', 'Seconds'])
+
+
+def taskTimesSummary(taskTimes):
+    """
+    Distribution of the time of the tasks of each parallel map of each stage and measure
+    """
+    summary = []
+    for (measure, stageName, taskName), group in taskTimes.groupby(['Measure', 'Stage', 'Task'], dropna=False,
+                                                                   sort=False):
+        seconds = group['Seconds'].to_numpy()
+        summary.append({"Measure": None if pd.isna(measure) else measure,
+                        "Stage": None if pd.isna(stageName) else stageName,
+                        "Task": taskName,
+                        "Tasks": len(seconds),
+                        "TotalSeconds": float(seconds.sum()),
+                        "MeanSeconds": float(seconds.mean()),
+                        "MedianSeconds": float(np.median(seconds)),
+                        "P90Seconds": float(np.percentile(seconds, 90)),
+                        "MaxSeconds": float(seconds.max()),
+                        "SlowestKey": group['Key'].iloc[int(seconds.argmax())]})
+
+    return summary
+
+
+def jsonValue(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def writeRunReport(argOptions):
+    """
+    The steps are written as the Run_Report table and the per-key task times as the Run_Task_Times table (in the
+    format of the results), and the whole report, with the options, the task time distributions and the result
+    writes, as Run_Report.json
+    """
+    if not _enabled:
+        return
+    import SummaryReports as sr
+
+    steps = stepsTable()
+    taskTimes = taskTimesTable()
+    sr.writeTable(steps, "Run_Report")
+    if not taskTimes.empty:
+        sr.writeTable(taskTimes, "Run_Task_Times")
+
+    report = {"start": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(_runStart)),
+              "wallSeconds": time.time() - _runStart,
+              "peakMemoryMB": peakMemoryMB(),
+              "options": {name: jsonValue(value) for name, value in vars(argOptions).items()},
+              "stages": [{name: jsonValue(value) for name, value in record.items()} for record in _records],
+              "taskTimes": taskTimesSummary(taskTimes),
+              "writes": [{name: jsonValue(value) for name, value in write.items()}
+                         for write in sr.writeReport().to_dict(orient='records')]}
+    path = sr.outputPath("Run_Report.json")
+    with open(path, 'w') as reportFile:
+        json.dump(report, reportFile, indent=1)
+    print(f"Run report written into {path}")
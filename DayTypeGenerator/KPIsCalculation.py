@@ -1,3 +1,6 @@
+import Instrumentation as ins
+import ParallelProcessing as pp
+
 import numpy as np
 import pandas as pd
 from sklearn import metrics
@@ -19,6 +22,7 @@ def KPI(smoothDF, ClusterDF, ClusterCentersDF, KPItype):
     and then we have to average all of them. Note that this is OK only under the following caveat, i.e. that the time
     profiles have the same temporal discretization. If one of the two data of the profile is missing we will skip the error
     computation.
+    It works on a single KPI type at a time and it is kept as the reference implementation of KPIsTable
     """
     KPI_results = {}
 
@@ -57,6 +61,57 @@ def KPI(smoothDF, ClusterDF, ClusterCentersDF, KPItype):
     return KPI_results
 
 
+def clusterErrors(profiles, labels, centers):
+    """
+    Engine of the KPIs of the clusters of a single KeyID, given its profiles as a 2-D array of shape dates x time
+    buckets, the cluster label of each date and the date indexes of the cluster centers. Each profile is compared with
+    the center of its cluster at once and the sums and counts of the defined errors of each cluster are obtained by
+    bincount over the labels, so that MAE, MAPE, MSE and RMSE come from a single pass with the same NaN handling of
+    KPI (errors involving a missing value are skipped). It returns an array of shape clusters x 4.
+    The function is defined at module level because it is the task run by the worker processes.
+    """
+    numberOfClusters = len(centers)
+    members = (labels >= 0) & (labels < numberOfClusters)
+    values = profiles[members]
+    memberLabels = labels[members]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        differences = values - profiles[np.asarray(centers, dtype=np.int64)[memberLabels]]
+        errors = [np.abs(differences), np.abs(differences / values), differences * differences]
+
+        result = np.empty((numberOfClusters, 4))
+        rowLabels = np.repeat(memberLabels, profiles.shape[1])
+        for i, error in enumerate(errors):
+            error = error.ravel()
+            defined = ~np.isnan(error)
+            sums = np.bincount(rowLabels[defined], weights=error[defined], minlength=numberOfClusters)
+            counts = np.bincount(rowLabels[defined], minlength=numberOfClusters)
+            result[:, i] = sums / counts
+        result[:, 3] = np.sqrt(result[:, 2])
+
+    return result
+
+
+@ins.instrumented
+def KPIsTable(smoothDF, ClusterDF, ClusterCentersDF, numberOfWorkers=1):
+    """
+    This function computes all the KPIs (MAE, MAPE, MSE and RMSE) of all the clusters of all the keys, returning a
+    single table with a row for each (KeyID, ClusterGroup). The keys are independent, so with more than one worker
+    they are spread across a pool of processes as done for the clustering.
+    """
+    keys = list(ClusterCentersDF.keys())
+    profiles = [smoothDF[key].values.T for key in keys]
+    arguments = [(ClusterDF[key]['ClusterGroup'].to_numpy(dtype=np.int64),
+                  ClusterCentersDF[key]['ClusterCenterIndex'].to_numpy(dtype=np.int64)) for key in keys]
+    results = pp.mapOverProfiles(clusterErrors, profiles, numberOfWorkers, profileArguments=arguments, taskNames=keys)
+
+    KPI_results = pd.DataFrame(np.vstack(results + [np.empty((0, 4))]), columns=['MAE', 'MAPE', 'MSE', 'RMSE'])
+    KPI_results.insert(0, 'ClusterGroup', np.concatenate([np.arange(len(r)) for r in results] + [np.zeros(0, int)]))
+    KPI_results.insert(0, 'KeyID', np.repeat(np.asarray(keys, dtype=object), [len(r) for r in results]))
+
+    return KPI_results
+
+
 def KPIsSummaryTable(dataframeList):
     """
     This function take a list of all dataframe for one keyID and merge them on the "ClusterGroup" column
@@ -96,6 +151,7 @@ def DaviesBouldinScore(X, labels):
     return ['Davies-Bouldin', kpi_value, 'The lower the better']
 
 
+@ins.instrumented
 def NetworkKpisIntegration(X, labels):
     result = [SilhoutteScore(X, labels),
               CalinskiHarabaszScore(X, labels),
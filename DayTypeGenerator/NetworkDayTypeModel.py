@@ -0,0 +1,180 @@
+import DayTypeClustering as dtc
+import KPIsCalculation as kc
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Network stage of the pipeline as a single object: the similarity between the days, their distance, the network
+# cluster of each day, the centroids of the clusters (in the space of the distances from the days) and the network
+# KPIs are computed lazily, the first time they are asked, and only once, whoever asks them (exports, web-app,
+# classifier, incremental state). A fitted model can be saved and loaded without the per-key clusters it comes from.
+
+
+class NetworkDayTypeModel:
+    """
+    Day-types at network level of one measure:
+    - sectionClusterDF = dictionary of KeyID and dataframes of the cluster of each date (None for a loaded model)
+    - numberOfClusters = number of network clusters, None to choose it automatically between minimumClusters and
+      maximumClusters (see DayTypeClustering.selectNetworkClusters)
+    - numberOfInits = number of K-Means initializations
+    - numberOfWorkers = number of worker processes for the automatic choice
+    """
+
+    def __init__(self, sectionClusterDF, numberOfClusters=None, minimumClusters=2, maximumClusters=20,
+                 numberOfInits=10, numberOfWorkers=1):
+        self.sectionClusterDF = sectionClusterDF
+        self.numberOfClusters = numberOfClusters
+        self.minimumClusters = minimumClusters
+        self.maximumClusters = maximumClusters
+        self.numberOfInits = numberOfInits
+        self.numberOfWorkers = numberOfWorkers
+
+        self._similarity = None
+        self._days = None
+        self._distance = None
+        self._labels = None
+        self._centroids = None
+        self._kpis = None
+        self._scoreCurve = None
+
+    @property
+    def similarity(self):
+        """
+        Days x days dataframe of the similarity between the days
+        """
+        if self._similarity is None:
+            self._similarity = dtc.networkSimilarityMatrix(self.sectionClusterDF)
+        return self._similarity
+
+    @property
+    def days(self):
+        if self._days is None:
+            self._days = pd.DatetimeIndex(pd.to_datetime(self.similarity.columns))
+        return self._days
+
+    @property
+    def distance(self):
+        """
+        Days x days array of the distance between the days
+        """
+        if self._distance is None:
+            self._distance = np.asarray(dtc.networkDistanceMatrix(self.similarity), dtype=np.float64)
+        return self._distance
+
+    @property
+    def labels(self):
+        """
+        Network cluster of each day. When the number of clusters is chosen automatically the score curve of the
+        numbers of clusters evaluated is kept too, together with the KPIs of the chosen one
+        """
+        if self._labels is None:
+            if self.numberOfClusters is None:
+                self.numberOfClusters, self._labels, self._kpis, self._scoreCurve = dtc.selectNetworkClusters(
+                    self.distance, self.minimumClusters, self.maximumClusters, self.numberOfInits,
+                    self.numberOfWorkers)
+            else:
+                self._labels = dtc.networkClusteringLabels(self.distance, self.numberOfClusters, self.numberOfInits)
+        return self._labels
+
+    @property
+    def scoreCurve(self):
+        """
+        Network KPIs of each number of clusters evaluated by the automatic choice, None if the number is given
+        """
+        if self._labels is None:
+            # the curve is computed together with the labels
+            self._labels = self.labels
+        return self._scoreCurve
+
+    @property
+    def clusterResult(self):
+        return dtc.networkClusterResult(self.similarity, self.labels)
+
+    @property
+    def centroids(self):
+        """
+        Clusters x days array of the centroids of the clusters in the space of the distances from the days, so that
+        a new day can be assigned to the nearest one
+        """
+        if self._centroids is None:
+            self._centroids = np.vstack([self.distance[self.labels == c].mean(axis=0)
+                                         for c in range(self.labels.max() + 1)])
+        return self._centroids
+
+    @property
+    def kpis(self):
+        """
+        Network-wide KPIs of the clustering
+        """
+        if self._kpis is None:
+            # the automatic choice of the number of clusters computes them together with the labels
+            labels = self.labels
+            if self._kpis is None:
+                self._kpis = kc.NetworkKpisIntegration(self.distance, labels)
+        return self._kpis
+
+
+def buildNetworkModel(sectionClusterDF, argOptions):
+    """
+    The network model given by the user options. Nothing is computed until its results are asked
+    """
+    numberOfClusters = None if str(argOptions.autoNetworkClusters) == 'True' else argOptions.KmeansNumberOfFlowCluster
+
+    return NetworkDayTypeModel(sectionClusterDF, numberOfClusters,
+                               argOptions.minimumNetworkClusters, argOptions.maximumNetworkClusters,
+                               argOptions.networkClusteringInits, argOptions.numberOfWorkers)
+
+
+# ==============================================================================================================
+#                                                 SAVE AND LOAD
+# ==============================================================================================================
+def networkModelPaths(modelDirectory, measureType):
+    return (os.path.join(modelDirectory, measureType + "_network.npz"),
+            os.path.join(modelDirectory, measureType + "_network.json"))
+
+
+def saveNetworkModel(model, modelDirectory, measureType):
+    """
+    Arrays are saved in a NumPy archive (the similarity in single precision, as it is computed) and the number of
+    clusters, the KPIs and the score curve in a JSON file beside it. The distance is not saved, being a function of
+    the similarity
+    """
+    os.makedirs(modelDirectory, exist_ok=True)
+    arraysPath, metadataPath = networkModelPaths(modelDirectory, measureType)
+
+    with open(arraysPath, 'wb') as arraysFile:
+        np.savez(arraysFile,
+                 days=model.days.values.astype('datetime64[ns]'),
+                 similarity=model.similarity.to_numpy(dtype=np.float32),
+                 labels=np.asarray(model.labels, dtype=np.int32),
+                 centroids=model.centroids)
+
+    metadata = {"numberOfClusters": int(model.labels.max() + 1),
+                "numberOfInits": model.numberOfInits,
+                "kpis": model.kpis.to_dict(orient='list'),
+                "scoreCurve": None if model.scoreCurve is None else model.scoreCurve.to_dict(orient='list')}
+    with open(metadataPath, 'w') as metadataFile:
+        json.dump(metadata, metadataFile, indent=1)
+
+
+def loadNetworkModel(modelDirectory, measureType):
+    """
+    A saved model has all its results already computed, so it does not need the per-key clusters
+    """
+    arraysPath, metadataPath = networkModelPaths(modelDirectory, measureType)
+
+    with open(metadataPath, 'r') as metadataFile:
+        metadata = json.load(metadataFile)
+
+    model = NetworkDayTypeModel(None, metadata["numberOfClusters"], numberOfInits=metadata["numberOfInits"])
+    with np.load(arraysPath) as arrays:
+        days = pd.DatetimeIndex(arrays['days']).strftime("%Y-%m-%d")
+        model._similarity = pd.DataFrame(arrays['similarity'], index=list(days), columns=list(days))
+        model._labels = arrays['labels']
+        model._centroids = arrays['centroids']
+    model._kpis = pd.DataFrame(metadata["kpis"])
+    model._scoreCurve = None if metadata["scoreCurve"] is None else pd.DataFrame(metadata["scoreCurve"])
+
+    return model
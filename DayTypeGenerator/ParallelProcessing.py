@@ -0,0 +1,157 @@
+import Instrumentation as ins
+
+import numpy as np
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+# layout of the profiles shared with the current worker process, set by the pool initializer
+_sharedMemory = None
+_sharedProfiles = None
+_sharedLayout = None
+
+
+def workerCount(numberOfWorkers):
+    """
+    Function that returns the number of worker processes to be used given the user option, where 0 (or a negative
+    value) means all the CPUs of the machine
+    """
+    numberOfWorkers = int(numberOfWorkers)
+    if numberOfWorkers <= 0:
+        numberOfWorkers = os.cpu_count() or 1
+
+    return numberOfWorkers
+
+
+def packProfiles(profileArrays, dtype=np.float64):
+    """
+    The per-key profile arrays (dates x time buckets, possibly with different shapes) are flattened one after the
+    other into a single 1-D buffer, so that they can be copied once into shared memory. The layout returned is the
+    list of (offset, shape) of each array into the buffer.
+    """
+    layout = []
+    offset = 0
+    for array in profileArrays:
+        layout.append((offset, array.shape))
+        offset += int(np.prod(array.shape))
+
+    buffer = np.empty(offset, dtype=dtype)
+    for array, (start, shape) in zip(profileArrays, layout):
+        buffer[start:start + int(np.prod(shape))] = np.asarray(array, dtype=dtype).ravel()
+
+    return buffer, layout
+
+
+def _attachSharedProfiles(memoryName, size, dtype, layout):
+    """
+    Pool initializer: each worker attaches once to the shared memory block holding all the profiles
+    """
+    global _sharedMemory, _sharedProfiles, _sharedLayout
+    _sharedMemory = shared_memory.SharedMemory(name=memoryName)
+    _sharedProfiles = np.ndarray((size,), dtype=dtype, buffer=_sharedMemory.buf)
+    _sharedLayout = layout
+
+
+def _runOnSharedProfile(task):
+    """
+    Worker task: the profile array of one key is a zero-copy view into the shared memory block
+    """
+    function, index, arguments = task
+    start, shape = _sharedLayout[index]
+    profiles = _sharedProfiles[start:start + int(np.prod(shape))].reshape(shape)
+
+    return function(profiles, *arguments)
+
+
+def _timedCall(profiles, *arguments):
+    """
+    Task run when the instrumentation is enabled: the function, given as last argument, is applied to the profiles and
+    its result is returned together with the seconds it took
+    """
+    *arguments, function = arguments
+    start = time.perf_counter()
+    result = function(profiles, *arguments)
+
+    return result, time.perf_counter() - start
+
+
+def mapOverProfiles(function, profileArrays, numberOfWorkers=1, extraArguments=(), profileArguments=None,
+                    taskNames=None):
+    """
+    This function applies function(profiles, *arguments, *extraArguments) to each of the per-key profile arrays, where
+    the optional arguments are the ones of the key given by profileArguments (a list of tuples, one per key, of small
+    objects such as label vectors), and returns the list of the results in the same order of the input, so that the
+    output is deterministic whatever the number of workers. With more than one worker the profiles are packed into a
+    shared memory block that the worker processes read without copies, so that only the key index, its arguments and
+    the (small) results travel through pickling.
+    The function must be defined at module level to be usable by the worker processes.
+    When the instrumentation is enabled the time of each task is recorded, the tasks being named by taskNames (e.g.
+    the KeyIDs) or by their position.
+    """
+    timed = ins.enabled()
+    if timed:
+        function, extraArguments = _timedCall, tuple(extraArguments) + (function,)
+
+    profileArrays = list(profileArrays)
+    numberOfWorkers = min(workerCount(numberOfWorkers), len(profileArrays))
+    if profileArguments is None:
+        profileArguments = [()] * len(profileArrays)
+
+    if numberOfWorkers <= 1:
+        # contiguous as the arrays read from shared memory, so that the floating point results are the same
+        results = [function(np.ascontiguousarray(profiles, dtype=np.float64), *arguments, *extraArguments)
+                   for profiles, arguments in zip(profileArrays, profileArguments)]
+    else:
+        results = runOnSharedProfiles(profileArrays,
+                                      [(function, index, tuple(arguments) + tuple(extraArguments))
+                                       for index, arguments in enumerate(profileArguments)],
+                                      numberOfWorkers)
+
+    if timed:
+        ins.recordTaskTimes(extraArguments[-1].__name__, [seconds for result, seconds in results], taskNames)
+        results = [result for result, seconds in results]
+
+    return results
+
+
+def mapOverArguments(function, array, argumentsList, numberOfWorkers=1):
+    """
+    This function applies function(array, *arguments) to the same array for each tuple of arguments of the list (e.g.
+    a clustering of the same distance matrix for each number of clusters) and returns the list of the results in the
+    same order. With more than one worker the array is copied once into shared memory.
+    The function must be defined at module level to be usable by the worker processes.
+    """
+    argumentsList = list(argumentsList)
+    numberOfWorkers = min(workerCount(numberOfWorkers), len(argumentsList))
+
+    if numberOfWorkers <= 1:
+        return [function(np.ascontiguousarray(array, dtype=np.float64), *arguments) for arguments in argumentsList]
+
+    return runOnSharedProfiles([array], [(function, 0, tuple(arguments)) for arguments in argumentsList],
+                               numberOfWorkers)
+
+
+def runOnSharedProfiles(profileArrays, tasks, numberOfWorkers):
+    """
+    The profile arrays are packed into a shared memory block and the tasks, i.e. tuples (function, index of the
+    profile array, arguments), are run by a pool of worker processes attached to it
+    """
+    buffer, layout = packProfiles(profileArrays)
+    memory = shared_memory.SharedMemory(create=True, size=max(buffer.nbytes, 1))
+    try:
+        size = buffer.size
+        np.ndarray((size,), dtype=buffer.dtype, buffer=memory.buf)[:] = buffer
+        del buffer
+
+        chunkSize = max(1, len(tasks) // (4 * numberOfWorkers))
+        with ProcessPoolExecutor(max_workers=numberOfWorkers,
+                                 initializer=_attachSharedProfiles,
+                                 initargs=(memory.name, size, np.float64, layout)) as executor:
+            results = list(executor.map(_runOnSharedProfile, tasks, chunksize=chunkSize))
+    finally:
+        memory.close()
+        memory.unlink()
+
+    return results
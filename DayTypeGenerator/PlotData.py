@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+
+# Preparation of the inputs of the charts of the web-app from indexed arrays, without filtering dataframes date by
+# date: the charts (see DataAnalysis) only draw what is prepared here.
+
+weekdayNames = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# the distribution charts use 20 and 90 bins, both obtained by merging the same fine bins
+fineBins = 180
+
+
+# ==============================================================================================================
+#                                                  HISTOGRAMS
+# ==============================================================================================================
+def histogramData(values, upper=None, bins=fineBins, chunkSize=1 << 22):
+    """
+    Counts of the valid (defined and not negative) values into bins equally spaced between 0 and upper, together with
+    the bin edges and the number of valid values. Without upper the bins cover the whole range of the values, up to
+    their maximum; when upper is given (e.g. the outlier cap) the values above it fall in no bin, but they are still
+    counted in the number of valid values. The values are binned a chunk at a time, so that the temporary arrays stay
+    small whatever their number
+    """
+    values = np.asarray(values)
+    if upper is None:
+        # maximum ignoring the missing values, without the temporary arrays of the chunks
+        upper = np.fmax.reduce(values, initial=0.0)
+    upper = float(upper) if np.isfinite(upper) and upper > 0 else 1.0
+    edges = np.linspace(0.0, upper, bins + 1)
+
+    counts = np.zeros(bins, dtype=np.int64)
+    total = 0
+    for start in range(0, len(values), chunkSize):
+        chunk = values[start:start + chunkSize]
+        chunk = chunk[chunk >= 0]
+        total += len(chunk)
+        counts += np.histogram(chunk, bins=edges)[0]
+
+    return counts, edges, total
+
+
+def rebinHistogram(counts, edges, bins):
+    """
+    Counts and edges of the histogram with the given number of bins (a divisor of the current one), merging adjacent
+    bins
+    """
+    factor = len(counts) // bins
+    if factor * bins != len(counts):
+        raise Exception("HISTOGRAM ERROR: ", f"{bins} bins cannot be obtained from {len(counts)} bins")
+
+    return counts.reshape(bins, factor).sum(axis=1), edges[::factor]
+
+
+def densityHistogram(counts, edges, total):
+    """
+    Density of each bin, normalized on the total number of values (the area of the bins is the share of the values
+    falling in their range)
+    """
+    return counts / (total * np.diff(edges)) if total else np.zeros(len(counts))
+
+
+def cumulativeHistogram(counts, total):
+    """
+    Normalized cumulative distribution at the right edge of each bin
+    """
+    return np.cumsum(counts) / total if total else np.zeros(len(counts))
+
+
+# ==============================================================================================================
+#                                                   HEATMAPS
+# ==============================================================================================================
+def decimationFactors(rows, columns, maximumCells):
+    """
+    Number of rows and of columns merged into each cell so that the heatmap has at most maximumCells cells, merging
+    rows and columns alike as long as possible
+    """
+    maximumCells = max(1, int(maximumCells))
+    if rows * columns <= maximumCells:
+        return 1, 1
+
+    rowFactor = min(int(np.ceil(np.sqrt(rows * columns / maximumCells))), rows)
+    rowBlocks = -(-rows // rowFactor)
+    columnFactor = -(-columns // max(1, maximumCells // rowBlocks))
+
+    return rowFactor, columnFactor
+
+
+def blockMeans(values, rowFactor, columnFactor):
+    """
+    Mean of the defined values of each block of rowFactor x columnFactor cells (NaN for the blocks without values)
+    """
+    rows, columns = values.shape
+    rowBlocks, columnBlocks = -(-rows // rowFactor), -(-columns // columnFactor)
+    padded = np.full((rowBlocks * rowFactor, columnBlocks * columnFactor), np.nan)
+    padded[:rows, :columns] = values
+    blocks = padded.reshape(rowBlocks, rowFactor, columnBlocks, columnFactor)
+
+    defined = ~np.isnan(blocks)
+    counts = defined.sum(axis=(1, 3))
+    sums = np.where(defined, blocks, 0.0).sum(axis=(1, 3))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def heatmapData(DataFrame, maximumCells):
+    """
+    Values, row labels, column labels and hover texts of the heatmap of the dataframe, binned into blocks of rows and
+    columns (averaging their values) when it has more than maximumCells cells. The label of a block is the one of its
+    first row (or column), the hover text tells the range of the block
+    """
+    values = DataFrame.to_numpy(dtype=float)
+    rowLabels = [str(label) for label in DataFrame.index]
+    columnLabels = [label.strftime("%Y-%m-%d") if hasattr(label, 'strftime') else str(label)
+                    for label in DataFrame.columns]
+    rowFactor, columnFactor = decimationFactors(values.shape[0], values.shape[1], maximumCells)
+
+    if rowFactor == 1 and columnFactor == 1:
+        return values, rowLabels, columnLabels, values
+
+    means = blockMeans(values, rowFactor, columnFactor)
+    rowRanges = [(rowLabels[i], rowLabels[min(i + rowFactor, len(rowLabels)) - 1])
+                 for i in range(0, len(rowLabels), rowFactor)]
+    columnRanges = [(columnLabels[j], columnLabels[min(j + columnFactor, len(columnLabels)) - 1])
+                    for j in range(0, len(columnLabels), columnFactor)]
+    hoverText = np.array([[f"{rowFirst} - {rowLast}<br>{columnFirst} - {columnLast}<br>mean {mean:.1f}"
+                           for (columnFirst, columnLast), mean in zip(columnRanges, meanRow)]
+                          for (rowFirst, rowLast), meanRow in zip(rowRanges, means)], dtype=object)
+
+    return means, [first for first, last in rowRanges], [first for first, last in columnRanges], hoverText
+
+
+# ==============================================================================================================
+#                                               CALENDAR HEATMAP
+# ==============================================================================================================
+def calendarYears(dates):
+    return np.unique(pd.DatetimeIndex(dates).year)
+
+
+def calendarGrid(dates, clusterGroups, year, selectedCluster=-1):
+    """
+    Weekday x week grid of the days of the year, holding the cluster of each date of the year (NaN for the days
+    without a cluster). When a cluster is selected, the dates of the other clusters hold -1. The column of a day is its
+    week counted from the week of the 1st of January (weeks starting on Monday), so every day of the year has its own
+    cell, and its row is its weekday. It returns the grid, the grid of the dates as text (for the hover) and the label
+    of each week
+    """
+    firstDay = pd.Timestamp(year=int(year), month=1, day=1)
+    allDays = pd.date_range(start=firstDay, end=pd.Timestamp(year=int(year), month=12, day=31), freq='D')
+    offset = firstDay.weekday()
+    numberOfWeeks = (len(allDays) - 1 + offset) // 7 + 1
+
+    def cells(days):
+        dayIndex = (days - firstDay).days.to_numpy() + offset
+        return dayIndex % 7, dayIndex // 7
+
+    grid = np.full((7, numberOfWeeks), np.nan)
+    dates = pd.DatetimeIndex(dates)
+    clusterGroups = np.asarray(clusterGroups, dtype=float)
+    inYear = dates.year == int(year)
+    values = clusterGroups[inYear]
+    if selectedCluster != -1:
+        values = np.where(values == selectedCluster, values, -1)
+    rows, columns = cells(dates[inYear])
+    grid[rows, columns] = values
+
+    hoverText = np.full((7, numberOfWeeks), "", dtype=object)
+    rows, columns = cells(allDays)
+    hoverText[rows, columns] = allDays.strftime("%Y-%m-%d")
+
+    # each week is named after the month of its first day in the year
+    weekStarts = allDays[np.r_[0, np.arange(7 - offset, len(allDays), 7)]]
+    weekLabels = [f"{day.strftime('%B')}-week_{week + 1}" for week, day in enumerate(weekStarts)]
+
+    return grid, hoverText, weekLabels
+
+
+# ==============================================================================================================
+#                                                   PROFILES
+# ==============================================================================================================
+def keyProfileArray(keyFrame, dates):
+    """
+    Time x dates array of the profiles of the given dates of a key (dataframe with the time on the rows and the dates
+    on the columns), taken with a single slice
+    """
+    return keyFrame.to_numpy()[:, keyFrame.columns.get_indexer(pd.DatetimeIndex(dates))]
+
+
+def cubeProfileArray(profileCube, key, dates):
+    """
+    Time x dates array of the original profiles of the given dates of a key, restricted to the time buckets of the key,
+    taken from the profile cube with a single slice
+    """
+    k = profileCube.keys.get_loc(key)
+    dateIndexes = profileCube.dates.get_indexer(pd.DatetimeIndex(dates))
+
+    return profileCube.values[k][np.ix_(dateIndexes, profileCube.timeExists[k])].T
+
+
+def boxPlotData(times, profiles):
+    """
+    The x and y of a single box trace with a box for each time bucket: each time is repeated for each profile, the
+    profiles being the columns of the time x dates array
+    """
+    return np.repeat(np.asarray(times, dtype=object), profiles.shape[1]), profiles.ravel()
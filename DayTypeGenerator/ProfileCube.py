@@ -0,0 +1,91 @@
+import StageCache as sc
+
+import numpy as np
+import pandas as pd
+
+
+class ProfileCube:
+    """
+    Dense KeyID x Date x TimeBucket array of the values of one measure, built once from the clean dataframe and shared
+    by all the subsequent stages (smoothing, clustering, KPIs and charts) instead of filtering again and again the long
+    dataframe by key and date.
+    Missing values are NaN, the validity mask tells which cells are defined and profileExists tells, for each key,
+    which dates have at least one defined value, i.e. which dates are the profiles of the key. In the same way
+    timeExists tells which time buckets have at least one defined value for each key: the others are not part of the
+    profiles of the key.
+    """
+
+    def __init__(self, keys, dates, times, values):
+        self.keys = pd.Index(keys)
+        self.dates = pd.Index(dates)
+        self.times = pd.Index(times)
+        self.values = values
+        self.valid = ~np.isnan(values)
+        self.profileExists = self.valid.any(axis=2)
+        self.timeExists = self.valid.any(axis=1)
+
+    def withValues(self, values):
+        """
+        A new cube sharing the same index maps but storing other values (e.g. the smoothed ones). The profiles of each
+        key, i.e. its dates and time buckets, are kept the same of the current cube
+        """
+        cube = ProfileCube(self.keys, self.dates, self.times, values)
+        cube.profileExists = self.profileExists
+        cube.timeExists = self.timeExists
+
+        return cube
+
+    def datesOfKey(self, key):
+        return self.dates[self.profileExists[self.keys.get_loc(key)]]
+
+    def datesGivenAKey(self):
+        return {key: self.datesOfKey(key) for key in self.keys}
+
+    def profile(self, key, date):
+        """
+        The profile of one key for one date as a series indexed by the time buckets of the key
+        """
+        k = self.keys.get_loc(key)
+        timeExists = self.timeExists[k]
+
+        return pd.Series(self.values[k, self.dates.get_loc(date), timeExists], index=self.times[timeExists])
+
+    def keyFrame(self, key):
+        """
+        The profiles of one key as a dataframe having the time on the rows and the dates of the key on the columns
+        """
+        k = self.keys.get_loc(key)
+        exists = self.profileExists[k]
+        timeExists = self.timeExists[k]
+
+        return pd.DataFrame(self.values[k][np.ix_(exists, timeExists)].T,
+                            index=self.times[timeExists],
+                            columns=self.dates[exists])
+
+    def keyFrames(self):
+        return {key: self.keyFrame(key) for key in self.keys}
+
+
+@sc.stage()
+def buildProfileCube(cleanDataframe, valueColumn, dtype=np.float64):
+    """
+    Single pass construction of the cube: keys, dates and times are factorized into integer codes and the defined
+    values are scattered into the dense array. Keys keep the order in which they appear in the data, while dates and
+    times are sorted. If the same (key, date, time) appears more than once the first defined value is taken, as the
+    pivot tables used to do.
+    """
+    defined = (cleanDataframe[valueColumn] >= 0).to_numpy()
+    definedRows = cleanDataframe[defined]
+
+    keyCodes, keys = pd.factorize(definedRows['KeyID'], sort=False)
+    dateCodes, dates = pd.factorize(definedRows['Date'], sort=True)
+    timeCodes, times = pd.factorize(cleanDataframe['Time'], sort=True)
+    timeCodes = timeCodes[defined]
+    keys = np.asarray(keys)
+
+    values = np.full((len(keys), len(dates), len(times)), np.nan, dtype=dtype)
+    flatIndex = (keyCodes.astype(np.int64) * len(dates) + dateCodes) * len(times) + timeCodes
+    flatIndex, first = np.unique(flatIndex, return_index=True)
+    values.reshape(-1)[flatIndex] = definedRows[valueColumn].to_numpy(dtype=dtype)[first]
+
+    return ProfileCube(keys, dates, times, values)
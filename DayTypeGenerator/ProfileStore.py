@@ -0,0 +1,131 @@
+import StageCache as sc
+
+import collections.abc
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+# On-disk store of a cube of profiles (e.g. the smoothed ones): the values are a KeyID x Date x TimeBucket float32
+# array in a NumPy file opened as a memory map, beside a small index file with the keys, dates and time buckets and
+# the masks of the profiles of each key. Opening a store reads only the index: the profiles of a key are read from
+# the disk (or from the page cache shared by all the processes opening the same store, as the sessions of the
+# web-app) the first time the key is asked.
+# Stores are named by a digest of what they are computed from, so any complete store with a given name has the same
+# content: a store is written once and then opened by all the runs needing it.
+
+
+def storeName(stageName, profileCube, *options):
+    """
+    Name of the store of the result of a stage computed from the profile cube with the given options
+    """
+    return stageName + "-" + hashlib.sha1(repr((sc.argumentDigest(profileCube), options)).encode()).hexdigest()
+
+
+def storePaths(directory, name):
+    return os.path.join(directory, name + ".npy"), os.path.join(directory, name + "_index.npz")
+
+
+def storeExists(directory, name):
+    return all(os.path.exists(path) for path in storePaths(directory, name))
+
+
+def temporaryPath(path):
+    return path + "." + str(os.getpid()) + ".tmp"
+
+
+def createStoreValues(directory, name, shape):
+    """
+    Memory-mapped float32 array of the values of a new store, to be filled and then committed with commitStore. It is
+    written to a temporary file, so that a broken run never leaves a partial store
+    """
+    os.makedirs(directory, exist_ok=True)
+    valuesPath, indexPath = storePaths(directory, name)
+
+    return np.lib.format.open_memmap(temporaryPath(valuesPath), mode='w+', dtype=np.float32, shape=shape)
+
+
+def commitStore(values, profileCube, directory, name):
+    """
+    The values are flushed and moved beside the index of the profile cube they come from. If a store with the same
+    name has been committed meanwhile by another run (and it cannot be replaced while open, as on Windows), that one
+    is kept, having the same content
+    """
+    valuesPath, indexPath = storePaths(directory, name)
+    values.flush()
+    del values
+
+    with open(temporaryPath(indexPath), 'wb') as indexFile:
+        np.savez(indexFile,
+                 keys=np.array([str(key) for key in profileCube.keys], dtype=str),
+                 dates=profileCube.dates.values,
+                 times=profileCube.times.values,
+                 profileExists=profileCube.profileExists,
+                 timeExists=profileCube.timeExists)
+
+    for path in (valuesPath, indexPath):
+        try:
+            os.replace(temporaryPath(path), path)
+        except PermissionError:
+            if not storeExists(directory, name):
+                raise
+            os.remove(temporaryPath(path))
+
+
+def openProfileStore(directory, name):
+    return StoredProfiles(directory, name)
+
+
+class StoredProfiles(collections.abc.Mapping):
+    """
+    Read-only mapping of KeyID and dataframe of its profiles (time on the rows and dates of the key on the columns),
+    as the dictionary returned by ProfileCube.keyFrames, whose dataframes are built when asked from the memory-mapped
+    values. A key having all the dates and time buckets is a view of the memory map, without copies.
+    Pickling a store pickles only its location, so the stage cache keeps only a reference to it.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        valuesPath, indexPath = storePaths(directory, name)
+
+        with np.load(indexPath) as index:
+            self.keyIndex = pd.Index(index['keys'].astype(object))
+            self.dates = pd.Index(index['dates'])
+            self.times = pd.Index(index['times'])
+            self.profileExists = index['profileExists']
+            self.timeExists = index['timeExists']
+        self.array = np.load(valuesPath, mmap_mode='r')
+
+    def __getitem__(self, key):
+        k = self.keyIndex.get_loc(key)
+        exists = self.profileExists[k]
+        timeExists = self.timeExists[k]
+
+        if exists.all() and timeExists.all():
+            values = self.array[k]
+        else:
+            values = self.array[k][np.ix_(exists, timeExists)]
+
+        return pd.DataFrame(values.T, index=self.times[timeExists], columns=self.dates[exists], copy=False)
+
+    def __iter__(self):
+        return iter(self.keyIndex)
+
+    def __len__(self):
+        return len(self.keyIndex)
+
+    def __contains__(self, key):
+        return key in self.keyIndex
+
+    def contentDigest(self):
+        """
+        The name of the store is already a digest of its content
+        """
+        return self.name
+
+    def __getstate__(self):
+        return {"directory": self.directory, "name": self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"], state["name"])
@@ -0,0 +1,347 @@
+import Instrumentation as ins
+
+import argparse
+import collections
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import weakref
+
+import numpy as np
+import pandas as pd
+
+
+# Persistent stage cache of the pipeline. Each stage (reading, cleaning, profile cube, smoothing, clustering, ...) is
+# identified by a key computed from the name of the stage, the options the stage actually depends on and the keys of
+# the results of the previous stages it receives as input. The first stage depends on a fingerprint of the input file
+# (path, size and modification time), so the keys are chained from the input file down to the last stage and changing
+# an option invalidates only the stages downstream of it: e.g. changing the number of network clusters reuses the
+# cached smoothed profiles and per-key clusters.
+# Results are pickled into the cache directory and the least recently used ones are deleted when the size of the
+# directory exceeds the budget. Inside the web-app the results are also kept in memory, as st.cache used to do.
+# Cached results are shared, so they must be treated as read-only by the callers.
+# The persistent cache is disabled unless a directory is given. Pickles are loaded back as they are, so the cache
+# directory must be trusted: loading a crafted file can run any code.
+
+_cacheDirectory = None
+_cacheSizeBytes = 0
+
+# results kept in memory by the web-app, by stage key
+_memoryEntries = collections.OrderedDict()
+_memoryEntriesLimit = 16
+
+# stage key of the results recently returned by the stages, by object id, so that a result given as input to the
+# next stage is identified by its key instead of being hashed again
+_lineage = collections.OrderedDict()
+_lineageLimit = 32
+
+
+def configure(argOptions):
+    """
+    Function that sets the cache directory and its size budget from the options. An empty directory or a zero budget
+    disable the persistent cache
+    """
+    global _cacheDirectory, _cacheSizeBytes
+
+    _cacheDirectory = argOptions.cacheDirectory if argOptions.cacheDirectory else None
+    _cacheSizeBytes = int(float(argOptions.cacheSizeMB) * 1024 * 1024)
+
+
+def persistentCacheEnabled():
+    return _cacheDirectory is not None and _cacheSizeBytes > 0
+
+
+def memoryCacheEnabled():
+    return 'streamlit' in sys.modules
+
+
+# ==============================================================================================================
+#                                                 STAGE KEYS
+# ==============================================================================================================
+def fileFingerprint(path):
+    """
+    Fingerprint of an input file (or of a dataset directory, as for partitioned Parquet files) given by its path,
+    size and modification time, so that the file is never read to compute the key
+    """
+    path = os.path.abspath(getattr(path, 'name', path))
+    if not os.path.isdir(path):
+        status = os.stat(path)
+        return path, status.st_size, status.st_mtime_ns
+
+    files = []
+    for directory, subDirectories, fileNames in os.walk(path):
+        subDirectories.sort()
+        for fileName in sorted(fileNames):
+            status = os.stat(os.path.join(directory, fileName))
+            files.append((os.path.relpath(os.path.join(directory, fileName), path), status.st_size, status.st_mtime_ns))
+
+    return path, tuple(files)
+
+
+def contentDigest(value):
+    """
+    Digest of the content of an input which is not the result of a previous stage. Arrays and pandas objects are
+    hashed on their values, containers item by item and the other values by their representation
+    """
+    digest = hashlib.sha1()
+    if isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).view(np.uint8).ravel().tobytes())
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            digest.update(repr(key).encode())
+            digest.update(contentDigest(item).encode())
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            digest.update(contentDigest(item).encode())
+    elif hasattr(value, 'contentDigest'):
+        # objects knowing their own digest, e.g. the profile stores
+        digest.update(value.contentDigest().encode())
+    elif hasattr(value, '__dict__') and not isinstance(value, type):
+        digest.update(type(value).__name__.encode())
+        digest.update(contentDigest(vars(value)).encode())
+    else:
+        digest.update(repr(value).encode())
+
+    return digest.hexdigest()
+
+
+def argumentDigest(value):
+    """
+    The key of the result of a previous stage, otherwise the digest of the content of the input
+    """
+    entry = _lineage.get(id(value))
+    if entry is not None:
+        stageKey, reference = entry
+        if refersTo(reference, value):
+            return stageKey
+
+    return contentDigest(value)
+
+
+def stageKey(stageName, arguments, options, fileOptions, ignore):
+    """
+    Key of one stage: name of the stage, options it depends on, fingerprint of the input files and digests of the
+    other arguments (excluding the ignored ones, i.e. the ones not changing the result such as the number of workers)
+    """
+    components = [stageName]
+    for name, value in arguments.items():
+        if name in ignore:
+            continue
+        if isinstance(value, argparse.Namespace):
+            components.append((name, [(option, repr(getattr(value, option, None))) for option in options]))
+            components.append((name, [(option, fileFingerprint(getattr(value, option))) for option in fileOptions]))
+        else:
+            components.append((name, argumentDigest(value)))
+
+    return stageName + "-" + hashlib.sha1(repr(components).encode()).hexdigest()
+
+
+def optionsFingerprint(argOptions, ignore=()):
+    """
+    Fingerprint of a whole configuration: the options (but the ignored ones, i.e. the ones not changing the results)
+    and the fingerprint of the input file, e.g. to keep the results of the pipeline of each configuration
+    """
+    components = [(name, repr(value)) for name, value in sorted(vars(argOptions).items())
+                  if name not in ignore and name != "inputFile"]
+    components.append(("inputFile", fileFingerprint(argOptions.inputFile)))
+
+    return hashlib.sha1(repr(components).encode()).hexdigest()
+
+
+class ContainerReference:
+    """
+    Reference to a tuple, list or dictionary, which cannot be weakly referenced, made of the references of its items
+    (and of the keys of a dictionary), so that it does not keep alive the items
+    """
+
+    def __init__(self, container):
+        self.type = type(container)
+        self.keys = list(container.keys()) if isinstance(container, dict) else None
+        self.items = [lineageReference(item) for item in (container.values() if self.keys is not None else container)]
+
+    def refersTo(self, value):
+        if type(value) is not self.type or len(value) != len(self.items):
+            return False
+        if self.keys is not None and list(value.keys()) != self.keys:
+            return False
+
+        return all(refersTo(reference, item)
+                   for reference, item in zip(self.items, value.values() if self.keys is not None else value))
+
+
+def lineageReference(value):
+    """
+    Reference to a result kept by the lineage registry: a weak reference when possible, a reference to the items for
+    the containers, and the value itself only for the other (small) values, e.g. the outlier caps returned by cleanData
+    """
+    try:
+        return weakref.ref(value)
+    except TypeError:
+        pass
+    if isinstance(value, (tuple, list, dict)):
+        return ContainerReference(value)
+
+    return value
+
+
+def refersTo(reference, value):
+    """
+    Cheap identity check telling whether the value is still the result referenced by the lineage registry, i.e. its
+    id has not been reused by another object
+    """
+    if isinstance(reference, weakref.ref):
+        return reference() is value
+    if isinstance(reference, ContainerReference):
+        return reference.refersTo(value)
+
+    return reference is value
+
+
+def registerLineage(key, result):
+    """
+    The result (and each item of a tuple result, as the outputs of the stages are often unpacked) is associated with
+    the stage key. The registry never keeps alive the results: large objects (e.g. dataframes and arrays) are weakly
+    referenced, also when they are items of a tuple, list or dictionary result
+    """
+    items = [(key, result)]
+    if isinstance(result, tuple):
+        items += [(key + "/" + str(i), item) for i, item in enumerate(result)]
+
+    for itemKey, item in items:
+        _lineage[id(item)] = (itemKey, lineageReference(item))
+        _lineage.move_to_end(id(item))
+
+    while len(_lineage) > _lineageLimit:
+        _lineage.popitem(last=False)
+
+
+# ==============================================================================================================
+#                                               PERSISTENT STORE
+# ==============================================================================================================
+def entryPath(key):
+    return os.path.join(_cacheDirectory, key + ".pkl")
+
+
+def loadEntry(key):
+    """
+    The cached result of the stage key, None if it is not in the cache (or it cannot be read). The modification time
+    of the file is refreshed so that it becomes the most recently used entry
+    """
+    path = entryPath(key)
+    try:
+        with open(path, 'rb') as entryFile:
+            result = pickle.load(entryFile)
+        os.utime(path)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+    return result
+
+
+def storeEntry(key, result):
+    """
+    The result is written to a temporary file and then moved, so that a broken run never leaves partial entries.
+    Results larger than the whole budget are not stored
+    """
+    os.makedirs(_cacheDirectory, exist_ok=True)
+    path = entryPath(key)
+    temporaryPath = path + "." + str(os.getpid()) + ".tmp"
+    with open(temporaryPath, 'wb') as entryFile:
+        pickle.dump(result, entryFile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if os.path.getsize(temporaryPath) > _cacheSizeBytes:
+        os.remove(temporaryPath)
+        return
+
+    os.replace(temporaryPath, path)
+    evictEntries()
+
+
+def evictEntries():
+    """
+    Least recently used eviction: the entries with the oldest modification time are deleted until the size of the
+    cache directory is within the budget
+    """
+    entries = []
+    for fileName in os.listdir(_cacheDirectory):
+        if fileName.endswith(".pkl"):
+            status = os.stat(os.path.join(_cacheDirectory, fileName))
+            entries.append((status.st_mtime_ns, status.st_size, fileName))
+
+    totalSize = sum(size for _, size, _ in entries)
+    for _, size, fileName in sorted(entries):
+        if totalSize <= _cacheSizeBytes:
+            break
+        try:
+            os.remove(os.path.join(_cacheDirectory, fileName))
+        except OSError:
+            continue
+        totalSize -= size
+
+
+def clear():
+    """
+    Function that empties the memory and the persistent cache
+    """
+    _memoryEntries.clear()
+    _lineage.clear()
+    if _cacheDirectory is not None and os.path.isdir(_cacheDirectory):
+        for fileName in os.listdir(_cacheDirectory):
+            if fileName.endswith(".pkl"):
+                os.remove(os.path.join(_cacheDirectory, fileName))
+
+
+# ==============================================================================================================
+#                                                 DECORATOR
+# ==============================================================================================================
+def stage(options=(), fileOptions=(), ignore=()):
+    """
+    Decorator making a function a cached stage of the pipeline.
+    - options = names of the options (attributes of the argOptions argument) the result depends on
+    - fileOptions = names of the options being input files, which take part to the key by their fingerprint
+    - ignore = names of the arguments not changing the result (e.g. number of workers or block sizes)
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+        stageName = function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            boundArguments = signature.bind(*args, **kwargs)
+            boundArguments.apply_defaults()
+            key = stageKey(stageName, boundArguments.arguments, options, fileOptions, ignore)
+
+            result = _memoryEntries.get(key)
+            if result is not None:
+                _memoryEntries.move_to_end(key)
+            elif persistentCacheEnabled():
+                result = loadEntry(key)
+
+            if result is not None:
+                ins.markCached()
+            else:
+                result = function(*args, **kwargs)
+                if persistentCacheEnabled():
+                    storeEntry(key, result)
+
+            if memoryCacheEnabled():
+                _memoryEntries[key] = result
+                _memoryEntries.move_to_end(key)
+                while len(_memoryEntries) > _memoryEntriesLimit:
+                    _memoryEntries.popitem(last=False)
+
+            registerLineage(key, result)
+
+            return result
+
+        # every stage is a step of the run report
+        return ins.instrumented(wrapper)
+
+    return decorator
@@ -1,28 +1,135 @@
+import numpy as np
 import pandas as pd
-import datetime
+import os
+import shutil
+import time
 
+# Results writer: every table of results is assembled once and written with a single write into the output
+# directory, as a CSV file or as a Parquet file (or a Parquet dataset partitioned by KeyID, one folder per key). The
+# rows written and the time spent are printed and kept in the log of the writes of the run.
 
-def DetectorClusterSummaryCSV(ClusterResult, FileName):
+_outputDirectory = "Results"
+_outputFormat = "csv"
+_partitionByKey = False
+
+# (table name, path, rows, seconds) of each write of the run
+_writeLog = []
+
+
+def configure(argOptions):
+    """
+    Function that sets the output directory and format from the options
+    """
+    global _outputDirectory, _outputFormat, _partitionByKey
+
+    _outputDirectory = argOptions.outputDirectory
+    _outputFormat = argOptions.outputFormat
+    _partitionByKey = str(argOptions.partitionByKey) == 'True'
+
+
+# ==============================================================================================================
+#                                                    TABLES
+# ==============================================================================================================
+def dateFields(dates):
+    """
+    Name of the week day and number of the month of the dates, computed on the whole column at once
     """
-    the "ClusterResult" dataframe is the clustering result containing "ClusterGroup" and corresponded "Date"
-    with the mentioned named. The function dump a CSV file including "WeekDay" and "Month" name with
-    "ClusterGroup" in ascending order.
+    dates = pd.DatetimeIndex(dates)
+
+    return dates.day_name(), dates.month
+
+
+def DetectorClusterSummary(ClusterResult):
     """
-    final_result = pd.DataFrame([])
+    the "ClusterResult" dictionary holds for each KeyID the clustering result containing "ClusterGroup" and
+    corresponded "Date" with the mentioned named. The function returns a single table including "WeekDay" and "Month"
+    name with "ClusterGroup" in ascending order for each KeyID. Only the row order of each key is computed in the loop,
+    the table is assembled once.
+    """
+    keys = []
+    clusterGroups = []
+    dates = []
     for key, df in ClusterResult.items():
-        res = df.sort_values(["ClusterGroup"], ascending=True)
-        res["KeyID"] = list((key,) * len(df))
-        res["WeekDay"] = res["Date"].apply(lambda x: datetime.date.strftime(x, "%A"))
-        res["Month"] = res["Date"].apply(lambda x: x.month)
-        res = res[["KeyID", "ClusterGroup", "Date", "WeekDay", "Month"]]
-        final_result = pd.concat([final_result, res])
-    final_result.to_csv(FileName, index=False)
+        order = np.argsort(df["ClusterGroup"].to_numpy(), kind='quicksort')
+        keys.append(np.repeat(np.array([key], dtype=object), len(order)))
+        clusterGroups.append(df["ClusterGroup"].to_numpy()[order])
+        dates.append(pd.DatetimeIndex(df["Date"])[order])
+
+    if not keys:
+        return pd.DataFrame(columns=["KeyID", "ClusterGroup", "Date", "WeekDay", "Month"])
 
+    final_result = pd.DataFrame({"KeyID": np.concatenate(keys),
+                                 "ClusterGroup": np.concatenate(clusterGroups),
+                                 "Date": pd.DatetimeIndex(np.concatenate(dates))})
+    final_result["WeekDay"], final_result["Month"] = dateFields(final_result["Date"])
 
-def NetworkClusterSummaryCSV(ClusterResult, FileName):
+    return final_result
+
+
+def NetworkClusterSummary(ClusterResult):
     result = ClusterResult.sort_values(["ClusterGroup"], ascending=True)
-    result["WeekDay"] = result["Date"].apply(lambda x: datetime.date.strftime(x, "%A"))
-    result["Month"] = result["Date"].apply(lambda x: x.month)
-    result = result[["ClusterGroup", "Date", "WeekDay", "Month"]]
+    result["WeekDay"], result["Month"] = dateFields(result["Date"])
+
+    return result[["ClusterGroup", "Date", "WeekDay", "Month"]]
+
 
-    result.to_csv(FileName, index=False)
\ No newline at end of file
+# ==============================================================================================================
+#                                                    WRITER
+# ==============================================================================================================
+def writeParquet(table, path, partitionColumn):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("WRITING ERROR: ", "pyarrow is needed to write Parquet files")
+
+    arrowTable = pa.Table.from_pandas(table, preserve_index=False)
+    if partitionColumn is None:
+        pq.write_table(arrowTable, path)
+    else:
+        # a dataset is a directory of files, the ones of a previous run must not be mixed with the new ones
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        pq.write_to_dataset(arrowTable, path, partition_cols=[partitionColumn])
+
+
+def outputPath(fileName):
+    """
+    Path of a file of the output directory, which is created if missing
+    """
+    os.makedirs(_outputDirectory, exist_ok=True)
+
+    return os.path.join(_outputDirectory, fileName)
+
+
+def writeTable(table, tableName):
+    """
+    Single write of a table of results into the output directory, named after the table. In Parquet format the tables
+    having a KeyID column are partitioned by it when asked. It returns the path written
+    """
+    partitionColumn = None
+    if _outputFormat == "parquet" and _partitionByKey and "KeyID" in table.columns:
+        partitionColumn = "KeyID"
+    path = outputPath(tableName + ("" if partitionColumn else "." + _outputFormat))
+
+    start = time.perf_counter()
+    if _outputFormat == "parquet":
+        if partitionColumn is not None:
+            # partition values are written as the folder names
+            table = table.assign(KeyID=table["KeyID"].astype(str))
+        writeParquet(table, path, partitionColumn)
+    else:
+        table.to_csv(path, index=False)
+    seconds = time.perf_counter() - start
+
+    _writeLog.append((tableName, path, len(table.index), seconds))
+    print(f"Written {len(table.index)} rows into {path} in {seconds:.3f} s")
+
+    return path
+
+
+def writeReport():
+    """
+    Table of the writes done in the run: name of the table, path, rows written and time spent
+    """
+    return pd.DataFrame(_writeLog, columns=['Table', 'Path', 'Rows', 'Seconds'])
@@ -0,0 +1,102 @@
+import utils as ut
+
+import argparse
+import numpy as np
+import pandas as pd
+
+# Deterministic generator of synthetic detector data, in the same layout of data/sample_data.csv (KeyID; timestamp;
+# flow; speed), to measure the performance of the pipeline at any scale. Each key has its own capacity and free-flow
+# speed; working days have a morning and an evening peak, Saturdays, Sundays and holidays a single flatter midday
+# bump, so that the clustering has real day-types to find. Missing data (single values and whole days) and outliers
+# are added with the given rates. The same arguments always give the same data.
+
+# month-day of the holidays, which are given the pattern of a Sunday
+defaultHolidays = ("01-01", "01-06", "04-25", "05-01", "06-02", "08-15", "11-01", "12-08", "12-25", "12-26")
+
+
+def dayTypePatterns(timeBuckets):
+    """
+    Relative flow of the time buckets of a day (1 = capacity) for each of the 3 day-types: 0 = working day,
+    1 = Saturday, 2 = Sunday or holiday
+    """
+    hours = np.arange(timeBuckets) * 24.0 / timeBuckets
+
+    def bump(center, width):
+        return np.exp(-0.5 * ((hours - center) / width) ** 2)
+
+    night = 0.05
+    return np.vstack([night + 0.85 * bump(8.0, 1.2) + 0.75 * bump(17.5, 1.8) + 0.45 * bump(12.5, 3.0),
+                      night + 0.55 * bump(12.0, 3.5) + 0.25 * bump(18.5, 2.0),
+                      night + 0.40 * bump(13.0, 4.0)])
+
+
+def generateDetectorData(numberOfKeys, numberOfDays, TimeResolution=15, missingRate=0.02, missingDayRate=0.01,
+                         outlierRate=0.001, startDate="2016-01-01", holidays=defaultHolidays, seed=0):
+    """
+    Function that returns the synthetic data of numberOfKeys keys over numberOfDays days as a dataframe with the
+    columns clock_id, time_stamp, flow and speed:
+    - missingRate = fraction of the values set to missing
+    - missingDayRate = fraction of the (key, day) profiles entirely missing
+    - outlierRate = fraction of the flow values multiplied by a large factor
+    """
+    rng = np.random.default_rng(seed)
+    timeBuckets = ut.timeBucketNumber(TimeResolution)
+    dates = pd.date_range(startDate, periods=numberOfDays, freq='D')
+
+    dayTypes = np.where(dates.dayofweek < 5, 0, np.where(dates.dayofweek == 5, 1, 2))
+    dayTypes[np.isin(dates.strftime("%m-%d"), list(holidays))] = 2
+    patterns = dayTypePatterns(timeBuckets)
+
+    # capacity and free-flow speed of each key, seasonal modulation of the days
+    capacity = rng.lognormal(np.log(1200.0), 0.5, numberOfKeys)
+    freeFlowSpeed = rng.uniform(50.0, 110.0, numberOfKeys)
+    season = 1.0 + 0.1 * np.sin(2 * np.pi * np.arange(numberOfDays) / 365.25)
+
+    load = patterns[dayTypes][np.newaxis, :, :] * season[np.newaxis, :, np.newaxis]
+    load = load * rng.lognormal(0.0, 0.08, (numberOfKeys, numberOfDays, 1))
+    load = load * rng.lognormal(0.0, 0.05, (numberOfKeys, numberOfDays, timeBuckets))
+    flow = capacity[:, np.newaxis, np.newaxis] * load
+    speed = freeFlowSpeed[:, np.newaxis, np.newaxis] * (1.0 - 0.6 * np.clip(load, 0.0, 1.2) ** 3)
+    speed = np.clip(speed + rng.normal(0.0, 2.0, speed.shape), 5.0, None)
+
+    outliers = rng.random(flow.shape) < outlierRate
+    flow[outliers] *= rng.uniform(5.0, 20.0, int(outliers.sum()))
+
+    missing = (rng.random(flow.shape) < missingRate) | (rng.random((numberOfKeys, numberOfDays, 1)) < missingDayRate)
+    flow[missing] = np.nan
+    speed[missing] = np.nan
+
+    timestamps = (dates.values[:, np.newaxis] +
+                  (np.arange(timeBuckets) * TimeResolution).astype('timedelta64[m]')[np.newaxis, :]).ravel()
+    keys = np.array([f"{k:05d}_synt" for k in range(numberOfKeys)], dtype=object)
+
+    return pd.DataFrame({'clock_id': np.repeat(keys, numberOfDays * timeBuckets),
+                         'time_stamp': np.tile(timestamps, numberOfKeys),
+                         'flow': np.round(flow.ravel(), 1),
+                         'speed': np.round(speed.ravel(), 1)})
+
+
+def writeDetectorData(df, fileName):
+    """
+    The data are written as data/sample_data.csv: semicolon separated, with the header and empty missing values
+    """
+    df.to_csv(fileName, sep=';', index=False, date_format="%Y-%m-%d %H:%M:%S.000")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Synthetic detector data generator')
+    parser.add_argument('--numberOfKeys', type=int, default=100, help="Number of keys (detectors)")
+    parser.add_argument('--numberOfDays', type=int, default=365, help="Number of days")
+    parser.add_argument('--TimeResolution', type=int, default=15, help="Time resolution in minutes")
+    parser.add_argument('--missingRate', type=float, default=0.02, help="Fraction of missing values")
+    parser.add_argument('--missingDayRate', type=float, default=0.01, help="Fraction of missing daily profiles")
+    parser.add_argument('--outlierRate', type=float, default=0.001, help="Fraction of outlier flow values")
+    parser.add_argument('--startDate', default="2016-01-01", help="First day (YYYY-MM-DD)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator")
+    parser.add_argument('--outputFile', default="synthetic_data.csv", help="Output CSV file")
+    args = parser.parse_args()
+
+    data = generateDetectorData(args.numberOfKeys, args.numberOfDays, args.TimeResolution, args.missingRate,
+                                args.missingDayRate, args.outlierRate, args.startDate, seed=args.seed)
+    writeDetectorData(data, args.outputFile)
+    print(f"Written {len(data.index)} rows into {args.outputFile}")
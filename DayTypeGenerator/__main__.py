@@ -1,18 +1,40 @@
 import ConfigurableOptions as conf
-import DayTypeGenerator as dtg
+import Instrumentation as ins
+import StageCache as sc
+import SummaryReports as sr
 import argparse
-import streamlit as st
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Day-Type Generation by flow/speed time profiles')
 
-    st.title(parser.description)
-    st.sidebar.title("Configuration Panel")
-
     argOptions = conf.parseArgument(parser)
     if conf.checkArgument(argOptions):
-        st.balloons()
-        dtg.run(argOptions)
+        sc.configure(argOptions)
+        sr.configure(argOptions)
+        ins.configure(argOptions)
+        webApp = False
+        if argOptions.convertToParquet:
+            import FileReader as fr
+            numberOfRows = fr.convertCSVToParquet(argOptions, argOptions.convertToParquet)
+            print(f"Converted {numberOfRows} rows into {argOptions.convertToParquet}")
+        elif conf.isClassification(argOptions):
+            import DayTypeClassifier as dcl
+            dcl.run(argOptions)
+        elif conf.isIncremental(argOptions):
+            import IncrementalUpdate as iu
+            iu.run(argOptions)
+        elif conf.isHeadless(argOptions):
+            import BatchPipeline as bp
+            bp.run(argOptions)
+        else:
+            import streamlit as st
+            import DayTypeGenerator as dtg
+            st.balloons()
+            dtg.run(argOptions)
+            webApp = True
+        # the web-app writes the run report only when it computes the pipeline, not at each rerun
+        if not webApp:
+            ins.writeRunReport(argOptions)
     else:
         print("CONFIGURATION ERROR(s): review them!")
@@ -10,3 +10,11 @@ def timeBucketNumber(timeResolution):
     buckets = math.ceil(1440.0 / timeResolution)  # 1440 minutes in 24h
 
     return buckets
+
+
+def timeBucketLabels(buckets, timeResolution):
+    """
+    Function that converts the indexes of the time buckets within a day into readable "HH:MM" labels of the starting
+    time of each bucket, to be used only when the times are shown to the user
+    """
+    return ["%02d:%02d" % divmod(int(b) * timeResolution, 60) for b in buckets]
@@ -0,0 +1,259 @@
+import datetime
+import math
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import AffinityPropagation
+
+import DataSmoothing as ds
+import utils as ut
+
+# Loop implementations of the first version of the tool (without the Streamlit cache), kept only as references of the
+# vectorized ones in the equivalence tests.
+
+
+def similarityMatrix(FinalSmoothedDataFrame):
+    """
+    Similarity matrix among all the profiles of one ID computed pair by pair
+    """
+    dates = FinalSmoothedDataFrame.columns
+    values = FinalSmoothedDataFrame.values.T
+    size = len(dates)
+    similarity_matrix = []
+    for k in range(0, size):
+        correlation = []
+        M1 = (np.nansum(values[k] ** 2))
+        for j in range(0, size):
+            if k == j:
+                value = 1.0
+            else:
+                H = np.nansum(values[k] * values[j])
+                M2 = (np.nansum(values[j] ** 2))
+                value = H / ((M1 * M2) ** .5)
+            correlation.append(value)
+        similarity_matrix.append(correlation)
+
+    return pd.DataFrame(similarity_matrix, index=dates, columns=dates)
+
+
+def IndividualDetectorClusteringResult(FinalSmoothedDataFrame):
+    """
+    Affinity propagation of the profiles of each key, one key after the other. The random state is the one hard coded
+    by the versions of scikit-learn of the first version of the tool
+    """
+    individual_clustering = {}
+    centers_clustering = {}
+
+    for keyID, df in FinalSmoothedDataFrame.items():
+        dates = df.columns
+        similarityDF = similarityMatrix(df)
+
+        clustering = AffinityPropagation(affinity='precomputed', random_state=0).fit(similarityDF)
+        labels = clustering.labels_
+        centers = clustering.cluster_centers_indices_
+
+        cluster_result = pd.DataFrame(zip(dates, labels), columns=['Date', 'ClusterGroup'])
+        cluster_centers = pd.DataFrame(zip(range(0, len(centers)), centers), columns=['ClusterGroup',
+                                                                                      'ClusterCenterIndex'])
+
+        individual_clustering[keyID] = cluster_result
+        centers_clustering[keyID] = cluster_centers
+
+    return individual_clustering, centers_clustering
+
+
+def DataSmoothing(FinalDataFrame, ValueColumnIndex, kernelFunction):
+    """
+    Smoothing of the profiles of one key, one date after the other, on the time buckets of its pivot table
+    """
+    finalCleanPivotTable = pd.pivot_table(data=FinalDataFrame, index='Time', columns='Date',
+                                          values=FinalDataFrame.columns[ValueColumnIndex], aggfunc='first')
+
+    SmoothDataFrame = pd.DataFrame()
+    for col in finalCleanPivotTable:
+        SmoothDataFrame[col] = ds.smooth(finalCleanPivotTable[col], kernelFunction)
+
+    return SmoothDataFrame
+
+
+def smoothDataframe(FinalDataFrame, argOptions, measureType):
+    """
+    Smoothed profiles of each key, filtering the clean dataframe by key and by the dates having the measure
+    """
+    ValueColumnIndex = FinalDataFrame.columns.get_loc(measureType.lower())
+    IDvsDateDictionary = {}
+    for key in FinalDataFrame[FinalDataFrame[measureType.lower()] >= 0]['KeyID'].unique():
+        IDvsDateDictionary[key] = FinalDataFrame[(FinalDataFrame['KeyID'] == key) &
+                                                 (FinalDataFrame[measureType.lower()] >= 0)]['Date'].unique()
+
+    kernelHalfWidth = math.ceil(argOptions.smoothingKernelPercentage * ut.timeBucketNumber(argOptions.TimeResolution) / 200)
+    kernelFunction = ds.kernel(kernelHalfWidth)
+
+    smoothDF = {}
+    for key, value in IDvsDateDictionary.items():
+        df = FinalDataFrame[(FinalDataFrame['KeyID'] == key) & (FinalDataFrame['Date'].isin(value))]
+        smoothDF[key] = DataSmoothing(df, ValueColumnIndex, kernelFunction)
+
+    return smoothDF
+
+
+def checkCompleteness(outlierDataframe, argOptions):
+    """
+    Masking of the incomplete profiles one key after the other, with pivot tables of the counts of each measure. The
+    missing percentage is the one of the number of time buckets of a day (the first version compared the count itself
+    with the percentage)
+    """
+    profileKeyNames = outlierDataframe.loc[:, 'KeyID']
+    pivots = {}
+    for columnIndex, maximumMissing in ((argOptions.flow, argOptions.maximumMissingPercentageFlow),
+                                        (argOptions.speed, argOptions.maximumMissingPercentageSpeed)):
+        if columnIndex < 0:
+            continue
+        pivotKeyDateDF = outlierDataframe.pivot_table(index=profileKeyNames, columns='Date',
+                                                      values=outlierDataframe.columns[columnIndex],
+                                                      aggfunc=lambda x: x.count())
+
+        missingPercentage = 100 * (1 - pivotKeyDateDF / ut.timeBucketNumber(argOptions.TimeResolution))
+        pivotKeyDateDF.mask(missingPercentage > maximumMissing, inplace=True)
+
+        IDdates = {}
+        for ID in pivotKeyDateDF.index:
+            IDdates[ID] = pivotKeyDateDF.loc[ID, :].dropna().index.astype(str).tolist()
+
+        for key, value in IDdates.items():
+            outlierDataframe.iloc[:, columnIndex].mask((outlierDataframe.loc[:, 'KeyID'] == key) &
+                                                       (np.logical_not(outlierDataframe.loc[:, 'Date'].astype(str).isin(value))),
+                                                       inplace=True)
+        pivots[columnIndex] = pivotKeyDateDF
+
+    return pivots.get(argOptions.flow), pivots.get(argOptions.speed), outlierDataframe
+
+
+def datetimeAndKeyOptimization(finalCleanDataframe, argOptions):
+    """
+    Date and time objects and key strings built row by row
+    """
+    finalCleanDataframe['Date'] = [d.date() for d in finalCleanDataframe.iloc[:, argOptions.timestamp]]
+    finalCleanDataframe['Time'] = [d.time() for d in finalCleanDataframe.iloc[:, argOptions.timestamp]]
+
+    if argOptions.ID2 >= 0:
+        finalCleanDataframe['KeyID'] = finalCleanDataframe.iloc[:, argOptions.ID1] + ";" + \
+            finalCleanDataframe.iloc[:, argOptions.ID2]
+    else:
+        finalCleanDataframe['KeyID'] = finalCleanDataframe.iloc[:, argOptions.ID1]
+
+    return finalCleanDataframe
+
+
+def networkSimilarityMatrix(singleLocationClusteringDF):
+    """
+    Similarity of the days from the dense incidence dataframe of the (KeyID, ClusterGroup) tuples over the days,
+    filled one cell at a time. Days are in the order of a set
+    """
+    setOfDays = set()
+    for key in singleLocationClusteringDF:
+        for d in singleLocationClusteringDF[key]['Date'].unique():
+            setOfDays.add(pd.Timestamp(d).strftime("%Y-%m-%d"))
+
+    IDcol = []
+    ClusterCol = []
+    key2cluster2days = {}
+    for key in singleLocationClusteringDF:
+        key2cluster2days[key] = {}
+        for cl in singleLocationClusteringDF[key]['ClusterGroup'].unique():
+            IDcol.append(key)
+            ClusterCol.append(cl)
+            key2cluster2days[key][cl] = [pd.Timestamp(d).strftime("%Y-%m-%d") for d in list(
+                singleLocationClusteringDF[key][singleLocationClusteringDF[key]['ClusterGroup'] == cl]['Date'])]
+
+    tmpDF = pd.DataFrame(IDcol, columns=['KeyID'])
+    tmpDF['ClusterGroup'] = ClusterCol
+    for d in setOfDays:
+        tmpDF[d] = np.zeros(len(tmpDF.index))
+
+    for key in key2cluster2days:
+        for cl in key2cluster2days[key]:
+            for d in key2cluster2days[key][cl]:
+                indexRow = tmpDF.index[(tmpDF['KeyID'] == key) & (tmpDF['ClusterGroup'] == cl)].tolist()
+                tmpDF.at[indexRow[0], d] = 1.0
+
+    simNumerator = []
+    for d in setOfDays:
+        simNumerator.append(tmpDF[d].to_numpy())
+    num = np.asarray(simNumerator, dtype=np.float32)
+
+    pivotTmpDF = tmpDF.pivot_table(index=['KeyID'], values=list(setOfDays), aggfunc=lambda x: x.sum())
+
+    simDenominator = []
+    for d in setOfDays:
+        simDenominator.append(pivotTmpDF[d].to_numpy())
+    den = np.asarray(simDenominator, dtype=np.float32)
+
+    similarityMatrixDays = np.nan_to_num(np.divide(np.matmul(num, num.T), np.matmul(den, den.T)))
+
+    return pd.DataFrame(similarityMatrixDays, index=list(setOfDays), columns=list(setOfDays))
+
+
+def readInputFileCSV(argOptions):
+    """
+    Reading of the whole CSV file at once
+    """
+    columnIndex = {"ID1": argOptions.ID1,
+                   "ID2": argOptions.ID2,
+                   "timestamp": argOptions.timestamp,
+                   "flow": argOptions.flow,
+                   "speed": argOptions.speed}
+
+    columnType = {"ID1": "str",
+                  "ID2": "str",
+                  "timestamp": "datetime",
+                  "flow": "float64",
+                  "speed": "float64"}
+
+    columnNames = {}
+    dtypes = {}
+    for key, value in columnIndex.items():
+        if int(value) >= 0:
+            columnNames[key] = value
+            if columnType[key] != "datetime":
+                dtypes[value] = columnType[key]
+
+    columnNames = {k: v for k, v in sorted(columnNames.items(), key=lambda item: item[1])}
+
+    df = pd.read_csv(argOptions.inputFile,
+                     sep=argOptions.fileSeparator,
+                     header=(None if argOptions.header == "False" else 0),
+                     usecols=columnNames.values(),
+                     dtype=dtypes,
+                     parse_dates=[columnNames["timestamp"]],
+                     compression=(None if argOptions.compression == "None" else argOptions.compression))
+
+    df.columns = columnNames.keys()
+
+    if 'flow' in columnNames:
+        df['flow'] *= argOptions.flowFactor
+    if 'speed' in columnNames:
+        df['speed'] *= argOptions.speedFactor
+
+    return df
+
+
+def DetectorClusterSummaryCSV(ClusterResult, FileName):
+    final_result = pd.DataFrame([])
+    for key, df in ClusterResult.items():
+        res = df.sort_values(["ClusterGroup"], ascending=True)
+        res["KeyID"] = list((key,) * len(df))
+        res["WeekDay"] = res["Date"].apply(lambda x: datetime.date.strftime(x, "%A"))
+        res["Month"] = res["Date"].apply(lambda x: x.month)
+        res = res[["KeyID", "ClusterGroup", "Date", "WeekDay", "Month"]]
+        final_result = pd.concat([final_result, res])
+    final_result.to_csv(FileName, index=False)
+
+
+def NetworkClusterSummaryCSV(ClusterResult, FileName):
+    result = ClusterResult.sort_values(["ClusterGroup"], ascending=True)
+    result["WeekDay"] = result["Date"].apply(lambda x: datetime.date.strftime(x, "%A"))
+    result["Month"] = result["Date"].apply(lambda x: x.month)
+    result = result[["ClusterGroup", "Date", "WeekDay", "Month"]]
+
+    result.to_csv(FileName, index=False)
@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules of the tool are imported by their name, as done by the tool itself
+rootDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(rootDirectory, "DayTypeGenerator"))
+
+import ConfigurableOptions as conf
+import DataCleansing as dc
+import DataSmoothing as ds
+import FileReader as fr
+import ProfileCube as pc
+
+# Shared data of the tests: the sample data of the repository plus a copy of one of its keys (gapKey) whose profiles
+# have no data at all in some time buckets (time gaps), so that the profiles of the key do not cover the whole day.
+
+gapKey = "gap_cloc"
+gapTimeBuckets = list(range(44, 53)) + list(range(75, 85))
+
+
+def runOptions(inputFile, **options):
+    """
+    Default options of a run on the test data (laid out as the sample data), changed by the given ones
+    """
+    argOptions = conf.parseArgument(argparse.ArgumentParser(), [])
+
+    argOptions.inputFile = inputFile
+    argOptions.fileSeparator = ';'
+    argOptions.header = 'True'
+    argOptions.ID1 = 0
+    argOptions.timestamp = 1
+    argOptions.flow = 2
+    argOptions.speed = 3
+    # no persistent stage cache, unless a test asks for it
+    argOptions.cacheDirectory = ""
+    for name, value in options.items():
+        setattr(argOptions, name, value)
+
+    return argOptions
+
+
+@pytest.fixture(scope="session")
+def dataFile(tmp_path_factory):
+    sample = pd.read_csv(os.path.join(rootDirectory, "data", "sample_data.csv"), sep=";", parse_dates=["time_stamp"])
+
+    gapData = sample[sample['clock_id'] == sample['clock_id'].iloc[0]].copy()
+    gapData['clock_id'] = gapKey
+    timeBucket = (60 * gapData['time_stamp'].dt.hour + gapData['time_stamp'].dt.minute) // 15
+    gapData = gapData[~timeBucket.isin(gapTimeBuckets)]
+
+    fileName = str(tmp_path_factory.mktemp("data") / "test_data.csv")
+    pd.concat([sample, gapData], ignore_index=True).to_csv(fileName, sep=";", index=False)
+
+    return fileName
+
+
+@pytest.fixture(scope="session")
+def argOptions(dataFile):
+    return runOptions(dataFile)
+
+
+@pytest.fixture(scope="session")
+def rawData(argOptions):
+    return fr.readInputFile(argOptions)
+
+
+@pytest.fixture(scope="session")
+def cleanData(rawData, argOptions):
+    """
+    The result of cleanData: clean dataframe, flow and speed caps and flow and speed count pivots
+    """
+    return dc.cleanData(rawData, argOptions)
+
+
+@pytest.fixture(scope="session")
+def cleanDataframe(cleanData):
+    return cleanData[0]
+
+
+def assertSameArrays(actual, expected, tolerance=1e-9):
+    """
+    The arrays have the same shape, the same NaN cells and the same values elsewhere (up to the tolerance)
+    """
+    actual, expected = np.asarray(actual, dtype=float), np.asarray(expected, dtype=float)
+    assert actual.shape == expected.shape
+    assert np.array_equal(np.isnan(actual), np.isnan(expected))
+    np.testing.assert_allclose(actual[~np.isnan(actual)], expected[~np.isnan(expected)], rtol=tolerance,
+                               atol=tolerance)
+
+
+@pytest.fixture(scope="session")
+def smoothProfiles(cleanDataframe, argOptions):
+    """
+    Smoothed profiles of each key of each measure, i.e. the dictionaries of KeyID and dataframe (time on the rows and
+    dates on the columns) given to the clustering
+    """
+    return {measureType: ds.smoothDataframe(pc.buildProfileCube(cleanDataframe, measureType.lower()), argOptions)
+            for measureType in ('Flow', 'Speed')}
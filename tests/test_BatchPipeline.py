@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import BatchPipeline as bp
+import SummaryReports as sr
+from conftest import rootDirectory, runOptions
+
+
+def resultsTable(directory, name):
+    return pd.read_csv(os.path.join(str(directory), "Results", name + ".csv"))
+
+
+def test_batchPipelineWithoutStreamlit():
+    """
+    The headless pipeline does not load Streamlit (nor the plotting libraries)
+    """
+    loaded = subprocess.run([sys.executable, "-c", "import sys, BatchPipeline; "
+                                                   "print(sorted({'streamlit', 'matplotlib', 'plotly'} & "
+                                                   "{name.split('.')[0] for name in sys.modules}))"],
+                            cwd=os.path.join(rootDirectory, "DayTypeGenerator"), capture_output=True, text=True,
+                            check=True)
+
+    assert loaded.stdout.strip() == "[]"
+
+
+@pytest.fixture(scope="module")
+def headlessRun(dataFile, tmp_path_factory):
+    """
+    Directory of a headless run of the flow profiles of the test data
+    """
+    directory = tmp_path_factory.mktemp("headless")
+    workingDirectory = os.getcwd()
+    os.chdir(directory)
+    try:
+        bp.run(runOptions(dataFile, headless='True', speed=-1, enableProfileClustering=True,
+                          enableNetworkClustering=True, autoNetworkClusters='True', minimumNetworkClusters=2,
+                          maximumNetworkClusters=6, networkClusteringInits=3))
+    finally:
+        os.chdir(workingDirectory)
+
+    return directory
+
+
+def test_runWritesClusterResults(headlessRun, smoothProfiles):
+    """
+    The per-key results have a row for each profile of each key and the KPIs a row for each of its clusters
+    """
+    individualResults = resultsTable(headlessRun, "Individual_Flow_Cluster_Results")
+    individualKPIs = resultsTable(headlessRun, "Individual_Flow_Cluster_KPIs")
+
+    profiles = {(key, date) for key, df in smoothProfiles['Flow'].items()
+                for date in pd.to_datetime(df.columns).strftime("%Y-%m-%d")}
+    assert set(zip(individualResults['KeyID'], individualResults['Date'])) == profiles
+    assert len(individualResults.index) == len(profiles)
+    for key, df in individualResults.groupby('KeyID'):
+        assert (individualKPIs['KeyID'] == key).sum() == df['ClusterGroup'].nunique()
+
+
+def test_runWritesNetworkResults(headlessRun, smoothProfiles):
+    """
+    The network results have a row for each date having profiles, in one of the clusters of the selected number
+    """
+    networkResults = resultsTable(headlessRun, "Network_Flow_Cluster_Results")
+    selection = resultsTable(headlessRun, "Network_Flow_Cluster_Selection")
+
+    dates = set().union(*[pd.to_datetime(df.columns).strftime("%Y-%m-%d") for df in smoothProfiles['Flow'].values()])
+    assert sorted(networkResults['Date']) == sorted(dates)
+    assert list(selection['NumberOfClusters']) == [2, 3, 4, 5, 6]
+    assert selection['Selected'].sum() == 1
+    numberOfClusters = selection.loc[selection['Selected'], 'NumberOfClusters'].iloc[0]
+    assert sorted(networkResults['ClusterGroup'].unique()) == list(range(numberOfClusters))
+
+
+def test_runWritesClusteringQuality(headlessRun, smoothProfiles):
+    """
+    The quality table has a row for each key, the ones whose clustering did not converge and then the lowest
+    silhouette scores first
+    """
+    qualityTable = resultsTable(headlessRun, "Individual_Flow_Cluster_Quality")
+
+    assert sorted(qualityTable['KeyID']) == sorted(smoothProfiles['Flow'])
+    pd.testing.assert_frame_equal(qualityTable, qualityTable.sort_values(['Converged', 'Silhouette'],
+                                                                         na_position='last', kind='mergesort'))
+
+
+def test_computeSingleMeasureWritesNothing(cleanDataframe, dataFile, tmp_path):
+    """
+    The results of a measure are computed without writing any file, and then exported into tables named after the
+    measure, so that the ones of a measure are not overwritten by the other one
+    """
+    argOptions = runOptions(dataFile, enableProfileClustering=True, enableNetworkClustering=True,
+                            outputDirectory=str(tmp_path / "Results"))
+    sr.configure(argOptions)
+    try:
+        results = bp.computeSingleMeasure(cleanDataframe, 'Flow', argOptions)
+        assert not os.path.exists(argOptions.outputDirectory)
+
+        bp.exportSingleMeasure(results, argOptions)
+        bp.exportSingleMeasure(bp.computeSingleMeasure(cleanDataframe, 'Speed', argOptions), argOptions)
+    finally:
+        sr.configure(runOptions(dataFile))
+
+    assert results.measureType == 'Flow'
+    assert list(results.sectionClusterDF) == list(results.smoothDF)
+    assert list(results.qualityTable['KeyID']) != [] and results.networkModel is not None
+    assert sorted(os.listdir(argOptions.outputDirectory)) == sorted(
+        [f"{table}.csv".format(measure) for measure in ['Flow', 'Speed']
+         for table in ["Individual_{}_Cluster_Results", "Individual_{}_Cluster_KPIs", "Individual_{}_Cluster_Quality",
+                       "Network_{}_Cluster_Results", "Network_{}_Cluster_KPIs"]])
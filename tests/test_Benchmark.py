@@ -0,0 +1,59 @@
+import argparse
+
+import pytest
+
+import Benchmark as bm
+
+stageNames = ["readInputFile", "cleanData", "buildProfileCube", "smoothDataframe", "similarityMatrix",
+              "IndividualDetectorClusteringResult", "KPI", "networkSimilarityMatrix", "networkClustering",
+              "NetworkKpisIntegration", "exportIndividualResults", "exportNetworkResults"]
+
+
+def test_parseScales():
+    assert bm.parseScales("10x30,50X90") == [(10, 30), (50, 90)]
+    with pytest.raises(Exception, match="BENCHMARK ERROR"):
+        bm.parseScales("10-30")
+
+
+@pytest.mark.parametrize("measureMemory", [False, True])
+def test_measureStageRunsOnce(measureMemory):
+    calls = []
+
+    result, measurement = bm.measureStage(lambda: calls.append(len(calls)) or bytearray(4 << 20), measureMemory)
+
+    assert calls == [0] and len(result) == 4 << 20
+    if measureMemory:
+        assert measurement["peakMemoryMB"] >= 4
+    else:
+        assert measurement["peakMemoryMB"] is None
+
+
+@pytest.mark.parametrize("noMemory", [False, True])
+def test_benchmarkScale(tmp_path, noMemory):
+    args = argparse.Namespace(TimeResolution=60, seed=0, measure='Flow', numberOfWorkers=1, noMemory=noMemory)
+
+    result = bm.benchmarkScale(4, 30, args, str(tmp_path))
+
+    assert result["numberOfRows"] == 4 * 30 * 24
+    assert list(result["stages"]) == stageNames
+    for stageResult in result["stages"].values():
+        assert stageResult["seconds"] >= 0
+        assert (stageResult["peakMemoryMB"] is None) == noMemory
+    assert result["totalSeconds"] == pytest.approx(sum(s["seconds"] for s in result["stages"].values()), abs=1e-5)
+
+
+def test_compareRuns():
+    previous = {"scales": [{"numberOfKeys": 10, "numberOfDays": 30, "TimeResolution": 15,
+                            "stages": {"cleanData": {"seconds": 2.0, "peakMemoryMB": 10.0},
+                                       "KPI": {"seconds": 1.0, "peakMemoryMB": None}}}]}
+    current = {"scales": [{"numberOfKeys": 10, "numberOfDays": 30, "TimeResolution": 15,
+                           "stages": {"cleanData": {"seconds": 1.0, "peakMemoryMB": 5.0},
+                                      "readInputFile": {"seconds": 1.0, "peakMemoryMB": 1.0}}},
+                          {"numberOfKeys": 50, "numberOfDays": 90, "TimeResolution": 15, "stages": {}}]}
+
+    comparison = bm.compareRuns(previous, current)
+
+    assert list(comparison['Stage']) == ["cleanData"]
+    assert comparison['Scale'].iloc[0] == "10x30"
+    assert comparison['SecondsRatio'].iloc[0] == 0.5
+    assert comparison['PeakMemoryRatio'].iloc[0] == 0.5
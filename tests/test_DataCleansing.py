@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+import utils as ut
+
+import DataCleansing as dc
+import ReferenceImplementations as ref
+from conftest import assertSameArrays, gapKey, runOptions
+
+
+@pytest.fixture(scope="module")
+def augmentedData(rawData, argOptions):
+    """
+    The raw data up to datetimeAndKeyOptimization, i.e. the input of checkCompleteness
+    """
+    validDataFrame = dc.checkValidity(rawData.copy(), argOptions)
+    outlierDataframe = dc.checkOutliers(validDataFrame, argOptions)[0]
+
+    return dc.datetimeAndKeyOptimization(outlierDataframe, argOptions)
+
+
+@pytest.mark.parametrize("ID2", [-1, 0])
+def test_datetimeAndKeyOptimizationEqualsLoop(rawData, dataFile, ID2):
+    """
+    Dates, time buckets and keys are the ones of the row by row version, the time buckets being shown as its times
+    """
+    argOptions = runOptions(dataFile, ID2=ID2)
+    augmentedDF = dc.datetimeAndKeyOptimization(rawData.copy(), argOptions)
+    expectedDF = ref.datetimeAndKeyOptimization(rawData.copy(), argOptions)
+
+    assert [d.date() for d in augmentedDF['Date']] == list(expectedDF['Date'])
+    assert ut.timeBucketLabels(augmentedDF['Time'], argOptions.TimeResolution) == \
+        [t.strftime("%H:%M") for t in expectedDF['Time']]
+    assert list(augmentedDF['KeyID'].astype(str)) == list(expectedDF['KeyID'])
+
+
+@pytest.mark.parametrize("maximumMissingPercentage", [100, 50, 10])
+def test_checkCompletenessEqualsLoop(augmentedData, dataFile, maximumMissingPercentage):
+    """
+    The key with time gaps misses about 20% of the time buckets of each day, so with a threshold of 10% all its
+    profiles are incomplete
+    """
+    argOptions = runOptions(dataFile, maximumMissingPercentageFlow=maximumMissingPercentage,
+                             maximumMissingPercentageSpeed=maximumMissingPercentage)
+    pivotFlowDF, pivotSpeedDF, completeDF = dc.checkCompleteness(augmentedData.copy(), argOptions)
+    expectedFlowDF, expectedSpeedDF, expectedDF = ref.checkCompleteness(augmentedData.copy(), argOptions)
+
+    for column in ('flow', 'speed'):
+        assertSameArrays(completeDF[column], expectedDF[column])
+    for pivot, expected in ((pivotFlowDF, expectedFlowDF), (pivotSpeedDF, expectedSpeedDF)):
+        assert set(pivot.index) == set(expected.index) and set(pivot.columns) == set(expected.columns)
+        assertSameArrays(pivot.reindex(index=expected.index, columns=expected.columns), expected)
+
+    if maximumMissingPercentage < 19:
+        assert completeDF.loc[completeDF['KeyID'] == gapKey, 'flow'].isna().all()
+
+
+def test_cleanDataLeavesRawDataUnchanged(rawData, argOptions):
+    """
+    Negative values and outliers are masked in the clean data only
+    """
+    raw = rawData.copy()
+    raw.iloc[:5, argOptions.flow] = -1.0
+    raw.iloc[5:10, argOptions.speed] = 1e6
+    expected = raw.copy()
+
+    cleanDF, cap_flow, cap_speed = dc.cleanData(raw, argOptions)[:3]
+
+    pd.testing.assert_frame_equal(raw, expected)
+    assert not (cleanDF['flow'] < 0).any()
+    assert not (cleanDF['flow'] > cap_flow).any() and not (cleanDF['speed'] > cap_speed).any()
+
+
+def test_checkOutliersWithoutSpeed(rawData, dataFile):
+    """
+    Without the speed column no column is taken as the speed one, so the last column keeps its zeros
+    """
+    argOptions = runOptions(dataFile, speed=-1, keepSpeedZero=False)
+    raw = rawData.copy()
+    raw.iloc[:5, -1] = 0.0
+
+    validDataFrame, cap_flow, cap_speed = dc.checkOutliers(raw.copy(), argOptions)
+
+    assert cap_speed is None
+    pd.testing.assert_series_equal(validDataFrame.iloc[:, -1], raw.iloc[:, -1])
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import DataSmoothing as ds
+import ReferenceImplementations as ref
+from conftest import assertSameArrays, gapKey
+
+
+@pytest.mark.parametrize("halfWidth", [1, 5])
+def test_smoothArrayEqualsSeries(cleanDataframe, halfWidth):
+    """
+    The vectorized smoothing of all the profiles of a key at once gives the smoothing of each profile as a series
+    """
+    g = ds.kernel(halfWidth)
+    for key in cleanDataframe['KeyID'].unique()[:3].tolist() + [gapKey]:
+        profiles = cleanDataframe[cleanDataframe['KeyID'] == key].pivot_table(index='Time', columns='Date',
+                                                                              values='flow', aggfunc='first')
+        expected = np.array([ds.smooth(profiles[date], g).to_numpy() for date in profiles])
+
+        assertSameArrays(ds.smoothArray(profiles.values.T, g), expected)
+
+
+def test_smoothArrayMissingValues():
+    values = np.random.default_rng(0).uniform(0, 100, (4, 6, 40))
+    values[values < 30] = np.nan
+    values[0, 0] = np.nan
+    g = ds.kernel(3)
+    expected = np.array([[ds.smooth(pd.Series(profile), g).to_numpy() for profile in key] for key in values])
+
+    assertSameArrays(ds.smoothArray(values, g), expected)
+
+
+@pytest.mark.parametrize("measureType", ['Flow', 'Speed'])
+def test_smoothDataframeEqualsLoop(cleanDataframe, argOptions, smoothProfiles, measureType):
+    """
+    The profiles of each key are the ones smoothed over the pivot table of the key, also when it has time gaps
+    """
+    expected = ref.smoothDataframe(cleanDataframe, argOptions, measureType)
+
+    assert list(smoothProfiles[measureType]) == list(expected)
+    for key, profiles in expected.items():
+        smoothed = smoothProfiles[measureType][key]
+        assert list(smoothed.index) == list(profiles.index)
+        assert list(smoothed.columns) == list(profiles.columns)
+        assertSameArrays(smoothed, profiles)
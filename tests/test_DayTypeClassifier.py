@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import DayTypeClassifier as dtcl
+import DayTypeClustering as dtc
+import NetworkDayTypeModel as ndm
+import ProfileCube as pc
+
+
+@pytest.fixture(scope="module")
+def fittedClusters(smoothProfiles):
+    return dtc.IndividualDetectorClusteringResult(smoothProfiles['Flow'])
+
+
+@pytest.fixture(scope="module")
+def classifier(smoothProfiles, fittedClusters, argOptions):
+    clusters, centers = fittedClusters
+
+    return dtcl.buildClassifier(smoothProfiles['Flow'], clusters, centers, None, None, argOptions)
+
+
+@pytest.fixture(scope="module")
+def flowCube(cleanDataframe):
+    return pc.buildProfileCube(cleanDataframe, 'flow')
+
+
+def test_classifyGivesFittedClusters(classifier, fittedClusters, flowCube):
+    """
+    The profiles of the fit are classified in the clusters the clustering has given them, being each profile in the
+    cluster of its most similar exemplar
+    """
+    clusters, _ = fittedClusters
+    keyClusters, dayTypes = classifier.classify(flowCube)
+
+    for key, df in clusters.items():
+        keyResult = keyClusters[keyClusters['KeyID'] == str(key)]
+        assert list(keyResult['Date']) == list(pd.to_datetime(df['Date']))
+        assert list(keyResult['ClusterGroup']) == list(df['ClusterGroup'])
+        assert (keyResult['ExemplarSimilarity'] <= 1 + 1e-9).all()
+    # without the network model no day-type is given
+    assert (dayTypes['ClusterGroup'] == -1).all()
+
+
+def test_classifyDateEqualsBatch(classifier, flowCube):
+    keyClusters, _ = classifier.classify(flowCube)
+    date = flowCube.dates[len(flowCube.dates) // 2]
+    d = flowCube.dates.get_loc(date)
+    profilesForDate = pd.DataFrame(flowCube.values[:, d, :], index=flowCube.keys, columns=flowCube.times)
+
+    labels, dayType = classifier.classifyDate(profilesForDate)
+
+    expected = keyClusters[keyClusters['Date'] == date].set_index('KeyID')['ClusterGroup']
+    assert labels[labels >= 0].to_dict() == expected.to_dict()
+    assert dayType == -1
+
+
+def test_classifierRoundTrip(classifier, flowCube, tmp_path):
+    dtcl.saveClassifier(classifier, str(tmp_path), 'Flow')
+    loadedClassifier = dtcl.loadClassifier(str(tmp_path), 'Flow')
+
+    assert loadedClassifier.metadata == classifier.metadata
+    np.testing.assert_array_equal(loadedClassifier.exemplars, classifier.exemplars)
+    pd.testing.assert_frame_equal(loadedClassifier.classify(flowCube)[0], classifier.classify(flowCube)[0])
+
+
+def test_classifyGivesNetworkDayTypes(smoothProfiles, fittedClusters, flowCube, argOptions):
+    """
+    With the network model, the days of the network clustering are given their network clusters
+    """
+    clusters, centers = fittedClusters
+    networkModel = ndm.NetworkDayTypeModel(clusters, 4)
+    classifier = dtcl.buildClassifier(smoothProfiles['Flow'], clusters, centers, networkModel, None, argOptions)
+
+    _, dayTypes = classifier.classify(flowCube)
+
+    dayTypes = dayTypes.set_index('Date')['ClusterGroup']
+    np.testing.assert_array_equal(dayTypes.loc[networkModel.days].to_numpy(), networkModel.labels)
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import DayTypeClustering as dtc
+import KPIsCalculation as kc
+import ReferenceImplementations as ref
+from conftest import assertSameArrays, gapKey
+
+
+# ==============================================================================================================
+#                                            CLUSTERING INDIVIDUAL KEY
+# ==============================================================================================================
+@pytest.mark.parametrize("measureType", ['Flow', 'Speed'])
+def test_similarityMatrixEqualsLoop(smoothProfiles, measureType):
+    assert gapKey in smoothProfiles[measureType]
+    for key, profiles in smoothProfiles[measureType].items():
+        expected = ref.similarityMatrix(profiles)
+        similarity = dtc.similarityMatrix(profiles)
+
+        assert list(similarity.index) == list(expected.index)
+        assertSameArrays(similarity, expected)
+        # blocks smaller than the number of profiles and single precision
+        assertSameArrays(dtc.similarityMatrixArray(profiles.values.T, blockSize=7), expected)
+        assertSameArrays(dtc.similarityMatrixArray(profiles.values.T, dtype=np.float32), expected, tolerance=1e-5)
+
+
+@pytest.mark.parametrize("numberOfWorkers", [1, 2])
+def test_IndividualDetectorClusteringResultEqualsLoop(smoothProfiles, numberOfWorkers):
+    expectedClusters, expectedCenters = ref.IndividualDetectorClusteringResult(smoothProfiles['Flow'])
+    clusters, centers = dtc.IndividualDetectorClusteringResult(smoothProfiles['Flow'], numberOfWorkers)
+
+    assert list(clusters) == list(expectedClusters) and list(centers) == list(expectedCenters)
+    for key in expectedClusters:
+        pd.testing.assert_frame_equal(clusters[key], expectedClusters[key], check_dtype=False)
+        pd.testing.assert_frame_equal(centers[key], expectedCenters[key], check_dtype=False)
+
+
+@pytest.mark.parametrize("backend", ["miniBatchKMeans", "agglomerative", "kMedoids"])
+def test_clusteringBackendsGiveMemberCenters(smoothProfiles, backend):
+    """
+    Every backend gives the asked number of clusters, numbered from 0, each having as center one of its dates
+    """
+    clusters, centers = dtc.IndividualDetectorClusteringResult(smoothProfiles['Flow'], backend=backend,
+                                                               numberOfClusters=4)
+
+    assert list(clusters) == list(smoothProfiles['Flow'])
+    for key, df in smoothProfiles['Flow'].items():
+        labels = clusters[key]['ClusterGroup'].to_numpy()
+        centerIndexes = centers[key]['ClusterCenterIndex'].to_numpy()
+        assert list(clusters[key]['Date']) == list(df.columns)
+        assert sorted(np.unique(labels)) == list(range(min(4, len(df.columns))))
+        assert list(labels[centerIndexes]) == list(range(len(centerIndexes)))
+
+
+def test_agglomerativeWithCachedDendrogram(smoothProfiles):
+    profiles = next(iter(smoothProfiles['Flow'].values())).values.T
+    linkageMatrix = dtc.profileLinkage(profiles)
+
+    for numberOfClusters in (2, 5):
+        labels, centers = dtc.clusterProfiles(profiles, "agglomerative", numberOfClusters)
+        cachedLabels, cachedCenters = dtc.clusterProfiles(profiles, "agglomerative", numberOfClusters, linkageMatrix)
+        np.testing.assert_array_equal(cachedLabels, labels)
+        np.testing.assert_array_equal(cachedCenters, centers)
+
+
+def test_clusteringBackendsReport(smoothProfiles):
+    report = dtc.clusteringBackendsReport(smoothProfiles['Flow'], 4)
+
+    assert list(report['Backend']) == ["affinityPropagation", "miniBatchKMeans", "agglomerative", "kMedoids"]
+    assert (report['Seconds'] >= 0).all()
+    assert (report.loc[report['Backend'] != "affinityPropagation", 'ClustersPerKey'] == 4).all()
+    assert (report['CenterSimilarity'] <= 1 + 1e-9).all()
+
+
+def test_unknownClusteringBackend():
+    with pytest.raises(Exception, match="CLUSTERING ERROR"):
+        dtc.clusterProfiles(np.ones((3, 4)), "spectral")
+
+
+@pytest.mark.parametrize("backend", ["affinityPropagation", "kMedoids"])
+def test_clusteringQualityTable(smoothProfiles, backend):
+    """
+    The quality of the clusters computed with them is the one of the clusters given by the clustering stage
+    """
+    clusterings = dtc.profileClusterings(smoothProfiles['Flow'], backend=backend, numberOfClusters=4)
+    clusters, centers = dtc.IndividualDetectorClusteringResult(smoothProfiles['Flow'], backend=backend,
+                                                               numberOfClusters=4)
+    qualityTable = dtc.clusteringQualityTable(smoothProfiles['Flow'], clusterings)
+
+    assert list(qualityTable['KeyID']) == list(smoothProfiles['Flow'])
+    assert qualityTable['Converged'].all()
+    for key, row in qualityTable.set_index('KeyID').iterrows():
+        labels = clusters[key]['ClusterGroup'].to_numpy()
+        centerIndexes = centers[key]['ClusterCenterIndex'].to_numpy()
+        silhouette, centerSimilarity = dtc.clusteringQuality(smoothProfiles['Flow'][key].values.T, labels,
+                                                             centerIndexes)
+        assert row['NumberOfDates'] == len(labels)
+        assert row['NumberOfClusters'] == len(centerIndexes)
+        assert row['SingleDateClusters'] == (np.bincount(labels) == 1).sum()
+        assert row['Silhouette'] == pytest.approx(silhouette, nan_ok=True)
+        assert row['CenterSimilarity'] == pytest.approx(centerSimilarity)
+
+
+# ==============================================================================================================
+#                                        CLUSTERING AT NETWORK LEVEL
+# ==============================================================================================================
+@pytest.mark.parametrize("measureType", ['Flow', 'Speed'])
+def test_networkSimilarityMatrixEqualsLoop(smoothProfiles, measureType):
+    clusters, centers = dtc.IndividualDetectorClusteringResult(smoothProfiles[measureType])
+    expected = ref.networkSimilarityMatrix(clusters)
+    similarity = dtc.networkSimilarityMatrix(clusters)
+
+    assert list(similarity.index) == sorted(expected.index)
+    assertSameArrays(similarity, expected.loc[similarity.index, similarity.columns])
+
+
+
+@pytest.fixture(scope="module")
+def flowNetworkDistance(smoothProfiles):
+    clusters, _ = dtc.IndividualDetectorClusteringResult(smoothProfiles['Flow'])
+
+    return np.asarray(dtc.networkDistanceMatrix(dtc.networkSimilarityMatrix(clusters)), dtype=np.float64)
+
+
+@pytest.mark.parametrize("numberOfWorkers", [1, 2])
+def test_selectNetworkClustersBestSilhouette(flowNetworkDistance, numberOfWorkers):
+    """
+    Each number of clusters of the range is scored and the one with the best silhouette is chosen, its KPIs being
+    the ones of its row of the score curve
+    """
+    numberOfClusters, labels, kpis, scoreCurve = dtc.selectNetworkClusters(flowNetworkDistance, 2, 6, 3,
+                                                                           numberOfWorkers)
+
+    assert list(scoreCurve['NumberOfClusters']) == [2, 3, 4, 5, 6]
+    assert scoreCurve['Selected'].sum() == 1
+    selected = scoreCurve[scoreCurve['Selected']].iloc[0]
+    assert selected['NumberOfClusters'] == numberOfClusters
+    assert selected['Silhoutte'] == scoreCurve['Silhoutte'].max()
+    assert len(labels) == len(flowNetworkDistance)
+    assert sorted(np.unique(labels)) == list(range(numberOfClusters))
+    pd.testing.assert_frame_equal(kpis, kc.NetworkKpisIntegration(flowNetworkDistance, labels))
+    assert list(selected[kpis['KPI']]) == list(kpis['Value'])
+
+    serialResult = dtc.selectNetworkClusters(flowNetworkDistance, 2, 6, 3)
+    assert serialResult[0] == numberOfClusters
+    np.testing.assert_array_equal(serialResult[1], labels)
+
+
+def test_selectNetworkClustersEmptyRange(flowNetworkDistance):
+    with pytest.raises(Exception, match="CLUSTERING ERROR"):
+        dtc.selectNetworkClusters(flowNetworkDistance, 5, 4)
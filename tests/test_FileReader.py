@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+import FileReader as fr
+import ReferenceImplementations as ref
+from conftest import assertSameArrays, gapKey, runOptions
+
+
+def assertSameInput(df, expected, tolerance=1e-9):
+    """
+    Same keys, timestamps and values (negative values being invalidated by the chunked reading)
+    """
+    assert list(df.columns) == list(expected.columns)
+    assert list(df['ID1'].astype(str)) == list(expected['ID1'])
+    assert (df['timestamp'] == expected['timestamp']).all()
+    for column in ('flow', 'speed'):
+        assertSameArrays(df[column], expected[column].mask(expected[column] < 0), tolerance)
+
+
+@pytest.mark.parametrize("memoryBudgetMB", [0, 0.05])
+def test_readInputFileEqualsWholeFile(dataFile, memoryBudgetMB):
+    """
+    With a memory budget the file is read in chunks of about a thousand rows, with values in single precision
+    """
+    argOptions = runOptions(dataFile, memoryBudgetMB=memoryBudgetMB, flowFactor=2.0)
+    df = fr.readInputFile(argOptions)
+    expected = ref.readInputFileCSV(argOptions)
+
+    assert gapKey in set(expected['ID1'])
+    assertSameInput(df, expected, 1e-6 if memoryBudgetMB else 1e-9)
+
+
+@pytest.fixture(scope="module")
+def parquetDirectory(dataFile, tmp_path_factory):
+    pytest.importorskip("pyarrow")
+    directory = str(tmp_path_factory.mktemp("parquet"))
+    fr.convertCSVToParquet(runOptions(dataFile), directory)
+
+    return directory
+
+
+@pytest.mark.parametrize("keyFilter, startDate, endDate", [("", "", ""),
+                                                           (gapKey + ",416_cloc", "2016-01-10", "2016-02-05")])
+def test_readInputFileParquetEqualsCSV(dataFile, parquetDirectory, keyFilter, startDate, endDate):
+    """
+    The Parquet dataset converted from the CSV gives the same input, also when the filters are pushed down
+    """
+    argOptions = runOptions(parquetDirectory, format="parquet", keyFilter=keyFilter, startDate=startDate,
+                            endDate=endDate)
+    df = fr.readInputFile(argOptions)
+
+    expected = ref.readInputFileCSV(runOptions(dataFile))
+    if keyFilter:
+        expected = expected[expected['ID1'].isin(keyFilter.split(",")) &
+                            (expected['timestamp'] >= startDate) &
+                            (expected['timestamp'] < pd.Timestamp(endDate) + pd.Timedelta(days=1))]
+        assert set(expected['ID1']) == set(keyFilter.split(","))
+
+    # the partitions of the dataset are read in order of month, the CSV in order of key
+    order = ['ID1', 'timestamp']
+    assertSameInput(df.sort_values(order, kind='stable').reset_index(drop=True),
+                    expected.sort_values(order, kind='stable').reset_index(drop=True))
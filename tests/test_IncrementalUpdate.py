@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import DataSmoothing as ds
+import IncrementalUpdate as iu
+import ProfileCube as pc
+from conftest import runOptions
+
+newKey = "new_cloc"
+
+
+@pytest.fixture(scope="module")
+def splitData(cleanDataframe):
+    """
+    The clean data split into the history (all but the last two dates) and the new days, which hold also a key not
+    in the history
+    """
+    lastDates = np.sort(cleanDataframe['Date'].unique())[-2:]
+    isNew = cleanDataframe['Date'].isin(lastDates)
+    history = cleanDataframe[~isNew]
+
+    newData = cleanDataframe[isNew]
+    newKeyData = newData[newData['KeyID'] == newData['KeyID'].iloc[0]].copy()
+    newKeyData['KeyID'] = newKey
+    newData = pd.concat([newData.astype({'KeyID': str}), newKeyData.astype({'KeyID': str})], ignore_index=True)
+
+    return history, newData
+
+
+@pytest.fixture
+def fittedState(splitData, argOptions):
+    history, _ = splitData
+    smoothCube = ds.smoothProfileCube(pc.buildProfileCube(history, 'flow'), argOptions)
+    state, _, _ = iu.fitState(smoothCube, None, argOptions)
+
+    return state
+
+
+def test_addNewDaysExtendsState(fittedState, splitData, argOptions):
+    """
+    The new keys and dates are appended to the state, keeping the fitted profiles, clusters and exemplars as they are
+    """
+    _, newData = splitData
+    fittedKeys = fittedState.cube.keys
+    fittedDates = fittedState.cube.dates
+    fittedValues = fittedState.cube.values.copy()
+    fittedLabels = fittedState.labels.copy()
+    fittedExemplarDates = [fittedDates[e[e >= 0]] for e in fittedState.exemplars]
+
+    assignmentsDF, networkAssignments = iu.addNewDays(fittedState, newData, 'Flow', argOptions)
+
+    cube = fittedState.cube
+    newDates = pd.Index(np.sort(newData['Date'].unique()))
+    assert list(cube.keys) == list(fittedKeys) + [newKey]
+    assert cube.dates.equals(fittedDates.append(newDates))
+    oldDates = cube.dates.get_indexer(fittedDates)
+    np.testing.assert_array_equal(cube.values[:len(fittedKeys)][:, oldDates], fittedValues)
+    np.testing.assert_array_equal(fittedState.labels[:len(fittedKeys)][:, oldDates], fittedLabels)
+    for k, exemplarDates in enumerate(fittedExemplarDates):
+        exemplars = fittedState.exemplars[k]
+        assert cube.dates[exemplars[exemplars >= 0]].equals(exemplarDates)
+
+    # one assignment per new profile, the ones of the new key have no cluster
+    assert len(assignmentsDF.index) == cube.profileExists[:, cube.dates.get_indexer(newDates)].sum()
+    newKeyAssignments = assignmentsDF[assignmentsDF['KeyID'] == newKey]
+    assert len(newKeyAssignments.index) > 0
+    assert (newKeyAssignments['ClusterGroup'] == -1).all() and newKeyAssignments['Unexplained'].all()
+    assert (fittedState.labels[cube.keys.get_loc(newKey)] == -1).all()
+    assert networkAssignments is None
+    assert fittedState.metadata["profilesSinceFit"] == len(assignmentsDF.index)
+    assert fittedState.metadata["unexplainedSinceFit"] == assignmentsDF['Unexplained'].sum()
+
+
+def test_addNewDaysReassignsFittedProfiles(fittedState, splitData, argOptions):
+    """
+    A day of the history given again is assigned to the clusters the fit has given to its profiles
+    """
+    history, _ = splitData
+    lastDate = history['Date'].max()
+    j = fittedState.cube.dates.get_loc(lastDate)
+    fittedLabels = fittedState.labels[:, j].copy()
+
+    assignmentsDF, _ = iu.addNewDays(fittedState, history[history['Date'] == lastDate], 'Flow', argOptions)
+
+    expected = fittedLabels[fittedState.cube.keys.get_indexer(assignmentsDF['KeyID'])]
+    np.testing.assert_array_equal(assignmentsDF['ClusterGroup'].to_numpy(), expected)
+    assert not assignmentsDF['Unexplained'].any()
+
+
+def test_assignNetworkDaysLeavesOutUnclusteredProfiles(splitData, argOptions):
+    """
+    The profiles without a cluster count in the similarity of the days as the missing ones: two keys both without a
+    cluster are not in the same cluster
+    """
+    history, _ = splitData
+    smoothCube = ds.smoothProfileCube(pc.buildProfileCube(history, 'flow'), argOptions)
+    state, _, _ = iu.fitState(smoothCube, None, runOptions(argOptions.inputFile, enableNetworkClustering=True,
+                                                           KmeansNumberOfFlowCluster=4))
+    unclustered = np.arange(len(state.cube.keys)) % 2 == 0
+    state.labels[unclustered] = -1
+    days = np.arange(len(state.cube.dates))
+
+    networkAssignments = iu.assignNetworkDays(state, days)
+
+    state.cube.profileExists[unclustered] = False
+    pd.testing.assert_frame_equal(networkAssignments, iu.assignNetworkDays(state, days))
+
+
+def test_stateRoundTrip(fittedState, tmp_path):
+    iu.saveState(fittedState, str(tmp_path), 'Flow')
+    loadedState = iu.loadState(str(tmp_path), 'Flow')
+
+    assert list(loadedState.cube.keys) == list(fittedState.cube.keys)
+    assert loadedState.cube.dates.equals(fittedState.cube.dates)
+    for name in ("labels", "exemplars", "similarityFloor", "networkDays", "networkCenters", "networkLabels"):
+        np.testing.assert_array_equal(getattr(loadedState, name), getattr(fittedState, name))
+    for name in ("values", "profileExists", "timeExists"):
+        np.testing.assert_array_equal(getattr(loadedState.cube, name), getattr(fittedState.cube, name))
+    assert loadedState.metadata == fittedState.metadata
+    assert iu.loadState(str(tmp_path), 'Speed') is None
+
+
+def test_stateOptionsChecked(fittedState, dataFile):
+    with pytest.raises(Exception, match="INCREMENTAL UPDATE ERROR"):
+        iu.checkStateOptions(fittedState, runOptions(dataFile, TimeResolution=30))
@@ -0,0 +1,128 @@
+import collections
+import json
+import os
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import DayTypeClustering as dtc
+import Instrumentation as ins
+import StageCache as sc
+import SummaryReports as sr
+from conftest import runOptions
+
+
+@ins.instrumented
+def outerStep(df):
+    return innerStep(df.iloc[:2])
+
+
+@ins.instrumented
+def innerStep(df):
+    return len(df.index)
+
+
+@sc.stage()
+def cachedStep(df):
+    return df.sum()
+
+
+@pytest.fixture
+def instrumentation(dataFile, tmp_path):
+    """
+    Instrumentation enabled with the results in a directory of their own, disabled again at the end of the test
+    """
+    argOptions = runOptions(dataFile, runReport='True', profileStage="", outputDirectory=str(tmp_path / "Results"))
+    ins.configure(argOptions)
+    sr.configure(argOptions)
+    yield argOptions
+    ins.configure(runOptions(dataFile))
+    sr.configure(runOptions(dataFile))
+
+
+@pytest.fixture
+def keyData():
+    return pd.DataFrame({'KeyID': ['a', 'a', 'b'], 'Date': ['2016-01-01', '2016-01-02', '2016-01-01'],
+                         'flow': [1.0, 2.0, 3.0]})
+
+
+def test_disabledInstrumentationRecordsNothing(dataFile, keyData):
+    ins.configure(runOptions(dataFile))
+
+    assert outerStep(keyData) == 2
+    assert ins.stepsTable().empty
+
+
+def test_stepsRecordedWithTheirParent(instrumentation, keyData):
+    with ins.measureScope('Flow'):
+        assert outerStep(keyData) == 2
+    outerStep(keyData)
+
+    steps = ins.stepsTable()
+    assert list(steps['Stage']) == ["innerStep", "outerStep", "innerStep", "outerStep"]
+    assert list(steps['Parent']) == ["outerStep", None, "outerStep", None]
+    assert list(steps['Depth']) == [1, 0, 1, 0]
+    assert list(steps['Measure']) == ['Flow', 'Flow', None, None]
+    assert list(steps.iloc[1][['Rows', 'Keys', 'Dates']]) == [3, 2, 2]
+    assert list(steps.iloc[0][['Rows', 'Keys', 'Dates']]) == [2, 1, 2]
+    assert (steps['WallSeconds'] >= 0).all() and (steps['CpuSeconds'] >= 0).all()
+
+
+def test_cachedStagesMarked(instrumentation, keyData, tmp_path):
+    sc.configure(runOptions(instrumentation.inputFile, cacheDirectory=str(tmp_path / "Cache"), cacheSizeMB=16))
+    try:
+        cachedStep(keyData[['flow']])
+        cachedStep(keyData[['flow']])
+    finally:
+        sc.clear()
+        sc.configure(runOptions(instrumentation.inputFile))
+
+    assert list(ins.stepsTable()['Cached']) == [False, True]
+
+
+def test_taskTimesOfEachKey(instrumentation, smoothProfiles):
+    dtc.profileClusterings(smoothProfiles['Flow'])
+
+    taskTimes = ins.taskTimesTable()
+    assert list(taskTimes['Key']) == [str(key) for key in smoothProfiles['Flow']]
+    assert (taskTimes['Stage'] == "profileClusterings").all()
+    assert (taskTimes['Seconds'] >= 0).all()
+    summary = ins.taskTimesSummary(taskTimes)
+    assert len(summary) == 1 and summary[0]["Tasks"] == len(smoothProfiles['Flow'])
+    assert summary[0]["MaxSeconds"] == pytest.approx(taskTimes['Seconds'].max())
+
+
+def test_writeRunReport(instrumentation, keyData):
+    outerStep(keyData)
+    ins.recordTaskTimes("task", np.array([0.5, 1.5]), ['a', 'b'])
+
+    ins.writeRunReport(instrumentation)
+
+    steps = pd.read_csv(os.path.join(instrumentation.outputDirectory, "Run_Report.csv"))
+    assert list(steps['Stage']) == ["innerStep", "outerStep"]
+    with open(os.path.join(instrumentation.outputDirectory, "Run_Report.json")) as reportFile:
+        report = json.load(reportFile)
+    assert [stage["Stage"] for stage in report["stages"]] == ["innerStep", "outerStep"]
+    assert report["taskTimes"][0]["SlowestKey"] == 'b'
+    assert report["options"]["runReport"] == 'True'
+
+
+def test_peakMemory():
+    assert ins.peakMemoryMB() > 0
+
+
+@pytest.mark.parametrize("fields", [("rss", "peak_wset"), ("rss",)])
+def test_peakMemoryWithPsutil(fields, monkeypatch):
+    """
+    Without the resource module the peak is read from psutil, which gives it only on Windows: elsewhere the current
+    resident memory is given
+    """
+    memoryInfo = collections.namedtuple("memoryInfo", fields)(*[(i + 1) * 1024 * 1024 for i in range(len(fields))])
+    monkeypatch.setitem(sys.modules, "resource", None)
+    monkeypatch.setitem(sys.modules, "psutil", types.SimpleNamespace(
+        Process=lambda: types.SimpleNamespace(memory_info=lambda: memoryInfo)))
+
+    assert ins.peakMemoryMB() == len(fields)
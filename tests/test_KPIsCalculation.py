@@ -0,0 +1,24 @@
+import pytest
+
+import DayTypeClustering as dtc
+import KPIsCalculation as kc
+from conftest import assertSameArrays
+
+
+@pytest.mark.parametrize("measureType, numberOfWorkers", [('Flow', 1), ('Speed', 1), ('Flow', 2)])
+def test_KPIsTableEqualsLoop(smoothProfiles, measureType, numberOfWorkers):
+    """
+    All the KPIs of all the keys at once are the ones of KPI, computed one KPI type and one date at a time
+    """
+    clusters, centers = dtc.IndividualDetectorClusteringResult(smoothProfiles[measureType])
+    table = kc.KPIsTable(smoothProfiles[measureType], clusters, centers, numberOfWorkers)
+
+    expected = [kc.KPI(smoothProfiles[measureType], clusters, centers, KPItype)
+                for KPItype in ('MAE', 'MAPE', 'MSE', 'RMSE')]
+    assert list(table['KeyID'].unique()) == list(centers)
+    for key in centers:
+        keyTable = table[table['KeyID'] == key]
+        keyExpected = kc.KPIsSummaryTable([KPIs[key] for KPIs in expected])
+
+        assert list(keyTable['ClusterGroup']) == list(keyExpected['ClusterGroup'])
+        assertSameArrays(keyTable[['MAE', 'MAPE', 'MSE', 'RMSE']], keyExpected[['MAE', 'MAPE', 'MSE', 'RMSE']])
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import DayTypeClustering as dtc
+import NetworkDayTypeModel as ndm
+
+
+@pytest.fixture(scope="module")
+def flowClusters(smoothProfiles):
+    clusters, _ = dtc.IndividualDetectorClusteringResult(smoothProfiles['Flow'])
+
+    return clusters
+
+
+def test_networkModelComputesOnDemand(flowClusters):
+    model = ndm.NetworkDayTypeModel(flowClusters, 4)
+    assert model._similarity is None and model._labels is None
+
+    labels = model.labels
+
+    assert model.similarity is model._similarity
+    assert len(labels) == len(model.days) == len(model.distance)
+    assert sorted(np.unique(labels)) == [0, 1, 2, 3]
+    assert model.centroids.shape == (4, len(model.days))
+    np.testing.assert_allclose(model.centroids[0], model.distance[labels == 0].mean(axis=0))
+    assert model.scoreCurve is None
+    assert list(model.kpis['KPI']) == ['Silhoutte', 'Calinski-Harabasz', 'Davies-Bouldin']
+    assert list(model.clusterResult['Date']) == list(model.days)
+
+
+def countedCalls(function, name, calls):
+    def wrapper(*args, **kwargs):
+        calls.append(name)
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+def test_networkModelKeepsAutomaticChoice(flowClusters, monkeypatch):
+    """
+    The automatic choice of the number of clusters runs on the distance of the model and gives the KPIs of the
+    chosen number too, which are not computed again
+    """
+    calls = []
+    for module, name in [(dtc, "networkDistanceMatrix"), (ndm.kc, "NetworkKpisIntegration")]:
+        monkeypatch.setattr(module, name, countedCalls(getattr(module, name), name, calls))
+    model = ndm.NetworkDayTypeModel(flowClusters, None, minimumClusters=2, maximumClusters=5, numberOfInits=3)
+
+    labels = model.labels
+    kpis = model.kpis
+
+    # one evaluation of each number of clusters, from 2 to 5
+    assert sorted(calls) == ["NetworkKpisIntegration"] * 4 + ["networkDistanceMatrix"]
+    selected = model.scoreCurve[model.scoreCurve['Selected']].iloc[0]
+    assert selected['NumberOfClusters'] == model.numberOfClusters == labels.max() + 1
+    assert list(kpis['KPI']) == ['Silhoutte', 'Calinski-Harabasz', 'Davies-Bouldin']
+    assert list(kpis['Value']) == list(selected[kpis['KPI']])
+
+
+@pytest.mark.parametrize("numberOfClusters", [4, None])
+def test_networkModelRoundTrip(flowClusters, numberOfClusters, tmp_path):
+    """
+    A loaded model gives the results of the saved one, without the per-key clusters
+    """
+    model = ndm.NetworkDayTypeModel(flowClusters, numberOfClusters, minimumClusters=2, maximumClusters=5,
+                                    numberOfInits=3)
+    ndm.saveNetworkModel(model, str(tmp_path), 'Flow')
+    loadedModel = ndm.loadNetworkModel(str(tmp_path), 'Flow')
+
+    assert loadedModel.sectionClusterDF is None
+    assert loadedModel.days.equals(model.days)
+    np.testing.assert_array_equal(loadedModel.similarity.to_numpy(), model.similarity.to_numpy(dtype=np.float32))
+    np.testing.assert_array_equal(loadedModel.labels, model.labels)
+    np.testing.assert_array_equal(loadedModel.centroids, model.centroids)
+    np.testing.assert_allclose(loadedModel.distance, model.distance)
+    pd.testing.assert_frame_equal(loadedModel.kpis, model.kpis)
+    if numberOfClusters is None:
+        pd.testing.assert_frame_equal(loadedModel.scoreCurve, model.scoreCurve)
+    else:
+        assert loadedModel.scoreCurve is None
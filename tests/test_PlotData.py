@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import PlotData as pld
+import ProfileCube as pc
+
+
+def test_calendarGridPlacesEachDate():
+    """
+    Each date of the year is in the cell of its weekday and week from the 1st of January, the other years are left out
+    """
+    dates = pd.to_datetime(["2015-12-31", "2016-01-01", "2016-01-04", "2016-12-31"])
+    clusterGroups = [7, 0, 1, 2]
+
+    grid, hoverText, weekLabels = pld.calendarGrid(dates, clusterGroups, 2016)
+
+    # the 1st of January 2016 is a Friday, the 31st of December a Saturday
+    assert grid.shape == (7, 53) and len(weekLabels) == 53
+    assert grid[4, 0] == 0 and grid[0, 1] == 1 and grid[5, 52] == 2
+    assert np.isnan(grid).sum() == 7 * 53 - 3
+    assert hoverText[4, 0] == "2016-01-01" and hoverText[0, 0] == "" and hoverText[5, 52] == "2016-12-31"
+    assert weekLabels[0] == "January-week_1" and weekLabels[52] == "December-week_53"
+
+
+def test_calendarGridSelectedCluster():
+    dates = pd.date_range("2017-03-01", periods=6, freq='D')
+
+    grid, _, _ = pld.calendarGrid(dates, [0, 1, 1, 2, 1, 0], 2017, selectedCluster=1)
+
+    assert sorted(grid[~np.isnan(grid)]) == [-1, -1, -1, 1, 1, 1]
+
+
+@pytest.fixture(scope="module")
+def flowCube(cleanDataframe):
+    return pc.buildProfileCube(cleanDataframe, 'flow')
+
+
+def test_profileArrays(flowCube):
+    key = flowCube.keys[0]
+    keyFrame = flowCube.keyFrame(key)
+    dates = keyFrame.columns[[3, 0, 5]]
+
+    np.testing.assert_array_equal(pld.keyProfileArray(keyFrame, dates), keyFrame[dates].to_numpy())
+    np.testing.assert_array_equal(pld.cubeProfileArray(flowCube, key, dates),
+                                  np.column_stack([flowCube.profile(key, date).to_numpy() for date in dates]))
+
+
+def test_boxPlotData():
+    x, y = pld.boxPlotData([0, 1], np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]))
+
+    assert list(x) == [0, 0, 0, 1, 1, 1]
+    assert list(y) == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+
+
+@pytest.mark.parametrize("upper", [None, 80.0])
+def test_histogramDataEqualsWholeArray(upper):
+    """
+    The counts computed a chunk at a time are the ones of the whole array between 0 and its maximum or the upper
+    value, the missing and negative values being left out and the ones above the upper value counted only in the total
+    """
+    values = np.random.default_rng(0).normal(50.0, 30.0, 1000)
+    values[::7] = np.nan
+    valid = values[values >= 0]
+
+    counts, edges, total = pld.histogramData(values, upper, chunkSize=64)
+
+    expectedCounts, expectedEdges = np.histogram(valid, bins=pld.fineBins,
+                                                 range=(0.0, valid.max() if upper is None else upper))
+    np.testing.assert_array_equal(edges, expectedEdges)
+    np.testing.assert_array_equal(counts, expectedCounts)
+    assert total == len(valid)
+    if upper is None:
+        assert counts.sum() == total
+
+
+def test_histogramDataWithoutValidValues():
+    counts, edges, total = pld.histogramData(np.array([np.nan, -1.0]))
+
+    assert total == 0 and counts.sum() == 0
+    assert edges[0] == 0.0 and edges[-1] == 1.0
+
+
+def test_mergedHistograms():
+    values = np.random.default_rng(1).uniform(0.0, 1.0, 500)
+    counts, edges, total = pld.histogramData(values, 0.5)
+
+    rebinnedCounts, rebinnedEdges = pld.rebinHistogram(counts, edges, 20)
+
+    assert len(rebinnedCounts) == 20 and rebinnedCounts.sum() == (values <= 0.5).sum()
+    np.testing.assert_array_equal(rebinnedEdges, edges[::9])
+    assert (pld.densityHistogram(rebinnedCounts, rebinnedEdges, total) * np.diff(rebinnedEdges)).sum() == \
+        pytest.approx((values <= 0.5).mean())
+    assert pld.cumulativeHistogram(rebinnedCounts, total)[-1] == pytest.approx((values <= 0.5).mean())
+    with pytest.raises(Exception, match="HISTOGRAM ERROR"):
+        pld.rebinHistogram(counts, edges, 7)
+
+
+def test_heatmapDataBinnedWithinLimit():
+    """
+    A large heatmap is binned into the means of its blocks, a small one is kept as it is
+    """
+    values = np.arange(30 * 50, dtype=float).reshape(30, 50)
+    values[0, :4] = np.nan
+    heatmap = pd.DataFrame(values, index=[f"key{i}" for i in range(30)],
+                           columns=pd.date_range("2016-01-01", periods=50, freq='D'))
+
+    means, rowLabels, columnLabels, hoverText = pld.heatmapData(heatmap, 200)
+
+    rowFactor, columnFactor = pld.decimationFactors(30, 50, 200)
+    assert means.size <= 200 and means.shape == hoverText.shape
+    assert means[0, 0] == pytest.approx(np.nanmean(values[:rowFactor, :columnFactor]))
+    assert rowLabels[1] == f"key{rowFactor}"
+    assert columnLabels[0] == "2016-01-01"
+    assert hoverText[0, 0].startswith(f"key0 - key{rowFactor - 1}<br>2016-01-01 - ")
+
+    fullValues, _, _, _ = pld.heatmapData(heatmap, 30 * 50)
+    np.testing.assert_array_equal(fullValues, values)
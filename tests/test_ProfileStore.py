@@ -0,0 +1,66 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import DataSmoothing as ds
+import ProfileCube as pc
+import StageCache as sc
+from conftest import assertSameArrays, runOptions
+
+
+@pytest.fixture(scope="module")
+def flowCube(cleanDataframe):
+    return pc.buildProfileCube(cleanDataframe, 'flow')
+
+
+@pytest.fixture
+def storeOptions(dataFile, tmp_path):
+    return runOptions(dataFile, profileStoreDirectory=str(tmp_path / "Profiles"))
+
+
+def test_storedProfilesEqualInMemory(flowCube, storeOptions, smoothProfiles):
+    """
+    The stored profiles are the ones smoothed in memory (in single precision), with the dates and time buckets of
+    each key
+    """
+    storedProfiles = ds.smoothDataframe(flowCube, storeOptions)
+
+    assert list(storedProfiles) == list(smoothProfiles['Flow'])
+    for key, df in smoothProfiles['Flow'].items():
+        assert storedProfiles[key].index.equals(df.index)
+        assert storedProfiles[key].columns.equals(df.columns)
+        assertSameArrays(storedProfiles[key], df, tolerance=1e-5)
+
+
+def test_storeWrittenOnce(flowCube, storeOptions):
+    ds.smoothDataframe(flowCube, storeOptions)
+    files = sorted(os.listdir(storeOptions.profileStoreDirectory))
+    modificationTimes = [os.stat(os.path.join(storeOptions.profileStoreDirectory, f)).st_mtime_ns for f in files]
+
+    storedProfiles = ds.storedSmoothProfiles(flowCube, storeOptions)
+
+    assert len(files) == 2 and not any(f.endswith(".tmp") for f in files)
+    assert sorted(os.listdir(storeOptions.profileStoreDirectory)) == files
+    assert [os.stat(os.path.join(storeOptions.profileStoreDirectory, f)).st_mtime_ns for f in files] == \
+        modificationTimes
+    assert storedProfiles.array.dtype == np.float32
+
+    # another smoothing is another store
+    storeOptions.smoothingKernelPercentage = 2 * storeOptions.smoothingKernelPercentage
+    ds.storedSmoothProfiles(flowCube, storeOptions)
+    assert len(os.listdir(storeOptions.profileStoreDirectory)) == 4
+
+
+def test_storePicklesItsLocation(flowCube, storeOptions):
+    storedProfiles = ds.storedSmoothProfiles(flowCube, storeOptions)
+
+    pickled = pickle.dumps(storedProfiles)
+    loadedProfiles = pickle.loads(pickled)
+
+    assert len(pickled) < 1024
+    assert list(loadedProfiles) == list(storedProfiles)
+    key = next(iter(storedProfiles))
+    assertSameArrays(loadedProfiles[key], storedProfiles[key])
+    assert sc.contentDigest(loadedProfiles) == sc.contentDigest(storedProfiles)
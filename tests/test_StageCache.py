@@ -0,0 +1,156 @@
+import os
+import shutil
+import weakref
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import FileReader as fr
+import StageCache as sc
+from conftest import runOptions
+
+# stages computed by the tests, in order
+computed = []
+
+
+@sc.stage(options=("smoothingKernelPercentage",), ignore=("numberOfWorkers",))
+def scaledProfiles(profiles, argOptions, numberOfWorkers=1):
+    computed.append("scaledProfiles")
+    return profiles * argOptions.smoothingKernelPercentage
+
+
+@sc.stage()
+def profileTotals(profiles):
+    computed.append("profileTotals")
+    return profiles.sum(axis=0)
+
+
+@pytest.fixture
+def cacheOptions(dataFile, tmp_path):
+    """
+    Options of a persistent cache in a directory of its own, disabled again at the end of the test
+    """
+    argOptions = runOptions(dataFile, cacheDirectory=str(tmp_path / "Cache"), cacheSizeMB=16)
+    sc.configure(argOptions)
+    computed.clear()
+    yield argOptions
+    sc.clear()
+    sc.configure(runOptions(dataFile))
+
+
+def cacheEntries(argOptions):
+    return sorted(fileName for fileName in os.listdir(argOptions.cacheDirectory) if fileName.endswith(".pkl"))
+
+
+@pytest.fixture
+def profiles():
+    return pd.DataFrame(np.random.default_rng(0).uniform(0, 100, (96, 20)))
+
+
+def test_stageReusesCachedResults(cacheOptions, profiles):
+    """
+    The same inputs (also when they are other objects with the same content) and options give the cached result,
+    whatever the ignored arguments
+    """
+    result = scaledProfiles(profiles, cacheOptions)
+    cachedResult = scaledProfiles(profiles.copy(), cacheOptions, numberOfWorkers=4)
+
+    assert computed == ["scaledProfiles"]
+    pd.testing.assert_frame_equal(cachedResult, result)
+    assert len(cacheEntries(cacheOptions)) == 1
+
+
+def test_optionInvalidatesDownstreamStages(cacheOptions, profiles):
+    percentage = cacheOptions.smoothingKernelPercentage
+    profileTotals(scaledProfiles(profiles, cacheOptions))
+
+    cacheOptions.smoothingKernelPercentage = 2 * percentage
+    profileTotals(scaledProfiles(profiles, cacheOptions))
+    assert computed == ["scaledProfiles", "profileTotals"] * 2
+
+    # the previous option gives back the cached results of both stages
+    cacheOptions.smoothingKernelPercentage = percentage
+    totals = profileTotals(scaledProfiles(profiles, cacheOptions))
+    assert computed == ["scaledProfiles", "profileTotals"] * 2
+    pd.testing.assert_series_equal(totals, (profiles * percentage).sum(axis=0))
+
+
+def test_lineageIdentifiesStageResults(cacheOptions, profiles):
+    """
+    A result of a stage is identified by its stage key, another object by the digest of its content
+    """
+    result = scaledProfiles(profiles, cacheOptions)
+
+    assert sc.argumentDigest(result).startswith("scaledProfiles-")
+    assert sc.argumentDigest(result.copy()) == sc.contentDigest(result)
+
+
+@sc.stage()
+def splitProfiles(profiles):
+    return profiles.iloc[:48], {"second": profiles.iloc[48:], "cap": 1.0}
+
+
+def test_lineageKeepsNoResultAlive(cacheOptions, profiles):
+    """
+    The items of tuple and dictionary results are identified by their stage key while alive, and freed when dropped
+    """
+    first, rest = splitProfiles(profiles)
+    firstKey = sc.argumentDigest(first)
+
+    assert firstKey.startswith("splitProfiles-") and firstKey.endswith("/0")
+    assert sc.argumentDigest(rest).endswith("/1")
+
+    references = [weakref.ref(first), weakref.ref(rest["second"])]
+    del first, rest
+    assert [reference() for reference in references] == [None, None]
+
+
+def test_inputFileChangeInvalidatesReading(cacheOptions, dataFile, tmp_path):
+    inputFile = str(tmp_path / "input.csv")
+    shutil.copy(dataFile, inputFile)
+    cacheOptions.inputFile = inputFile
+
+    fr.readInputFile(cacheOptions)
+    fr.readInputFile(cacheOptions)
+    assert len(cacheEntries(cacheOptions)) == 1
+
+    modificationTime = os.stat(inputFile).st_mtime + 10
+    os.utime(inputFile, (modificationTime, modificationTime))
+    fr.readInputFile(cacheOptions)
+    assert len(cacheEntries(cacheOptions)) == 2
+
+
+def test_evictionKeepsCacheWithinBudget(cacheOptions, dataFile):
+    """
+    The least recently used entries are deleted beyond the size budget
+    """
+    sc.configure(runOptions(dataFile, cacheDirectory=cacheOptions.cacheDirectory, cacheSizeMB=0.1))
+    for i in range(10):
+        scaledProfiles(pd.DataFrame(np.full((2000, 2), float(i))), cacheOptions)
+
+    entries = cacheEntries(cacheOptions)
+    assert 0 < len(entries) < 10
+    assert sum(os.path.getsize(os.path.join(cacheOptions.cacheDirectory, entry)) for entry in entries) <= 0.1 * 2 ** 20
+
+    # the last result is still cached
+    scaledProfiles(pd.DataFrame(np.full((2000, 2), 9.0)), cacheOptions)
+    assert computed == ["scaledProfiles"] * 10
+
+
+def test_optionsFingerprint(dataFile, tmp_path):
+    """
+    The fingerprint of a configuration changes with the options changing the results and with the input file
+    """
+    inputFile = str(tmp_path / "input.csv")
+    shutil.copy(dataFile, inputFile)
+    argOptions = runOptions(inputFile)
+    fingerprint = sc.optionsFingerprint(argOptions, ("numberOfWorkers",))
+
+    assert sc.optionsFingerprint(runOptions(inputFile, numberOfWorkers=4), ("numberOfWorkers",)) == fingerprint
+    assert sc.optionsFingerprint(runOptions(inputFile, smoothingKernelPercentage=20.0),
+                                 ("numberOfWorkers",)) != fingerprint
+
+    modificationTime = os.stat(inputFile).st_mtime + 10
+    os.utime(inputFile, (modificationTime, modificationTime))
+    assert sc.optionsFingerprint(argOptions, ("numberOfWorkers",)) != fingerprint
@@ -0,0 +1,81 @@
+import os
+
+import pandas as pd
+import pytest
+
+import DayTypeClustering as dtc
+import ReferenceImplementations as ref
+import SummaryReports as sr
+from conftest import runOptions
+
+
+@pytest.fixture(scope="module")
+def flowClusters(smoothProfiles):
+    clusters, _ = dtc.IndividualDetectorClusteringResult(smoothProfiles['Flow'])
+
+    return clusters
+
+
+@pytest.fixture
+def writerOptions(dataFile, tmp_path):
+    """
+    Options writing the results into a directory of their own, set back to the default ones at the end of the test
+    """
+    yield lambda **options: sr.configure(runOptions(dataFile, outputDirectory=str(tmp_path / "Results"), **options))
+    sr.configure(runOptions(dataFile))
+
+
+def test_DetectorClusterSummaryEqualsLoop(flowClusters, writerOptions, tmp_path):
+    """
+    The table of the per-key clusters is written as the first version of the tool did, byte by byte
+    """
+    writerOptions()
+    path = sr.writeTable(sr.DetectorClusterSummary(flowClusters), "summary")
+    ref.DetectorClusterSummaryCSV(flowClusters, str(tmp_path / "expected.csv"))
+
+    with open(path, 'rb') as summary, open(tmp_path / "expected.csv", 'rb') as expected:
+        assert summary.read() == expected.read()
+
+
+def test_NetworkClusterSummaryEqualsLoop(flowClusters, writerOptions, tmp_path):
+    networkSimilarity = dtc.networkSimilarityMatrix(flowClusters)
+    clusterResult, _ = dtc.clusteringNetworkData(networkSimilarity, 4)
+
+    writerOptions()
+    path = sr.writeTable(sr.NetworkClusterSummary(clusterResult), "summary")
+    ref.NetworkClusterSummaryCSV(clusterResult, str(tmp_path / "expected.csv"))
+
+    with open(path, 'rb') as summary, open(tmp_path / "expected.csv", 'rb') as expected:
+        assert summary.read() == expected.read()
+
+
+def test_writeTableCSV(flowClusters, writerOptions):
+    writerOptions(outputFormat="csv")
+    table = sr.DetectorClusterSummary(flowClusters)
+
+    path = sr.writeTable(table, "Individual_Cluster_Results")
+
+    assert path == os.path.join(sr._outputDirectory, "Individual_Cluster_Results.csv")
+    pd.testing.assert_frame_equal(pd.read_csv(path, parse_dates=["Date"]), table, check_dtype=False)
+    assert list(sr.writeReport().iloc[-1][['Table', 'Path', 'Rows']]) == ["Individual_Cluster_Results", path,
+                                                                          len(table.index)]
+
+
+@pytest.mark.parametrize("partitionByKey", ['False', 'True'])
+def test_writeTableParquet(flowClusters, writerOptions, partitionByKey):
+    pytest.importorskip("pyarrow")
+    writerOptions(outputFormat="parquet", partitionByKey=partitionByKey)
+    table = sr.DetectorClusterSummary(flowClusters)
+
+    path = sr.writeTable(table, "Individual_Cluster_Results")
+
+    written = pd.read_parquet(path)
+    if partitionByKey == 'True':
+        # a folder for each key, the key being read back as a category
+        assert sorted(os.listdir(path)) == sorted("KeyID=" + str(key) for key in flowClusters)
+        written = written.assign(KeyID=written['KeyID'].astype(str))[list(table.columns)]
+        written = written.sort_values(['KeyID', 'Date']).reset_index(drop=True)
+        table = table.assign(KeyID=table['KeyID'].astype(str)).sort_values(['KeyID', 'Date']).reset_index(drop=True)
+    else:
+        assert path.endswith("Individual_Cluster_Results.parquet")
+    pd.testing.assert_frame_equal(written, table, check_dtype=False)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+import FileReader as fr
+import SyntheticData as sd
+from conftest import runOptions
+
+
+def test_generateDetectorDataDeterministic():
+    data = sd.generateDetectorData(3, 10, seed=1)
+
+    pd.testing.assert_frame_equal(sd.generateDetectorData(3, 10, seed=1), data)
+    assert not data.equals(sd.generateDetectorData(3, 10, seed=2))
+
+
+def test_generateDetectorDataLayout():
+    """
+    A row for each key, day and time bucket, with the asked rates of missing values and outliers
+    """
+    data = sd.generateDetectorData(5, 28, TimeResolution=30, missingRate=0.1, missingDayRate=0.0, outlierRate=0.01)
+
+    assert list(data.columns) == ['clock_id', 'time_stamp', 'flow', 'speed']
+    assert len(data.index) == 5 * 28 * 48
+    assert data['clock_id'].nunique() == 5
+    assert data['time_stamp'].min() == pd.Timestamp("2016-01-01")
+    assert data['time_stamp'].max() == pd.Timestamp("2016-01-28 23:30")
+    assert abs(data['flow'].isna().mean() - 0.1) < 0.02
+    assert np.array_equal(data['flow'].isna(), data['speed'].isna())
+    assert (data['speed'].dropna() >= 5.0).all()
+
+    # working days have more flow than Sundays
+    flow = data.groupby(data['time_stamp'].dt.dayofweek)['flow'].median()
+    assert flow[2] > flow[6]
+
+
+def test_writtenDataReadAsSampleData(tmp_path):
+    data = sd.generateDetectorData(2, 3)
+    fileName = str(tmp_path / "synthetic.csv")
+    sd.writeDetectorData(data, fileName)
+
+    df = fr.readInputFile(runOptions(fileName))
+
+    assert len(df.index) == len(data.index)
+    np.testing.assert_array_equal(df.iloc[:, 2].to_numpy(dtype=float), data['flow'].to_numpy())